@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import heapq
+import json
+from bisect import bisect_right
+from itertools import chain, islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Collection, Iterator, NamedTuple
+
+from .bucket_index import iter_bucket_lines
+from .core import CoreSnapshot
+from .metrics import AGGREGATE_LINES_SCANNED, Counter
+from .segments import ACTIVE_NAME, MANIFEST_NAME, LogReader, row_ts
+
+if TYPE_CHECKING:
+    from .compaction import AggregateSnapshot
+
+
+class Row(NamedTuple):
+    """One stored line, tagged with its source and merge key.
+
+    `end` is the byte offset just past the line in its source file, i.e.
+    where a reader resumes after emitting this row.
+    """
+
+    ts: int
+    source: str
+    line: bytes
+    end: int
+
+
+def json_source(source: str) -> bytes:
+    return json.dumps(source, ensure_ascii=False).encode("utf-8")
+
+
+def tag_raw_line(source: bytes, line: bytes) -> bytes:
+    """Inject `"source": <source>` into a stored compact JSON object line.
+
+    Stored lines are written compact by this service, so the common case is a
+    byte splice. Anything that does not look like a compact object goes
+    through json.loads so malformed data still fails loudly.
+    """
+    body = line.rstrip(b"\r\n")
+    if body[:1] == b"{" and body[-1:] == b"}":
+        if body == b"{}":
+            return b'{"source":' + source + b"}"
+        return b'{"source":' + source + b"," + body[1:]
+    row = {"source": json.loads(source), **json.loads(body)}
+    return json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def iter_core_rows(core_file: Path, start: int = 0, snapshot: CoreSnapshot | None = None) -> Iterator[Row]:
+    """Core rows from byte offset `start`, served from `snapshot` when one is given."""
+    source = json_source("core")
+    scanned = 0
+    try:
+        if snapshot is not None:
+            first = bisect_right(snapshot.ends, start)
+            for i in range(first, len(snapshot.lines)):
+                scanned += 1
+                yield Row(0, "core", tag_raw_line(source, snapshot.lines[i]), snapshot.ends[i])
+            return
+        if not core_file.exists():
+            return
+        with core_file.open("rb") as f:
+            f.seek(start)
+            pos = start
+            for line in f:
+                pos += len(line)
+                if line.strip():
+                    scanned += 1
+                    yield Row(0, "core", tag_raw_line(source, line), pos)
+    finally:
+        AGGREGATE_LINES_SCANNED.inc(scanned, labels=("core",))
+
+
+class PayloadMatch(NamedTuple):
+    """One `where=payload.<key>:<value>` clause: top-level payload key equality.
+
+    `value` is compared as a string, and also as the JSON literal it spells
+    (`3`, `true`, `null`, ...). `needles` are the raw encodings of those
+    values; a stored line containing none of them, or not the key, cannot
+    match and is rejected before it is decoded.
+    """
+
+    key: str
+    values: tuple[object, ...]
+    key_needle: bytes
+    needles: tuple[bytes, ...]
+
+    @staticmethod
+    def parse(expr: str) -> "PayloadMatch":
+        field, sep, raw = expr.partition(":")
+        if not sep or not field.startswith("payload.") or len(field) == len("payload."):
+            raise ValueError("where must look like payload.<key>:<value>")
+        key = field[len("payload.") :]
+        values: list[object] = [raw]
+        try:
+            literal = json.loads(raw)
+        except ValueError:
+            pass
+        else:
+            if literal is None or isinstance(literal, (bool, int, float)):
+                values.append(literal)
+        needles: set[bytes] = set()
+        for value in values:
+            # Lines written by this service use ensure_ascii=False; older ones may not.
+            needles.add(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+            needles.add(json.dumps(value).encode("ascii"))
+        return PayloadMatch(
+            key=key,
+            values=tuple(values),
+            key_needle=json.dumps(key, ensure_ascii=False).encode("utf-8"),
+            needles=tuple(needles),
+        )
+
+    def may_match(self, line: bytes) -> bool:
+        return self.key_needle in line and any(needle in line for needle in self.needles)
+
+    def matches(self, payload: dict) -> bool:
+        if self.key not in payload:
+            return False
+        actual = payload[self.key]
+        # bool is an int subclass; keep `true` from matching 1.
+        if isinstance(actual, bool):
+            return any(value is actual for value in self.values)
+        return any(not isinstance(value, bool) and actual == value for value in self.values)
+
+
+def line_matches(line: bytes, where: tuple[PayloadMatch, ...]) -> bool:
+    """Whether a stored line satisfies every clause, decoding it only if the raw bytes might."""
+    if not all(clause.may_match(line) for clause in where):
+        return False
+    try:
+        payload = json.loads(line).get("payload")
+    except (ValueError, AttributeError):
+        return False
+    return isinstance(payload, dict) and all(clause.matches(payload) for clause in where)
+
+
+def _iter_log_lines(ns_dir: Path, start: int, *, since: int | None, until: int | None) -> Iterator[tuple[bytes, int]]:
+    with LogReader(ns_dir) as log:
+        yield from log.iter_lines(start, since=since, until=until)
+
+
+def iter_namespace_rows(
+    namespace: str,
+    ns_dir: Path,
+    start: int = 0,
+    *,
+    since: int | None = None,
+    until: int | None = None,
+    s_buckets: Collection[str] | None = None,
+    where: tuple[PayloadMatch, ...] = (),
+    scan_counter: Counter = AGGREGATE_LINES_SCANNED,
+) -> Iterator[Row]:
+    """Rows of one namespace from logical offset `start`, across all its segments.
+
+    `since`/`until` (inclusive, unix seconds) skip non-overlapping sealed
+    segments unopened and drop rows outside the window. `s_buckets` keeps
+    only rows in those buckets, read through the s_bucket index. `where`
+    clauses are checked on the raw line before anything is decoded. Lines
+    read are counted on `scan_counter`.
+    """
+    name = f"agent:{namespace}"
+    source = json_source(name)
+    windowed = since is not None or until is not None
+    if s_buckets is not None:
+        lines = iter_bucket_lines(ns_dir, s_buckets, start, since=since, until=until)
+    else:
+        lines = _iter_log_lines(ns_dir, start, since=since, until=until)
+    scanned = 0
+    try:
+        for line, end in lines:
+            scanned += 1
+            ts = row_ts(line)
+            if windowed and ((since is not None and ts < since) or (until is not None and ts > until)):
+                continue
+            if where and not line_matches(line, where):
+                continue
+            yield Row(ts, name, tag_raw_line(source, line), end)
+    finally:
+        scan_counter.inc(scanned, labels=("namespace",))
+
+
+def namespace_logs(agents_root: Path) -> list[tuple[str, Path]]:
+    """(namespace, namespace dir) for every namespace with a log, sorted by name.
+
+    Sorting gives a host-independent order.
+    """
+    if not agents_root.exists():
+        return []
+    out: list[tuple[str, Path]] = []
+    for ns_dir in agents_root.iterdir():
+        if (ns_dir / ACTIVE_NAME).is_file() or (ns_dir / MANIFEST_NAME).is_file():
+            out.append((ns_dir.name, ns_dir))
+    out.sort()
+    return out
+
+
+def merge_namespace_rows(
+    agents_root: Path,
+    *,
+    per_namespace: int | None = None,
+    offsets: dict[str, int] | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    s_buckets: Collection[str] | None = None,
+    namespaces: Collection[str] | None = None,
+    where: tuple[PayloadMatch, ...] = (),
+    scan_counter: Counter = AGGREGATE_LINES_SCANNED,
+) -> Iterator[Row]:
+    """Every namespace log merged into one `ts`-ordered stream.
+
+    Each namespace log is append-ordered by `ts`, so a heapq k-way merge
+    yields a global time order while holding one pending row per namespace.
+    Ties keep namespace-name order, which makes the output deterministic.
+    Namespaces outside `namespaces` are not opened at all.
+    """
+    offsets = offsets or {}
+    streams: list[Iterator[Row]] = []
+    for namespace, ns_dir in namespace_logs(agents_root):
+        if namespaces is not None and namespace not in namespaces:
+            continue
+        start = offsets.get(f"agent:{namespace}", 0)
+        rows = iter_namespace_rows(
+            namespace,
+            ns_dir,
+            start,
+            since=since,
+            until=until,
+            s_buckets=s_buckets,
+            where=where,
+            scan_counter=scan_counter,
+        )
+        streams.append(islice(rows, per_namespace) if per_namespace is not None else rows)
+    return heapq.merge(*streams, key=lambda row: row.ts)
+
+
+def includes_core(
+    sources: Collection[str] | None,
+    *,
+    since: int | None = None,
+    until: int | None = None,
+    s_buckets: Collection[str] | None = None,
+    where: tuple[PayloadMatch, ...] = (),
+) -> bool:
+    """Whether an aggregate read with these filters can return core rows.
+
+    Core rows have no `ts`, bucket or payload, so any of those filters rules
+    them out, whatever `sources` lists.
+    """
+    if since is not None or until is not None or s_buckets is not None or where:
+        return False
+    return sources is None or "core" in sources
+
+
+def offsets_at_line_starts(core_file: Path, agents_root: Path, offsets: dict[str, int]) -> bool:
+    """Whether every offset of a client-supplied cursor points at the start of a line.
+
+    A cursor is only base64 JSON, so an edited offset could land mid-line;
+    reading from there would hand a partial line to `tag_raw_line`.
+    """
+    logs: dict[str, Path] | None = None
+    for source, offset in offsets.items():
+        if offset == 0:
+            continue
+        if source == "core":
+            try:
+                with core_file.open("rb") as f:
+                    f.seek(offset - 1)
+                    # Past the end is fine: there is simply nothing left to read.
+                    if f.read(1) not in (b"\n", b""):
+                        return False
+            except FileNotFoundError:
+                continue
+        elif source.startswith("agent:"):
+            if logs is None:
+                logs = dict(namespace_logs(agents_root))
+            ns_dir = logs.get(source[len("agent:") :])
+            if ns_dir is None:
+                continue
+            with LogReader(ns_dir) as log:
+                if not log.at_line_start(offset):
+                    return False
+    return True
+
+
+def iter_aggregate(
+    core_file: Path,
+    agents_root: Path,
+    *,
+    limit: int,
+    per_namespace: int | None = None,
+    offsets: dict[str, int] | None = None,
+    since: int | None = None,
+    until: int | None = None,
+    s_buckets: Collection[str] | None = None,
+    sources: Collection[str] | None = None,
+    where: tuple[PayloadMatch, ...] = (),
+    core_snapshot: CoreSnapshot | None = None,
+    namespace_snapshot: "AggregateSnapshot | None" = None,
+) -> Iterator[Row]:
+    """Core rows, then all namespaces merged by `ts` (see `merge_namespace_rows`).
+
+    `per_namespace` caps how many rows any single namespace contributes.
+    `offsets` maps a source ("core", "agent:<ns>") to the (logical) byte
+    offset to resume reading it from; see `advance_offsets`. Core rows come
+    from `core_snapshot` instead of the file when it is given. `sources`, if
+    given, limits the output to those sources. Filters combine with AND,
+    and the core has no `ts`, `s_bucket` or `payload`, so `since`/`until`,
+    `s_buckets` or `where` always leave core rows out (see `includes_core`).
+
+    With `namespace_snapshot` (see compaction.py), namespace rows come from
+    it plus the logs appended since, unless `sources` or `s_buckets` narrow
+    the read to a few logs or their indexes anyway.
+    """
+    offsets = offsets or {}
+    namespaces = None
+    if sources is not None:
+        namespaces = {source[len("agent:") :] for source in sources if source.startswith("agent:")}
+    if namespace_snapshot is not None and namespaces is None and s_buckets is None:
+        merged = namespace_snapshot.merge_namespace_rows(
+            agents_root, per_namespace=per_namespace, offsets=offsets, since=since, until=until, where=where
+        )
+    else:
+        merged = merge_namespace_rows(
+            agents_root,
+            per_namespace=per_namespace,
+            offsets=offsets,
+            since=since,
+            until=until,
+            s_buckets=s_buckets,
+            namespaces=namespaces,
+            where=where,
+        )
+    if not includes_core(sources, since=since, until=until, s_buckets=s_buckets, where=where):
+        yield from islice(merged, limit)
+        return
+    core = iter_core_rows(core_file, offsets.get("core", 0), core_snapshot)
+    yield from islice(chain(core, merged), limit)
+
+
+def advance_offsets(offsets: dict[str, int] | None, rows: list[Row]) -> dict[str, int]:
+    """Resume offsets after `rows` were delivered (sources not seen keep theirs)."""
+    out = dict(offsets or {})
+    for row in rows:
+        out[row.source] = row.end
+    return out
@@ -1,16 +1,47 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import binascii
 import hashlib
 import hmac
 import json
+import math
 import os
 import time
-from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any
-
-from fastapi import Depends, FastAPI, Header, HTTPException, Request
-from pydantic import BaseModel, Field
+from typing import Any, AsyncIterator, Iterator
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+from .aggregate import PayloadMatch, Row, advance_offsets, includes_core, iter_aggregate, offsets_at_line_starts
+from .compaction import AggregateCompactor, AggregateSnapshotStore
+from .compression import CODECS
+from .core import (
+    CoreDigestCache,
+    CoreLineIndexStore,
+    CoreSnapshot,
+    CoreSnapshotStore,
+    compact_json_line,
+)
+from .metrics import (
+    AGGREGATE_LINES_RETURNED,
+    BYTES_WRITTEN,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    HMAC_VERIFY_SECONDS,
+    LINES_WRITTEN,
+    REGISTRY,
+    MultiProcessMetrics,
+    RequestTimingMiddleware,
+)
+from .ratelimit import RateLimit, RateLimited, WriteAdmission
+from .segments import SegmentMaintainer, SegmentPolicy
+from .tail import TailHub
+from .writer import FSYNC_POLICIES, GroupCommitWriter
 
 
 def _repo_root_from_here() -> Path:
@@ -18,14 +49,6 @@ def _repo_root_from_here() -> Path:
     return Path(__file__).resolve().parents[1]
 
 
-def sha256_file(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
 def _parse_json_mapping(env_value: str, *, name: str) -> dict[str, str]:
     try:
         raw = json.loads(env_value)
@@ -53,6 +76,16 @@ def _env_int(name: str, default: int) -> int:
         raise ValueError(f"{name} must be an integer") from e
 
 
+def _env_float(name: str, default: float) -> float:
+    val = os.environ.get(name)
+    if val is None:
+        return default
+    try:
+        return float(val)
+    except ValueError as e:
+        raise ValueError(f"{name} must be a number") from e
+
+
 @dataclass(frozen=True)
 class IsolationApiSettings:
     """Runtime settings for the Isolation API.
@@ -69,6 +102,46 @@ class IsolationApiSettings:
     hmac_secrets_by_namespace: dict[str, str]
     require_hmac: bool
     hmac_max_skew_seconds: int
+    # 0 disables the background re-hash of the core file.
+    core_reverify_interval_seconds: int = 0
+    # Largest core kept in memory for reads (0 = always read from disk).
+    core_snapshot_max_bytes: int = 256 * 1024 * 1024
+    # Group-commit writer: "none" | "batch" | "interval" (see writer.py).
+    fsync_policy: str = "none"
+    fsync_interval_ms: int = 50
+    max_open_files: int = 256
+    max_batch_entries: int = 10_000
+    tail_poll_interval_ms: int = 250
+    # Namespace log segmentation; see segments.SegmentPolicy (0 / None = off).
+    segment_max_bytes: int = 0
+    segment_max_age_seconds: int = 0
+    segment_retention_seconds: int = 0
+    segment_compress_after_seconds: int | None = None
+    segment_compress_codec: str = "gzip"
+    segment_maintenance_interval_seconds: int = 60
+    # Maintain the per-namespace s_bucket index on append (see bucket_index.py).
+    s_bucket_index: bool = True
+    # Per-namespace write admission (see ratelimit.py); 0 disables each limit.
+    rate_limit_per_second: float = 0.0
+    rate_limit_burst: int = 0
+    # namespace -> "<rate>" or "<rate>/<burst>", overriding the default above.
+    rate_limits_by_namespace: dict[str, str] = field(default_factory=dict)
+    max_inflight_writes: int = 1024
+    # Per-worker metric snapshots are shared here (default: <data_dir>/metrics).
+    metrics_dir: Path | None = None
+    metrics_flush_interval_ms: int = 1000
+    # Rebuild the merged namespace snapshot under <data_dir>/aggregate this often (0 = off).
+    aggregate_snapshot_interval_seconds: int = 0
+
+    @property
+    def segment_policy(self) -> SegmentPolicy:
+        return SegmentPolicy(
+            max_bytes=self.segment_max_bytes,
+            max_age_seconds=self.segment_max_age_seconds,
+            retention_seconds=self.segment_retention_seconds,
+            compress_after_seconds=self.segment_compress_after_seconds,
+            compress_codec=self.segment_compress_codec,
+        )
 
     @staticmethod
     def from_env(repo_root: Path | None = None) -> "IsolationApiSettings":
@@ -89,6 +162,40 @@ class IsolationApiSettings:
 
         require_hmac = _env_bool("ISOLATION_API_REQUIRE_HMAC", default=False)
         hmac_max_skew_seconds = _env_int("ISOLATION_API_HMAC_MAX_SKEW_SECONDS", default=300)
+        core_reverify_interval_seconds = _env_int("ISOLATION_API_CORE_REVERIFY_SECONDS", default=0)
+        core_snapshot_max_bytes = _env_int("ISOLATION_API_CORE_SNAPSHOT_MAX_BYTES", default=256 * 1024 * 1024)
+
+        fsync_policy = os.environ.get("ISOLATION_API_FSYNC_POLICY", "none").strip().lower()
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"ISOLATION_API_FSYNC_POLICY must be one of {', '.join(FSYNC_POLICIES)}")
+        fsync_interval_ms = _env_int("ISOLATION_API_FSYNC_INTERVAL_MS", default=50)
+        max_open_files = _env_int("ISOLATION_API_MAX_OPEN_FILES", default=256)
+        max_batch_entries = _env_int("ISOLATION_API_MAX_BATCH_ENTRIES", default=10_000)
+        tail_poll_interval_ms = _env_int("ISOLATION_API_TAIL_POLL_MS", default=250)
+
+        segment_max_bytes = _env_int("ISOLATION_API_SEGMENT_MAX_BYTES", default=0)
+        segment_max_age_seconds = _env_int("ISOLATION_API_SEGMENT_MAX_AGE_SECONDS", default=0)
+        segment_retention_seconds = _env_int("ISOLATION_API_SEGMENT_RETENTION_SECONDS", default=0)
+        segment_compress_after_seconds = (
+            _env_int("ISOLATION_API_SEGMENT_COMPRESS_AFTER_SECONDS", default=0)
+            if os.environ.get("ISOLATION_API_SEGMENT_COMPRESS_AFTER_SECONDS") is not None
+            else None
+        )
+        segment_compress_codec = os.environ.get("ISOLATION_API_SEGMENT_COMPRESS_CODEC", "gzip").strip().lower()
+        if segment_compress_codec not in CODECS:
+            raise ValueError(f"ISOLATION_API_SEGMENT_COMPRESS_CODEC must be one of {', '.join(CODECS)}")
+        segment_maintenance_interval_seconds = _env_int("ISOLATION_API_SEGMENT_MAINTENANCE_SECONDS", default=60)
+        s_bucket_index = _env_bool("ISOLATION_API_S_BUCKET_INDEX", default=True)
+        rate_limit_per_second = _env_float("ISOLATION_API_RATE_LIMIT_PER_SECOND", default=0.0)
+        rate_limit_burst = _env_int("ISOLATION_API_RATE_LIMIT_BURST", default=0)
+        rate_limits_by_namespace = _parse_json_mapping(
+            os.environ.get("ISOLATION_API_RATE_LIMITS", "{}"), name="ISOLATION_API_RATE_LIMITS"
+        )
+        max_inflight_writes = _env_int("ISOLATION_API_MAX_INFLIGHT_WRITES", default=1024)
+        metrics_dir_env = os.environ.get("ISOLATION_API_METRICS_DIR")
+        metrics_dir = Path(metrics_dir_env).resolve() if metrics_dir_env else None
+        metrics_flush_interval_ms = _env_int("ISOLATION_API_METRICS_FLUSH_MS", default=1000)
+        aggregate_snapshot_interval_seconds = _env_int("ISOLATION_API_AGGREGATE_SNAPSHOT_SECONDS", default=0)
 
         return IsolationApiSettings(
             data_dir=data_dir,
@@ -98,6 +205,27 @@ class IsolationApiSettings:
             hmac_secrets_by_namespace=hmac_secrets_by_namespace,
             require_hmac=require_hmac,
             hmac_max_skew_seconds=hmac_max_skew_seconds,
+            core_reverify_interval_seconds=core_reverify_interval_seconds,
+            core_snapshot_max_bytes=core_snapshot_max_bytes,
+            fsync_policy=fsync_policy,
+            fsync_interval_ms=fsync_interval_ms,
+            max_open_files=max_open_files,
+            max_batch_entries=max_batch_entries,
+            tail_poll_interval_ms=tail_poll_interval_ms,
+            segment_max_bytes=segment_max_bytes,
+            segment_max_age_seconds=segment_max_age_seconds,
+            segment_retention_seconds=segment_retention_seconds,
+            segment_compress_after_seconds=segment_compress_after_seconds,
+            segment_compress_codec=segment_compress_codec,
+            segment_maintenance_interval_seconds=segment_maintenance_interval_seconds,
+            s_bucket_index=s_bucket_index,
+            rate_limit_per_second=rate_limit_per_second,
+            rate_limit_burst=rate_limit_burst,
+            rate_limits_by_namespace=rate_limits_by_namespace,
+            max_inflight_writes=max_inflight_writes,
+            metrics_dir=metrics_dir,
+            metrics_flush_interval_ms=metrics_flush_interval_ms,
+            aggregate_snapshot_interval_seconds=aggregate_snapshot_interval_seconds,
         )
 
 
@@ -106,6 +234,26 @@ class Entry(BaseModel):
     payload: dict[str, Any]
 
 
+def _write_admission(settings: IsolationApiSettings) -> WriteAdmission:
+    """Build (and validate, at startup) the per-namespace write limits.
+
+    Rate buckets are kept under `<data dir>/ratelimit` so all workers share them.
+    """
+    default = None
+    if settings.rate_limit_per_second > 0:
+        burst = settings.rate_limit_burst or max(1, math.ceil(settings.rate_limit_per_second))
+        default = RateLimit.parse(f"{settings.rate_limit_per_second}/{burst}")
+    overrides = {
+        namespace: RateLimit.parse(spec) for namespace, spec in settings.rate_limits_by_namespace.items()
+    }
+    return WriteAdmission(
+        default=default,
+        overrides=overrides,
+        max_inflight=settings.max_inflight_writes,
+        state_dir=settings.data_dir / "ratelimit",
+    )
+
+
 @dataclass(frozen=True)
 class PartnerContext:
     token: str
@@ -118,17 +266,141 @@ def _read_pinned_sha256(core_sha_file: Path) -> str:
     return core_sha_file.read_text(encoding="utf-8").strip().split()[0]
 
 
+def _encode_cursor(state: dict[str, Any]) -> str:
+    raw = json.dumps(state, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+    if not isinstance(state, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return state
+
+
 def _agents_root(settings: IsolationApiSettings) -> Path:
     return settings.data_dir / "agents"
 
 
+def _raw_json_response(items_key: str, items: list[bytes], meta: dict[str, Any]) -> Response:
+    """Build `{"<items_key>": [...raw items...], **meta}` without decoding the items."""
+    head = b'{"' + items_key.encode("ascii") + b'":[' + b",".join(items) + b"]"
+    tail = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    body = head + (b"," + tail[1:] if meta else b"}")
+    return Response(content=body, media_type="application/json")
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _aggregate_offsets(cursor: str) -> dict[str, int]:
+    state = _decode_cursor(cursor)
+    offsets = state.get("offsets")
+    if state.get("v") != 1 or not isinstance(offsets, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for offset in offsets.values():
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offsets
+
+
+def _aggregate_sources(namespaces: list[str] | None, sources: list[str] | None) -> set[str] | None:
+    """Union of `?source=` and `?namespace=` filters; None means every source."""
+    if namespaces is None and sources is None:
+        return None
+    out = {f"agent:{ns}" for ns in namespaces or ()}
+    for source in sources or ():
+        if source != "core" and not (source.startswith("agent:") and len(source) > len("agent:")):
+            raise HTTPException(status_code=400, detail="source must be 'core' or 'agent:<namespace>'")
+        out.add(source)
+    return out
+
+
+def _ndjson_with_cursor(rows: Iterator[Row], limit: int, offsets: dict[str, int], *, trailer: bool) -> Iterator[bytes]:
+    """NDJSON rows, then a final `{"next_cursor": ...}` line for resuming.
+
+    The trailer is sent when `trailer` is set or when rows were cut off at
+    `limit`, so a truncated stream is never mistaken for a complete one.
+    """
+    resume = dict(offsets)
+    has_more = False
+    sent = 0
+    try:
+        for row in rows:
+            if sent >= limit:
+                has_more = True
+                break
+            resume[row.source] = row.end
+            sent += 1
+            yield row.line + b"\n"
+    finally:
+        AGGREGATE_LINES_RETURNED.inc(sent)
+    if trailer or has_more:
+        tail = {"next_cursor": _encode_cursor({"v": 1, "offsets": resume}), "has_more": has_more}
+        yield json.dumps(tail, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+# Seconds between SSE keepalive comments when no rows arrive.
+_TAIL_HEARTBEAT_SECONDS = 15.0
+
+
+def _wants_ndjson(request: Request, stream: bool) -> bool:
+    return stream or "application/x-ndjson" in request.headers.get("accept", "")
+
+
 def _namespace_dir(settings: IsolationApiSettings, namespace: str) -> Path:
     # Defense-in-depth: keep namespaces as simple directory names.
-    if "/" in namespace or "\\" in namespace or namespace in {".", ".."}:
-        raise HTTPException(status_code=500, detail="Invalid namespace configuration")
+    if not namespace or "/" in namespace or "\\" in namespace or "\0" in namespace or namespace in {".", ".."}:
+        raise ValueError(f"Invalid namespace configuration: {namespace!r}")
     return _agents_root(settings) / namespace
 
 
+def _namespace_log_table(settings: IsolationApiSettings) -> dict[str, Path]:
+    """Resolve and validate every bound namespace's log path once, at startup.
+
+    Raises ValueError on the first misconfigured namespace so the app refuses
+    to start instead of failing individual writes.
+    """
+    agents_root = _agents_root(settings).resolve()
+    core_dir_resolved = settings.core_file.parent.resolve()
+
+    table: dict[str, Path] = {}
+    for namespace in sorted(set(settings.token_to_namespace.values())):
+        agent_dir = _namespace_dir(settings, namespace)
+        out_file = (agent_dir / "entries.jsonl").resolve()
+
+        # Defense-in-depth: ensure writes are inside the bound namespace directory,
+        # inside the global agents root, and never inside the core directory.
+        try:
+            out_file.relative_to(agent_dir.resolve())
+        except ValueError as e:
+            raise ValueError(f"Write path misconfigured for {namespace!r} (outside namespace dir)") from e
+
+        try:
+            out_file.relative_to(agents_root)
+        except ValueError as e:
+            raise ValueError(f"Write path misconfigured for {namespace!r} (outside agents root)") from e
+
+        try:
+            out_file.relative_to(core_dir_resolved)
+        except ValueError:
+            pass
+        else:
+            raise ValueError(f"Write path misconfigured for {namespace!r} (core overlap)")
+
+        table[namespace] = out_file
+    return table
+
+
 async def _require_partner(
     request: Request,
     authorization: str = Header(...),
@@ -163,9 +435,11 @@ async def _require_partner(
             raise HTTPException(status_code=401, detail="X-Timestamp outside allowed skew")
 
         body = await request.body()
-        msg = f"{ts}.".encode("utf-8") + body
-        expected = hmac.new(secret.encode("utf-8"), msg=msg, digestmod=hashlib.sha256).hexdigest()
-        if not hmac.compare_digest(expected, x_signature):
+        with HMAC_VERIFY_SECONDS.time():
+            msg = f"{ts}.".encode("utf-8") + body
+            expected = hmac.new(secret.encode("utf-8"), msg=msg, digestmod=hashlib.sha256).hexdigest()
+            valid = hmac.compare_digest(expected, x_signature)
+        if not valid:
             raise HTTPException(status_code=401, detail="Invalid X-Signature")
 
         request.state.hmac_timestamp = ts
@@ -176,124 +450,397 @@ async def _require_partner(
     return PartnerContext(token=token, namespace=namespace, hmac_verified=hmac_verified)
 
 
+_ENTRY_LIST = TypeAdapter(list[Entry])
+
+
+def _entry_record(entry: Entry, partner: PartnerContext, request: Request, *, ts: int) -> dict[str, Any]:
+    record: dict[str, Any] = {
+        "ts": ts,
+        "namespace": partner.namespace,
+        "s_bucket": entry.s_bucket,
+        "payload": entry.payload,
+    }
+
+    if partner.hmac_verified:
+        record["hmac"] = {
+            "alg": getattr(request.state, "hmac_alg", "HMAC-SHA256"),
+            "timestamp": getattr(request.state, "hmac_timestamp", None),
+            "signature": getattr(request.state, "hmac_signature", None),
+        }
+    return record
+
+
+def _encode_record(record: dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _parse_batch_body(body: bytes) -> list[Any]:
+    """Decode a batch body: either one JSON array or NDJSON (one entry per line)."""
+    stripped = body.strip()
+    try:
+        if stripped.startswith(b"["):
+            items = json.loads(stripped)
+        else:
+            items = [json.loads(line) for line in stripped.splitlines() if line.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Batch body must be a JSON array or NDJSON") from None
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a JSON array or NDJSON")
+    return items
+
+
 def create_app(settings: IsolationApiSettings | None = None) -> FastAPI:
     settings = settings or IsolationApiSettings.from_env()
-    app = FastAPI(title="Isolation API", version="1.0.0")
+    # Settings are frozen, so this table lives exactly as long as the app.
+    namespace_logs = _namespace_log_table(settings)
+    admission = _write_admission(settings)
+    core_digest = CoreDigestCache(settings.core_file)
+    writer = GroupCommitWriter(
+        fsync_policy=settings.fsync_policy,
+        fsync_interval_ms=settings.fsync_interval_ms,
+        max_open_files=settings.max_open_files,
+        segment_policy=settings.segment_policy,
+        index_buckets=settings.s_bucket_index,
+    )
+    segment_maintainer = SegmentMaintainer(
+        _agents_root(settings), settings.segment_policy, settings.segment_maintenance_interval_seconds
+    )
+    compactor = AggregateCompactor(
+        _agents_root(settings), settings.data_dir / "aggregate", settings.aggregate_snapshot_interval_seconds
+    )
+    namespace_snapshot = AggregateSnapshotStore(settings.data_dir / "aggregate")
+    tail_hub = TailHub(_agents_root(settings), poll_interval_ms=settings.tail_poll_interval_ms)
+    metrics = MultiProcessMetrics(
+        REGISTRY,
+        settings.metrics_dir or settings.data_dir / "metrics",
+        flush_interval_ms=settings.metrics_flush_interval_ms,
+    )
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        core_digest.start_reverifier(settings.core_reverify_interval_seconds)
+        segment_maintainer.start()
+        compactor.start()
+        metrics.start()
+        try:
+            yield
+        finally:
+            core_digest.stop_reverifier()
+            segment_maintainer.stop()
+            compactor.stop()
+            await writer.aclose()
+            admission.close()
+            metrics.stop()
+
+    app = FastAPI(title="Isolation API", version="1.0.0", lifespan=lifespan)
+    app.add_middleware(RequestTimingMiddleware)
     app.state.settings = settings
+    app.state.core_digest = core_digest
+    app.state.writer = writer
+    app.state.namespace_logs = namespace_logs
+    app.state.tail_hub = tail_hub
+    app.state.admission = admission
+    core_line_index = CoreLineIndexStore(settings.core_file, settings.data_dir / "index")
+    core_snapshot = CoreSnapshotStore(settings.core_file, settings.core_snapshot_max_bytes)
+
+    def _pinned_core_sha256() -> str:
+        if not settings.core_file.exists() or not settings.core_sha_file.exists():
+            raise HTTPException(status_code=500, detail="Core not initialized")
+        pinned = _read_pinned_sha256(settings.core_sha_file)
+        if core_digest.digest().sha256 != pinned:
+            raise HTTPException(status_code=500, detail="Core does not match pinned hash")
+        return pinned
+
+    def _aggregate_core_snapshot() -> CoreSnapshot | None:
+        """The in-memory core for aggregation, or None to read the file as before."""
+        try:
+            pinned = _read_pinned_sha256(settings.core_sha_file)
+            if core_digest.digest().sha256 != pinned:
+                return None
+            return core_snapshot.get(pinned)
+        except OSError:
+            return None
 
     @app.get("/v1/health")
     def health() -> dict[str, Any]:
         return {"ok": True}
 
+    @app.get("/v1/metrics", response_model=None)
+    def metrics_endpoint() -> Response:
+        return Response(content=metrics.collect(), media_type=METRICS_CONTENT_TYPE)
+
     @app.get("/v1/core/hash")
     def core_hash() -> dict[str, Any]:
         if not settings.core_file.exists() or not settings.core_sha_file.exists():
             raise HTTPException(status_code=500, detail="Core not initialized")
 
         pinned = _read_pinned_sha256(settings.core_sha_file)
-        current = sha256_file(settings.core_file)
+        current = core_digest.digest()
         return {
-            "core_sha256_current": current,
+            "core_sha256_current": current.sha256,
             "core_sha256_pinned": pinned,
-            "matches": pinned == current,
+            "matches": pinned == current.sha256,
+            "from_cache": current.from_cache,
+            "verified_at": current.verified_at,
         }
 
-    @app.get("/v1/core/read")
-    def core_read(limit: int = 200) -> dict[str, Any]:
-        if not settings.core_file.exists():
-            raise HTTPException(status_code=500, detail="Core not initialized")
+    @app.get("/v1/core/read", response_model=None)
+    def core_read(
+        limit: int = 200,
+        offset: int = 0,
+        cursor: str | None = None,
+        if_none_match: str | None = Header(None, alias="If-None-Match"),
+    ) -> Response:
         if limit < 1 or limit > 10_000:
             raise HTTPException(status_code=400, detail="limit out of range")
+        pinned = _pinned_core_sha256()
+        # The core behind a pinned hash never changes, so neither does any page of it.
+        etag = f'"{pinned}"'
+        if if_none_match is not None and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        if cursor is not None:
+            state = _decode_cursor(cursor)
+            if state.get("core") != pinned[:16] or not isinstance(state.get("offset"), int):
+                raise HTTPException(status_code=400, detail="Cursor does not match the pinned core")
+            offset = state["offset"]
+        if offset < 0:
+            raise HTTPException(status_code=400, detail="offset out of range")
+
+        snapshot = core_snapshot.get(pinned)
+        if snapshot is not None:
+            total = len(snapshot.lines)
+            start = min(offset, total)
+            stop = min(start + limit, total)
+            out = list(snapshot.lines[start:stop])
+        else:
+            index = core_line_index.get(pinned)
+            total = len(index)
+            start = min(offset, total)
+            stop = min(start + limit, total)
+            out = []
+            if stop > start:
+                begin = index.offset(start)
+                with settings.core_file.open("rb") as f:
+                    f.seek(begin)
+                    blob = f.read(index.offset(stop) - begin)
+                out = [compact_json_line(line) for line in blob.splitlines() if line.strip()]
+
+        next_cursor = _encode_cursor({"core": pinned[:16], "offset": stop}) if stop < total else None
+        response = _raw_json_response(
+            "items", out, {"limit": limit, "offset": start, "total": total, "next_cursor": next_cursor}
+        )
+        response.headers["ETag"] = etag
+        return response
 
-        out: list[dict[str, Any]] = []
-        with settings.core_file.open("r", encoding="utf-8") as f:
-            for i, line in enumerate(f):
-                if i >= limit:
-                    break
-                out.append(json.loads(line))
-        return {"items": out, "limit": limit}
+    def _bound_log_file(namespace: str) -> Path:
+        try:
+            return namespace_logs[namespace]
+        except KeyError:
+            raise HTTPException(status_code=500, detail="Invalid namespace configuration") from None
+
+    @asynccontextmanager
+    async def _admitted(namespace: str, cost: int) -> AsyncIterator[None]:
+        try:
+            if admission.blocks(namespace):
+                # Shared buckets wait on a file lock other workers may hold; keep that off the event loop.
+                await asyncio.to_thread(admission.acquire, namespace, cost)
+            else:
+                admission.acquire(namespace, cost)
+        except RateLimited as e:
+            retry_after = str(max(1, math.ceil(e.retry_after)))
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": retry_after}) from None
+        try:
+            yield
+        finally:
+            admission.release(namespace)
 
     @app.post("/v1/agent/entries")
     async def write_entry(entry: Entry, request: Request, partner: PartnerContext = Depends(_require_partner)) -> dict[str, Any]:
-        agent_dir = _namespace_dir(settings, partner.namespace)
-        agent_dir.mkdir(parents=True, exist_ok=True)
+        out_file = _bound_log_file(partner.namespace)
+        record = _entry_record(entry, partner, request, ts=int(time.time()))
+        line = _encode_record(record)
+        async with _admitted(partner.namespace, 1):
+            await writer.append(out_file, line)
+        LINES_WRITTEN.inc(labels=(partner.namespace,))
+        BYTES_WRITTEN.inc(len(line), labels=(partner.namespace,))
+        tail_hub.wake()
+        return {"ok": True, "namespace": partner.namespace}
 
-        record: dict[str, Any] = {
-            "ts": int(time.time()),
+    @app.post("/v1/agent/entries:batch")
+    async def write_entries_batch(request: Request, partner: PartnerContext = Depends(_require_partner)) -> dict[str, Any]:
+        # _require_partner already verified X-Signature over this exact body.
+        raw_items = _parse_batch_body(await request.body())
+        if not raw_items:
+            raise HTTPException(status_code=400, detail="Empty batch")
+        if len(raw_items) > settings.max_batch_entries:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {settings.max_batch_entries} entries")
+
+        entries: list[Entry | None]
+        errors: dict[int, str] = {}
+        try:
+            entries = list(_ENTRY_LIST.validate_python(raw_items))
+        except ValidationError as e:
+            entries = [None] * len(raw_items)
+            for err in e.errors(include_url=False):
+                loc = err["loc"]
+                idx = loc[0] if loc and isinstance(loc[0], int) else -1
+                where = ".".join(str(part) for part in loc[1:])
+                errors.setdefault(idx, f"{where}: {err['msg']}" if where else err["msg"])
+            for idx, raw in enumerate(raw_items):
+                if idx not in errors:
+                    entries[idx] = Entry.model_validate(raw)
+
+        ts = int(time.time())
+        results: list[dict[str, Any]] = []
+        lines: list[bytes] = []
+        for idx, entry in enumerate(entries):
+            if entry is None:
+                results.append({"index": idx, "ok": False, "error": errors.get(idx, "invalid entry")})
+                continue
+            record = _entry_record(entry, partner, request, ts=ts)
+            if "hmac" in record:
+                record["hmac"]["batch_index"] = idx
+            lines.append(_encode_record(record))
+            results.append({"index": idx, "ok": True})
+
+        if lines:
+            data = b"".join(lines)
+            async with _admitted(partner.namespace, len(lines)):
+                await writer.append(_bound_log_file(partner.namespace), data)
+            LINES_WRITTEN.inc(len(lines), labels=(partner.namespace,))
+            BYTES_WRITTEN.inc(len(data), labels=(partner.namespace,))
+            tail_hub.wake()
+
+        return {
+            "ok": not errors,
             "namespace": partner.namespace,
-            "s_bucket": entry.s_bucket,
-            "payload": entry.payload,
+            "accepted": len(lines),
+            "rejected": len(raw_items) - len(lines),
+            "results": results,
         }
 
-        if partner.hmac_verified:
-            record["hmac"] = {
-                "alg": getattr(request.state, "hmac_alg", "HMAC-SHA256"),
-                "timestamp": getattr(request.state, "hmac_timestamp", None),
-                "signature": getattr(request.state, "hmac_signature", None),
-            }
-
-        out_file = (agent_dir / "entries.jsonl").resolve()
-        agent_dir_resolved = agent_dir.resolve()
-        agents_root = _agents_root(settings).resolve()
-        core_dir_resolved = settings.core_file.parent.resolve()
-
-        # Defense-in-depth: ensure writes are inside the bound namespace directory,
-        # inside the global agents root, and never inside the core directory.
-        try:
-            out_file.relative_to(agent_dir_resolved)
-        except ValueError as e:
-            raise HTTPException(status_code=500, detail="Write path misconfigured (outside namespace dir)") from e
-
+    @app.get("/v1/aggregate", response_model=None)
+    def aggregate(
+        request: Request,
+        limit: int = 10_000,
+        per_namespace: int | None = None,
+        cursor: str | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        s_bucket: list[str] | None = Query(None),
+        namespace: list[str] | None = Query(None),
+        source: list[str] | None = Query(None),
+        where: list[str] | None = Query(None),
+        stream: bool = False,
+    ) -> Response:
+        if limit < 1 or limit > 200_000:
+            raise HTTPException(status_code=400, detail="limit out of range")
+        if per_namespace is not None and per_namespace < 1:
+            raise HTTPException(status_code=400, detail="per_namespace out of range")
+        offsets = _aggregate_offsets(cursor) if cursor else {}
+        if not offsets_at_line_starts(settings.core_file, _agents_root(settings), offsets):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        sources = _aggregate_sources(namespace, source)
         try:
-            out_file.relative_to(agents_root)
+            clauses = tuple(PayloadMatch.parse(expr) for expr in where or ())
         except ValueError as e:
-            raise HTTPException(status_code=500, detail="Write path misconfigured (outside agents root)") from e
-
-        try:
-            out_file.relative_to(core_dir_resolved)
-        except ValueError:
-            pass
-        else:
-            raise HTTPException(status_code=500, detail="Write path misconfigured (core overlap)")
-
-        with out_file.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
-
-        return {"ok": True, "namespace": partner.namespace}
+            raise HTTPException(status_code=400, detail=str(e)) from None
+
+        include_core = includes_core(sources, since=since, until=until, s_buckets=s_bucket, where=clauses)
+        rows = iter_aggregate(
+            settings.core_file,
+            _agents_root(settings),
+            limit=limit + 1,
+            per_namespace=per_namespace,
+            offsets=offsets,
+            since=since,
+            until=until,
+            s_buckets=s_bucket,
+            sources=sources,
+            where=clauses,
+            # Only load (and verify) the core when this query can return core rows.
+            core_snapshot=_aggregate_core_snapshot() if include_core else None,
+            namespace_snapshot=namespace_snapshot.get() if settings.aggregate_snapshot_interval_seconds > 0 else None,
+        )
+        if _wants_ndjson(request, stream):
+            return StreamingResponse(
+                _ndjson_with_cursor(rows, limit, offsets, trailer=cursor is not None),
+                media_type="application/x-ndjson",
+            )
+
+        page = list(rows)
+        has_more = len(page) > limit
+        del page[limit:]
+        AGGREGATE_LINES_RETURNED.inc(len(page))
+        next_cursor = _encode_cursor({"v": 1, "offsets": advance_offsets(offsets, page)})
+        return _raw_json_response(
+            "items",
+            [row.line for row in page],
+            {"count": len(page), "limit": limit, "next_cursor": next_cursor, "has_more": has_more},
+        )
 
-    @app.get("/v1/aggregate")
-    def aggregate(limit: int = 10_000) -> dict[str, Any]:
-        if limit < 1 or limit > 200_000:
+    @app.get("/v1/aggregate/tail", response_model=None)
+    async def aggregate_tail(
+        request: Request,
+        cursor: str | None = None,
+        mode: str = "sse",
+        timeout: float = 25.0,
+        limit: int = 1000,
+        max_events: int | None = None,
+        last_event_id: str | None = Header(None, alias="Last-Event-ID"),
+    ) -> Response:
+        if mode not in {"sse", "poll"}:
+            raise HTTPException(status_code=400, detail="mode must be 'sse' or 'poll'")
+        if limit < 1 or limit > 10_000:
             raise HTTPException(status_code=400, detail="limit out of range")
-
-        items: list[dict[str, Any]] = []
-
-        # core (read-only)
-        if settings.core_file.exists():
-            with settings.core_file.open("r", encoding="utf-8") as f:
-                for line in f:
-                    if len(items) >= limit:
-                        break
-                    items.append({"source": "core", **json.loads(line)})
-
-        # agents (append-only logs per namespace)
-        agents_root = _agents_root(settings)
-        if agents_root.exists():
-            for ns_dir in agents_root.iterdir():
-                if not ns_dir.is_dir():
-                    continue
-                p = ns_dir / "entries.jsonl"
-                if not p.exists() or not p.is_file():
-                    continue
-                with p.open("r", encoding="utf-8") as f:
-                    for line in f:
-                        if len(items) >= limit:
-                            break
-                        items.append({"source": f"agent:{ns_dir.name}", **json.loads(line)})
-                if len(items) >= limit:
-                    break
-
-        return {"count": len(items), "items": items, "limit": limit}
+        if timeout < 0 or timeout > 60:
+            raise HTTPException(status_code=400, detail="timeout out of range")
+        if max_events is not None and max_events < 1:
+            raise HTTPException(status_code=400, detail="max_events out of range")
+        token = cursor or last_event_id
+        offsets = _aggregate_offsets(token) if token else None
+        if offsets and not await asyncio.to_thread(
+            offsets_at_line_starts, settings.core_file, _agents_root(settings), offsets
+        ):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        sub = await tail_hub.subscribe(offsets)
+        if mode == "poll":
+            try:
+                rows = await tail_hub.next_rows(sub, timeout=timeout, limit=limit)
+            finally:
+                tail_hub.unsubscribe(sub)
+            return _raw_json_response(
+                "items",
+                [row.line for row in rows],
+                {"count": len(rows), "next_cursor": _encode_cursor({"v": 1, "offsets": sub.offsets})},
+            )
+
+        async def events() -> AsyncIterator[bytes]:
+            resume = dict(sub.offsets)
+            sent = 0
+            try:
+                yield b"retry: 3000\n\n"
+                while not await request.is_disconnected():
+                    rows = await tail_hub.next_rows(sub, timeout=_TAIL_HEARTBEAT_SECONDS, limit=limit)
+                    if not rows:
+                        yield b": keepalive\n\n"
+                        continue
+                    for row in rows:
+                        resume[row.source] = row.end
+                        event_id = _encode_cursor({"v": 1, "offsets": resume}).encode("ascii")
+                        yield b"id: " + event_id + b"\nevent: entry\ndata: " + row.line + b"\n\n"
+                        sent += 1
+                        if max_events is not None and sent >= max_events:
+                            return
+            finally:
+                tail_hub.unsubscribe(sub)
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     return app
 
@@ -0,0 +1,442 @@
+"""Load-test harness for the FastAPI isolation API and the stdlib isolation_proof server.
+
+Run from the repo root, e.g.:
+
+    python -m isolation_api.bench --core-rows 1000,1000000 --namespaces 8 \\
+        --concurrency 32 --requests 5000 --out bench.json
+
+Each (server, HMAC, core size) combination gets a fresh data directory and a
+server subprocess on localhost, then runs the write, aggregate and core-read
+workloads in that order. Results (throughput, latency percentiles, peak RSS
+of the server process tree during that workload) go to a JSON file meant to
+be diffed across commits. Data generation is seeded, so runs are reproducible.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+SERVERS = ("fastapi", "stdlib")
+WORKLOADS = ("write", "aggregate", "core_read")
+
+
+def _repo_root() -> Path:
+    return Path(__file__).resolve().parents[1]
+
+
+def generate_core(path: Path, rows: int, *, seed: int = 0) -> str:
+    """Write a synthetic core with `rows` S1..S7 records; returns its sha256."""
+    rng = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    predicates = ("has_vulnerability", "patched_in", "affected_versions", "depends_on", "maintained_by")
+    h = hashlib.sha256()
+    with path.open("wb") as f:
+        chunk: list[str] = []
+        for i in range(1, rows + 1):
+            record = {
+                "S1": f"CORE-{i:08d}",
+                "S2": f"vendor{rng.randrange(1000)}.pkg{rng.randrange(100)}",
+                "S3": predicates[rng.randrange(len(predicates))],
+                "S4": f"v{rng.randrange(10)}.{rng.randrange(100)}.{rng.randrange(100)}",
+                "S5": "vendor_advisory",
+                "S6": f"2025-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T00:00:00Z",
+                "S7": "Synthetic benchmark record.",
+            }
+            chunk.append(json.dumps(record, separators=(",", ":")))
+            if len(chunk) >= 10_000:
+                data = ("\n".join(chunk) + "\n").encode("utf-8")
+                f.write(data)
+                h.update(data)
+                chunk = []
+        if chunk:
+            data = ("\n".join(chunk) + "\n").encode("utf-8")
+            f.write(data)
+            h.update(data)
+    sha = h.hexdigest()
+    path.with_suffix(".sha256").write_text(f"{sha}  {path.name}\n", encoding="utf-8")
+    return sha
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending list (0.0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), math.ceil(pct / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict[str, Any]:
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)  # noqa: E731
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": ms(percentile(ordered, 50)),
+            "p95": ms(percentile(ordered, 95)),
+            "p99": ms(percentile(ordered, 99)),
+            "max": ms(ordered[-1]) if ordered else 0.0,
+            "mean": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        },
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _tree_pids(pid: int) -> list[int]:
+    pids = [pid]
+    for current in pids:
+        for children in Path(f"/proc/{current}/task").glob("*/children"):
+            try:
+                pids.extend(int(child) for child in children.read_text().split())
+            except OSError:
+                continue
+    return pids
+
+
+def peak_rss_bytes(pid: int) -> int | None:
+    """Sum of VmHWM over a process tree (Linux only; None elsewhere)."""
+    total = 0
+    found = False
+    for p in _tree_pids(pid):
+        try:
+            status = Path(f"/proc/{p}/status").read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith("VmHWM:"):
+                total += int(line.split()[1]) * 1024
+                found = True
+    return total if found else None
+
+
+def reset_peak_rss(pid: int) -> bool:
+    """Reset VmHWM to the current RSS for a process tree (Linux clear_refs "5").
+
+    False if any process could not be reset, in which case a later
+    `peak_rss_bytes` would include earlier workloads.
+    """
+    ok = True
+    for p in _tree_pids(pid):
+        try:
+            Path(f"/proc/{p}/clear_refs").write_text("5")
+        except OSError:
+            ok = False
+    return ok
+
+
+@dataclass(frozen=True)
+class Scenario:
+    server: str
+    hmac: bool
+    core_rows: int
+    namespaces: int
+    concurrency: int
+    requests: int
+    workers: int
+
+
+class Target:
+    """A running server plus how to build each workload's requests for it."""
+
+    def __init__(self, scenario: Scenario, root: Path, core_file: Path) -> None:
+        self.scenario = scenario
+        self.root = root
+        self.core_file = core_file
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.namespaces = [f"partner_{i:03d}" for i in range(scenario.namespaces)]
+        self.tokens = {ns: f"token-{ns}" for ns in self.namespaces}
+        self.secrets = {ns: f"secret-{ns}" for ns in self.namespaces}
+        self.proc: subprocess.Popen[bytes] | None = None
+
+    def start(self) -> None:
+        data_dir = self.root / "data"
+        env = dict(os.environ, PYTHONPATH=str(_repo_root()))
+        if self.scenario.server == "fastapi":
+            env.update(
+                ISOLATION_API_DATA_DIR=str(data_dir),
+                ISOLATION_API_CORE_FILE=str(self.core_file),
+                ISOLATION_API_CORE_SHA_FILE=str(self.core_file.with_suffix(".sha256")),
+                ISOLATION_API_TOKENS=json.dumps({t: ns for ns, t in self.tokens.items()}),
+                ISOLATION_API_REQUIRE_HMAC="1" if self.scenario.hmac else "0",
+                ISOLATION_API_HMAC_SECRETS=json.dumps(self.secrets),
+            )
+            cmd = [
+                sys.executable, "-m", "uvicorn", "isolation_api.app:app",
+                "--host", "127.0.0.1", "--port", str(self.port),
+                "--workers", str(self.scenario.workers), "--log-level", "warning",
+            ]  # fmt: skip
+        else:
+            cmd = [
+                sys.executable, "-m", "isolation_api.bench", "serve-stdlib",
+                "--port", str(self.port), "--core", str(self.core_file),
+                "--data-dir", str(data_dir), "--tokens", json.dumps(self.tokens),
+            ]  # fmt: skip
+        self.proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL)
+
+    async def wait_ready(self, client: Any, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        headers = {"Authorization": f"Bearer {self.tokens[self.namespaces[0]]}"}
+        while time.monotonic() < deadline:
+            if self.proc is not None and self.proc.poll() is not None:
+                raise RuntimeError(f"{self.scenario.server} server exited with {self.proc.returncode}")
+            try:
+                r = await client.get(f"{self.base_url}/v1/health", headers=headers)
+                if r.status_code == 200:
+                    return
+            except Exception:  # noqa: BLE001 - connection refused while starting
+                pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError(f"{self.scenario.server} server did not become ready")
+
+    def reset_peak_rss(self) -> bool:
+        return self.proc is not None and reset_peak_rss(self.proc.pid)
+
+    def peak_rss_bytes(self) -> int | None:
+        return peak_rss_bytes(self.proc.pid) if self.proc is not None else None
+
+    def stop(self) -> None:
+        if self.proc is None:
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def request(self, workload: str, i: int) -> tuple[str, str, dict[str, str], bytes | None]:
+        """(method, url, headers, body) for the i-th request of `workload`."""
+        ns = self.namespaces[i % len(self.namespaces)]
+        headers = {"Authorization": f"Bearer {self.tokens[ns]}"}
+        if workload == "write":
+            if self.scenario.server == "fastapi":
+                entry = {"s_bucket": f"S{i % 7 + 1}", "payload": {"seq": i, "note": "benchmark entry"}}
+                url = f"{self.base_url}/v1/agent/entries"
+            else:
+                # Aggregation there rejects projections that lack any of S1..S7.
+                projection = {f"S{k}": f"bench-{i}" for k in range(1, 8)}
+                entry = {"projection": projection, "seq": i, "note": "benchmark entry"}
+                url = f"{self.base_url}/v1/agents/{ns}/entries"
+            body = json.dumps(entry, separators=(",", ":")).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+            if self.scenario.hmac:
+                ts = str(int(time.time()))
+                msg = f"{ts}.".encode("utf-8") + body
+                headers["X-Timestamp"] = ts
+                headers["X-Signature"] = hmac.new(self.secrets[ns].encode("utf-8"), msg, hashlib.sha256).hexdigest()
+            return "POST", url, headers, body
+        if workload == "aggregate":
+            query = "?limit=1000" if self.scenario.server == "fastapi" else ""
+            return "GET", f"{self.base_url}/v1/aggregate{query}", headers, None
+        if self.scenario.server == "fastapi":
+            return "GET", f"{self.base_url}/v1/core/read?limit=200&offset={(i * 200) % max(1, self.scenario.core_rows)}", headers, None
+        # The stdlib server only offers the full record list.
+        return "GET", f"{self.base_url}/v1/core/records", headers, None
+
+
+async def run_workload(
+    client: Any, build: Callable[[int], tuple[str, str, dict[str, str], bytes | None]], total: int, concurrency: int
+) -> dict[str, Any]:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            method, url, headers, body = build(i)
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, url, headers=headers, content=body)
+                ok = r.status_code < 400
+            except Exception:  # noqa: BLE001 - count transport failures as errors
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_scenario(scenario: Scenario, workdir: Path, core_file: Path, workloads: tuple[str, ...]) -> list[dict[str, Any]]:
+    import httpx
+
+    root = Path(tempfile.mkdtemp(prefix=f"{scenario.server}-", dir=workdir))
+    target = Target(scenario, root, core_file)
+    target.start()
+    results: list[dict[str, Any]] = []
+    limits = httpx.Limits(max_connections=scenario.concurrency, max_keepalive_connections=scenario.concurrency)
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=300.0) as client:
+            await target.wait_ready(client)
+            for workload in workloads:
+                # Without a reset the high-water mark would carry over from earlier workloads.
+                reset = target.reset_peak_rss()
+                summary = await run_workload(
+                    client, lambda i, w=workload: target.request(w, i), scenario.requests, scenario.concurrency
+                )
+                rss = target.peak_rss_bytes() if reset else None
+                results.append({**asdict(scenario), "workload": workload, **summary, "peak_rss_bytes": rss})
+    finally:
+        target.stop()
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=_repo_root(), capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def _csv(value: str) -> list[str]:
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    servers = _csv(args.servers)
+    workloads = tuple(_csv(args.workloads))
+    for server in servers:
+        if server not in SERVERS:
+            raise SystemExit(f"unknown server {server!r}; choose from {', '.join(SERVERS)}")
+    for workload in workloads:
+        if workload not in WORKLOADS:
+            raise SystemExit(f"unknown workload {workload!r}; choose from {', '.join(WORKLOADS)}")
+    hmac_modes = {"off": [False], "on": [True], "both": [False, True]}[args.hmac]
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="isolation_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        results = _run_matrix(args, workdir, servers, workloads, hmac_modes)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "started_at": int(time.time()),
+            "args": {k: v for k, v in vars(args).items() if k != "command"},
+        },
+        "results": results,
+    }
+
+
+def _run_matrix(
+    args: argparse.Namespace, workdir: Path, servers: list[str], workloads: tuple[str, ...], hmac_modes: list[bool]
+) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for rows in (int(r) for r in _csv(args.core_rows)):
+        core_file = workdir / f"core-{rows}" / "core.jsonl"
+        if not core_file.with_suffix(".sha256").exists():
+            generate_core(core_file, rows, seed=args.seed)
+        for server in servers:
+            # The stdlib server has no HMAC support.
+            for use_hmac in hmac_modes if server == "fastapi" else [False]:
+                scenario = Scenario(
+                    server=server,
+                    hmac=use_hmac,
+                    core_rows=rows,
+                    namespaces=args.namespaces,
+                    concurrency=args.concurrency,
+                    requests=args.requests,
+                    workers=args.workers,
+                )
+                print(f"running {scenario}", file=sys.stderr)
+                results.extend(asyncio.run(run_scenario(scenario, workdir, core_file, workloads)))
+    return results
+
+
+def serve_stdlib(args: argparse.Namespace) -> int:
+    from http.server import ThreadingHTTPServer
+
+    from isolation_proof.api import ApiConfig, ApiState, make_handler
+
+    core = Path(args.core)
+    config = ApiConfig(
+        core_path=core,
+        core_hash_path=core.with_suffix(".sha256"),
+        data_dir=Path(args.data_dir),
+        tokens=json.loads(args.tokens),
+    )
+    config.data_dir.mkdir(parents=True, exist_ok=True)
+    httpd = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(ApiState(config=config)))
+    httpd.serve_forever()
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the isolation APIs on localhost")
+    sub = parser.add_subparsers(dest="command")
+
+    stdlib = sub.add_parser("serve-stdlib", help="(internal) run isolation_proof.api against a given core")
+    stdlib.add_argument("--port", type=int, required=True)
+    stdlib.add_argument("--core", required=True)
+    stdlib.add_argument("--data-dir", required=True)
+    stdlib.add_argument("--tokens", required=True, help="JSON mapping principal -> token")
+
+    parser.add_argument("--servers", default="fastapi,stdlib", help=f"comma-separated: {', '.join(SERVERS)}")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"comma-separated: {', '.join(WORKLOADS)}")
+    parser.add_argument("--core-rows", default="1000", help="comma-separated core sizes, e.g. 1000,100000,10000000")
+    parser.add_argument("--namespaces", type=int, default=4)
+    parser.add_argument("--hmac", choices=("off", "on", "both"), default="both")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per workload")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the FastAPI server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="where cores and data dirs go (default: a temp dir)")
+    parser.add_argument("--out", default="bench.json")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve-stdlib":
+        return serve_stdlib(args)
+
+    report = run(args)
+    Path(args.out).write_text(json.dumps(report, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    for r in report["results"]:
+        print(
+            f"{r['server']:8} hmac={'on ' if r['hmac'] else 'off'} rows={r['core_rows']:<9} {r['workload']:10} "
+            f"{r['throughput_rps']:>9.1f} req/s  p50={r['latency_ms']['p50']:.2f}ms "
+            f"p99={r['latency_ms']['p99']:.2f}ms  errors={r['errors']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
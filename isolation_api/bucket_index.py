@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Collection, Iterable, Iterator
+from urllib.parse import quote
+
+from .metrics import AGGREGATE_LINES_SCANNED
+from .segments import LogReader, lock_active
+
+INDEX_DIR = Path("index") / "s_bucket"
+WATERMARK_NAME = "watermark"
+
+_WATERMARK = struct.Struct("<Q")
+_OFFSET_SIZE = 8
+_APPEND_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_CLOEXEC", 0)
+
+
+def bucket_file_name(bucket: str) -> str:
+    """File holding the offsets of `bucket`; very long names are hashed to stay valid."""
+    name = quote(bucket, safe="")
+    if len(name) > 200:
+        name = "h-" + hashlib.sha256(bucket.encode("utf-8")).hexdigest()
+    return f"{name}.off"
+
+
+def line_bucket(line: bytes) -> str | None:
+    try:
+        value = json.loads(line).get("s_bucket")
+    except (ValueError, AttributeError):
+        return None
+    return value if isinstance(value, str) else None
+
+
+def _load_offsets(path: Path) -> array:
+    offsets = array("Q")
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        return offsets
+    # A writer that died mid-append can leave a partial trailing entry.
+    offsets.frombytes(raw[: len(raw) - len(raw) % _OFFSET_SIZE])
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    return offsets
+
+
+class BucketIndex:
+    """Per-namespace secondary index from `s_bucket` to logical line offsets.
+
+    Each bucket has an append-only file of little-endian uint64 line starts
+    under `<namespace>/index/s_bucket/`, and `watermark` records the logical
+    offset up to which every line is indexed. Writers extend the index under
+    the log's exclusive lock right after each append; readers use offsets
+    below the watermark and only scan the log past it. Deleting the
+    directory makes the next append rebuild it from the log.
+    """
+
+    def __init__(self, ns_dir: Path) -> None:
+        self.ns_dir = ns_dir
+        self.dir = ns_dir / INDEX_DIR
+
+    def watermark(self) -> int:
+        try:
+            raw = (self.dir / WATERMARK_NAME).read_bytes()
+        except FileNotFoundError:
+            return 0
+        return _WATERMARK.unpack(raw)[0] if len(raw) == _WATERMARK.size else 0
+
+    def offsets(self, bucket: str, start: int, stop: int) -> array:
+        """Indexed line starts of `bucket` in [start, stop)."""
+        offsets = _load_offsets(self.dir / bucket_file_name(bucket))
+        return offsets[bisect_left(offsets, start) : bisect_left(offsets, stop)]
+
+    def record_locked(self, start: int, data: bytes) -> None:
+        """Index the lines of `data`, just appended at logical offset `start`.
+
+        The caller holds the exclusive lock on the active log file. Lines
+        between the watermark and `start` (written before the index existed,
+        or by a worker that died mid-update) are indexed from the log first.
+        """
+        watermark = self.watermark()
+        pending: dict[str, array] = {}
+        if watermark != start:
+            if watermark > start:
+                # The log was replaced underneath the index.
+                self.clear()
+                watermark = 0
+            else:
+                self._truncate_from(watermark)
+            with LogReader(self.ns_dir, lock=False) as log:
+                for line, end in log.iter_lines(watermark):
+                    if end > start:
+                        break
+                    self._add(pending, line, end - len(line))
+
+        pos = start
+        for line in data.splitlines(keepends=True):
+            if line.strip():
+                self._add(pending, line, pos)
+            pos += len(line)
+        self._flush(pending, pos)
+
+    def clear(self) -> None:
+        if not self.dir.exists():
+            return
+        for path in self.dir.iterdir():
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _add(pending: dict[str, array], line: bytes, offset: int) -> None:
+        bucket = line_bucket(line)
+        if bucket is not None:
+            pending.setdefault(bucket, array("Q")).append(offset)
+
+    def _truncate_from(self, watermark: int) -> None:
+        """Drop entries at or past `watermark` that were written without advancing it."""
+        if not self.dir.exists():
+            return
+        for path in self.dir.glob("*.off"):
+            offsets = _load_offsets(path)
+            keep = bisect_left(offsets, watermark)
+            if keep * _OFFSET_SIZE != path.stat().st_size:
+                os.truncate(path, keep * _OFFSET_SIZE)
+
+    def _flush(self, pending: dict[str, array], watermark: int) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for bucket, offsets in pending.items():
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            fd = os.open(self.dir / bucket_file_name(bucket), _APPEND_FLAGS, 0o644)
+            try:
+                os.write(fd, offsets.tobytes())
+            finally:
+                os.close(fd)
+        fd = os.open(self.dir / WATERMARK_NAME, os.O_WRONLY | os.O_CREAT | getattr(os, "O_CLOEXEC", 0), 0o644)
+        try:
+            os.pwrite(fd, _WATERMARK.pack(watermark), 0)
+        finally:
+            os.close(fd)
+
+
+def rebuild_bucket_index(ns_dir: Path) -> int:
+    """Re-derive a namespace's s_bucket index from its log; returns the new watermark."""
+    lock = lock_active(ns_dir)
+    if lock is None:
+        return 0
+    with lock:
+        index = BucketIndex(ns_dir)
+        index.clear()
+        with LogReader(ns_dir, lock=False) as log:
+            end = log.end()
+        index.record_locked(end, b"")
+        return end
+
+
+def _unique(offsets: Iterable[int]) -> Iterator[int]:
+    last = -1
+    for offset in offsets:
+        if offset > last:
+            last = offset
+            yield offset
+
+
+def iter_bucket_lines(
+    ns_dir: Path,
+    buckets: Collection[str],
+    start: int = 0,
+    *,
+    since: int | None = None,
+    until: int | None = None,
+) -> Iterator[tuple[bytes, int]]:
+    """(line, logical end) of every line whose `s_bucket` is in `buckets`, from `start`.
+
+    Lines below the index watermark are read directly at their indexed
+    offsets; only the unindexed tail of the log is scanned and decoded.
+    """
+    index = BucketIndex(ns_dir)
+    needles = tuple(
+        {json.dumps(b, ensure_ascii=False).encode("utf-8") for b in buckets} | {json.dumps(b).encode("ascii") for b in buckets}
+    )
+    # Read before the log snapshot, so the watermark can never run ahead of it.
+    watermark = index.watermark()
+    wanted = set(buckets)
+    with LogReader(ns_dir) as log:
+        end = log.end()
+        if start > end:
+            start = 0
+        if watermark > end:
+            # The log was replaced since the index was written; scan instead.
+            watermark = 0
+        start = max(start, log.start)
+        if start < watermark:
+            streams = [index.offsets(bucket, start, watermark) for bucket in sorted(wanted)]
+            yield from log.lines_at(_unique(heapq.merge(*streams)), since=since, until=until)
+        # Lines rejected here are counted as scanned; the caller counts the rest.
+        rejected = 0
+        try:
+            for line, line_end in log.iter_lines(max(start, watermark), since=since, until=until):
+                # Cheap substring check first; only candidate lines are decoded.
+                if any(needle in line for needle in needles) and line_bucket(line) in wanted:
+                    yield line, line_end
+                else:
+                    rejected += 1
+        finally:
+            AGGREGATE_LINES_SCANNED.inc(rejected, labels=("namespace",))
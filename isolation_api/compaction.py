@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from .aggregate import PayloadMatch, Row, iter_namespace_rows, json_source, line_matches, namespace_logs, tag_raw_line
+from .metrics import AGGREGATE_LINES_SCANNED
+from .segments import ACTIVE_NAME, LogReader, Manifest, row_ts
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "lock"
+# Rows per block (the unit skipped by since/until) and per namespace checkpoint.
+BLOCK_ROWS = 4096
+CHECKPOINT_EVERY = 256
+
+
+@dataclass(frozen=True)
+class NamespaceMark:
+    """How far the snapshot covers one namespace.
+
+    `end` is the logical offset just past its last row in the snapshot.
+    `ino`/`size` are its active file's identity and size when compaction
+    started reading it: while they are unchanged, nothing was appended
+    since and the log need not be opened. `checkpoints` are (row end,
+    snapshot byte position) of every CHECKPOINT_EVERY-th row, used to find
+    where a cursor resumes.
+    """
+
+    end: int
+    ino: int | None
+    size: int
+    checkpoints: tuple[tuple[int, int], ...]
+
+
+@dataclass(frozen=True)
+class AggregateSnapshot:
+    """All namespace logs merged by `ts` into one file, up to per-namespace watermarks.
+
+    Each line is `<namespace>\\t<end>\\t<ts>\\t<stored line>`, in the order
+    `merge_namespace_rows` would produce. `blocks` are (byte position,
+    ts_min, ts_max) of consecutive runs of BLOCK_ROWS rows.
+    """
+
+    directory: Path
+    generation: int
+    file: str
+    bytes: int
+    rows: int
+    created_at: int
+    agents_mtime_ns: int
+    namespaces: dict[str, NamespaceMark]
+    blocks: tuple[tuple[int, int, int], ...]
+
+    @staticmethod
+    def load(directory: Path) -> "AggregateSnapshot | None":
+        try:
+            raw = json.loads((directory / MANIFEST_NAME).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        return AggregateSnapshot(
+            directory=directory,
+            generation=raw["generation"],
+            file=raw["file"],
+            bytes=raw["bytes"],
+            rows=raw["rows"],
+            created_at=raw["created_at"],
+            agents_mtime_ns=raw["agents_mtime_ns"],
+            namespaces={
+                ns: NamespaceMark(
+                    end=mark["end"],
+                    ino=mark["ino"],
+                    size=mark["size"],
+                    checkpoints=tuple((end, pos) for end, pos in mark["checkpoints"]),
+                )
+                for ns, mark in raw["namespaces"].items()
+            },
+            blocks=tuple((pos, lo, hi) for pos, lo, hi in raw["blocks"]),
+        )
+
+    def _start_pos(self, offsets: dict[str, int]) -> int:
+        """A snapshot position at or before the first row not yet consumed per `offsets`."""
+        start = self.bytes
+        for namespace, mark in self.namespaces.items():
+            if not mark.checkpoints:
+                continue
+            done = offsets.get(f"agent:{namespace}", 0)
+            if done >= mark.end:
+                continue
+            i = bisect_right(mark.checkpoints, (done, math.inf)) - 1
+            start = min(start, mark.checkpoints[max(i, 0)][1])
+        return start
+
+    def iter_rows(
+        self,
+        offsets: dict[str, int],
+        *,
+        since: int | None = None,
+        until: int | None = None,
+        where: tuple[PayloadMatch, ...] = (),
+    ) -> Iterator[Row]:
+        """Snapshot rows not yet consumed per `offsets`, filtered like `iter_namespace_rows`."""
+        start = self._start_pos(offsets)
+        # raw namespace -> (source, encoded source, offset already consumed)
+        known: dict[bytes, tuple[str, bytes, int]] = {}
+        scanned = 0
+        try:
+            with (self.directory / self.file).open("rb") as f:
+                for i, (pos, ts_min, ts_max) in enumerate(self.blocks):
+                    stop = self.blocks[i + 1][0] if i + 1 < len(self.blocks) else self.bytes
+                    if stop <= start:
+                        continue
+                    if (since is not None and ts_max < since) or (until is not None and ts_min > until):
+                        continue
+                    f.seek(max(pos, start))
+                    remaining = stop - max(pos, start)
+                    while remaining > 0:
+                        line = f.readline()
+                        if not line:
+                            break
+                        remaining -= len(line)
+                        scanned += 1
+                        ns, end_s, ts_s, stored = line.split(b"\t", 3)
+                        info = known.get(ns)
+                        if info is None:
+                            name = "agent:" + ns.decode("utf-8")
+                            info = known[ns] = (name, json_source(name), offsets.get(name, 0))
+                        end, ts = int(end_s), int(ts_s)
+                        if end <= info[2]:
+                            continue
+                        if (since is not None and ts < since) or (until is not None and ts > until):
+                            continue
+                        if where and not line_matches(stored, where):
+                            continue
+                        yield Row(ts, info[0], tag_raw_line(info[1], stored), end)
+        finally:
+            AGGREGATE_LINES_SCANNED.inc(scanned, labels=("namespace",))
+
+    def _namespace_dirs(self, agents_root: Path) -> list[tuple[str, Path]]:
+        # Adding or removing a namespace directory changes agents_root's mtime.
+        try:
+            unchanged = agents_root.stat().st_mtime_ns == self.agents_mtime_ns
+        except FileNotFoundError:
+            return []
+        if unchanged:
+            return [(ns, agents_root / ns) for ns in sorted(self.namespaces)]
+        return namespace_logs(agents_root)
+
+    def merge_namespace_rows(
+        self,
+        agents_root: Path,
+        *,
+        per_namespace: int | None = None,
+        offsets: dict[str, int] | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        where: tuple[PayloadMatch, ...] = (),
+    ) -> Iterator[Row]:
+        """Same rows and order as aggregate.merge_namespace_rows, reading the snapshot
+        plus only the logs that were appended to since it was written.
+
+        Snapshot rows that retention has pruned from a log since, or whose
+        namespace is gone, are skipped: each log's first stored offset is
+        treated as already consumed.
+        """
+        offsets = offsets or {}
+        namespace_dirs = self._namespace_dirs(agents_root)
+        snapshot_offsets = dict(offsets)
+        present = dict(namespace_dirs)
+        for namespace, mark in self.namespaces.items():
+            ns_dir = present.get(namespace)
+            floor = _log_start(ns_dir) if ns_dir is not None else mark.end
+            source = f"agent:{namespace}"
+            if floor > snapshot_offsets.get(source, 0):
+                snapshot_offsets[source] = floor
+        streams: list[Iterator[Row]] = [self.iter_rows(snapshot_offsets, since=since, until=until, where=where)]
+        for namespace, ns_dir in namespace_dirs:
+            start = offsets.get(f"agent:{namespace}", 0)
+            mark = self.namespaces.get(namespace)
+            if mark is not None:
+                if not _appended_since(ns_dir, mark):
+                    continue
+                start = max(start, mark.end)
+            streams.append(iter_namespace_rows(namespace, ns_dir, start, since=since, until=until, where=where))
+        merged = heapq.merge(*streams, key=lambda row: (row.ts, row.source))
+        return merged if per_namespace is None else _cap_per_source(merged, per_namespace)
+
+
+def _log_start(ns_dir: Path) -> int:
+    """Lowest logical offset still stored in a namespace log (see LogReader.start)."""
+    manifest = Manifest.load(ns_dir)
+    return manifest.segments[0].base if manifest.segments else manifest.active_base
+
+
+def _appended_since(ns_dir: Path, mark: NamespaceMark) -> bool:
+    try:
+        st = os.stat(ns_dir / ACTIVE_NAME)
+    except FileNotFoundError:
+        return True
+    return (st.st_ino, st.st_size) != (mark.ino, mark.size)
+
+
+def _cap_per_source(rows: Iterator[Row], cap: int) -> Iterator[Row]:
+    counts: dict[str, int] = {}
+    for row in rows:
+        n = counts.get(row.source, 0)
+        if n < cap:
+            counts[row.source] = n + 1
+            yield row
+
+
+def _raw_rows(namespace: str, ns_dir: Path) -> Iterator[tuple[int, str, bytes, int]]:
+    with LogReader(ns_dir) as log:
+        for line, end in log.iter_lines():
+            yield row_ts(line), namespace, line, end
+
+
+def compact_namespaces(agents_root: Path, directory: Path, *, min_age_seconds: int = 0) -> AggregateSnapshot | None:
+    """Write a new aggregate snapshot of every namespace log and make it current.
+
+    Returns None without doing anything if another process is compacting,
+    or the current snapshot is younger than `min_age_seconds`. The previous
+    generation's file is kept so in-flight readers can finish with it.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with (directory / LOCK_NAME).open("ab") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+        previous = AggregateSnapshot.load(directory)
+        now = int(time.time())
+        if previous is not None and min_age_seconds > 0 and now - previous.created_at < min_age_seconds:
+            return None
+        try:
+            agents_mtime_ns = agents_root.stat().st_mtime_ns
+        except FileNotFoundError:
+            agents_mtime_ns = 0
+
+        marks: dict[str, dict] = {}
+        streams: list[Iterator[tuple[int, str, bytes, int]]] = []
+        for namespace, ns_dir in namespace_logs(agents_root):
+            # Stat before reading: anything appended after this is re-read from `end`.
+            try:
+                st = os.stat(ns_dir / ACTIVE_NAME)
+                ino, size = st.st_ino, st.st_size
+            except FileNotFoundError:
+                ino, size = None, 0
+            marks[namespace] = {"end": 0, "ino": ino, "size": size, "checkpoints": [], "rows": 0}
+            if "\t" in namespace or "\n" in namespace:
+                # Cannot be framed; always read from its log instead.
+                marks[namespace]["size"] = -1
+                continue
+            streams.append(_raw_rows(namespace, ns_dir))
+
+        generation = (previous.generation if previous is not None else 0) + 1
+        name = f"aggregate-{generation:06d}.tsv"
+        tmp = directory / f".{name}.{os.getpid()}.tmp"
+        blocks: list[list[int]] = []
+        pos = rows = 0
+        try:
+            with tmp.open("wb") as out:
+                for ts, namespace, line, end in heapq.merge(*streams, key=lambda r: (r[0], r[1])):
+                    if rows % BLOCK_ROWS == 0:
+                        blocks.append([pos, ts, ts])
+                    else:
+                        block = blocks[-1]
+                        block[1], block[2] = min(block[1], ts), max(block[2], ts)
+                    mark = marks[namespace]
+                    if mark["rows"] % CHECKPOINT_EVERY == 0:
+                        mark["checkpoints"].append([end, pos])
+                    mark["rows"] += 1
+                    mark["end"] = end
+                    record = b"%s\t%d\t%d\t%s" % (namespace.encode("utf-8"), end, ts, line)
+                    if not record.endswith(b"\n"):
+                        record += b"\n"
+                    out.write(record)
+                    pos += len(record)
+                    rows += 1
+            os.replace(tmp, directory / name)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+        manifest = {
+            "generation": generation,
+            "file": name,
+            "bytes": pos,
+            "rows": rows,
+            "created_at": now,
+            "agents_mtime_ns": agents_mtime_ns,
+            "namespaces": {
+                ns: {key: mark[key] for key in ("end", "ino", "size", "checkpoints")} for ns, mark in marks.items()
+            },
+            "blocks": blocks,
+        }
+        tmp_manifest = directory / f".{MANIFEST_NAME}.{os.getpid()}.tmp"
+        tmp_manifest.write_text(json.dumps(manifest, separators=(",", ":")) + "\n", encoding="utf-8")
+        os.replace(tmp_manifest, directory / MANIFEST_NAME)
+
+        keep = {name, previous.file if previous is not None else name}
+        for path in directory.glob("aggregate-*.tsv"):
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+        return AggregateSnapshot.load(directory)
+
+
+class AggregateSnapshotStore:
+    """The current aggregate snapshot, re-read only when its manifest is replaced."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._key: tuple[int, int] | None = None
+        self._snapshot: AggregateSnapshot | None = None
+
+    def get(self) -> AggregateSnapshot | None:
+        try:
+            st = os.stat(self.directory / MANIFEST_NAME)
+        except FileNotFoundError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            if key != self._key:
+                self._snapshot = AggregateSnapshot.load(self.directory)
+                self._key = key
+            return self._snapshot
+
+
+class AggregateCompactor:
+    """Background thread running `compact_namespaces` every `interval_seconds`.
+
+    Every worker runs one; the lock and the age check keep them from
+    compacting more than once per interval between them.
+    """
+
+    def __init__(self, agents_root: Path, directory: Path, interval_seconds: int = 0) -> None:
+        self.agents_root = agents_root
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> AggregateSnapshot | None:
+        return compact_namespaces(self.agents_root, self.directory, min_age_seconds=self.interval_seconds)
+
+    def start(self) -> None:
+        if self.interval_seconds <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="aggregate-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except OSError:
+                pass
+            if self._stop.wait(self.interval_seconds):
+                return
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import gzip
+import lzma
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import IO, Iterator
+
+CODECS = {"gzip": ".gz", "lzma": ".xz"}
+INDEX_SUFFIX = ".idx"
+DEFAULT_BLOCK_BYTES = 256 * 1024
+
+_INDEX_MAGIC = b"IAPIBLK1"
+_PAIR = struct.Struct("<QQ")
+
+
+def codec_of(name: str) -> str | None:
+    """Codec a segment file name is compressed with, or None for plain files."""
+    for codec, suffix in CODECS.items():
+        if name.endswith(suffix):
+            return codec
+    return None
+
+
+def plain_name(name: str) -> str:
+    codec = codec_of(name)
+    return name.removesuffix(CODECS[codec]) if codec is not None else name
+
+
+def index_path(path: Path) -> Path:
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "gzip":
+        return zlib.decompress(data, wbits=31)
+    return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+
+def compress_file(src: Path, dst: Path, *, block_bytes: int = DEFAULT_BLOCK_BYTES) -> None:
+    """Write `src` to `dst` as independently compressed blocks of whole lines.
+
+    The result is an ordinary multi-member .gz (or multi-stream .xz) file, so
+    zcat/xzcat still read it, plus `<dst>.idx` recording where every block
+    starts before and after compression. Both are written to temporary names
+    and renamed into place, the index first. Raises FileNotFoundError if
+    `src` disappears.
+    """
+    codec = codec_of(dst.name)
+    if codec is None:
+        raise ValueError(f"Unknown compression suffix on {dst.name!r}")
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    tmp_index = dst.with_name(f".{dst.name}{INDEX_SUFFIX}.{os.getpid()}.tmp")
+    pairs: list[tuple[int, int]] = []
+    try:
+        with src.open("rb") as fin, tmp.open("wb") as fout:
+            usize = csize = 0
+            block: list[bytes] = []
+            pending = 0
+            for line in fin:
+                block.append(line)
+                pending += len(line)
+                if pending >= block_bytes:
+                    pairs.append((usize, csize))
+                    csize += fout.write(_compress(codec, b"".join(block)))
+                    usize += pending
+                    block, pending = [], 0
+            if block:
+                pairs.append((usize, csize))
+                csize += fout.write(_compress(codec, b"".join(block)))
+                usize += pending
+            pairs.append((usize, csize))
+        tmp_index.write_bytes(_INDEX_MAGIC + b"".join(_PAIR.pack(u, c) for u, c in pairs))
+        os.replace(tmp_index, index_path(dst))
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+        tmp_index.unlink(missing_ok=True)
+
+
+def load_index(path: Path, compressed_size: int) -> tuple[array, array] | None:
+    """(uncompressed starts, compressed starts) of every block plus an end sentinel.
+
+    None if the index is missing or does not describe a file of `compressed_size`.
+    """
+    try:
+        raw = index_path(path).read_bytes()
+    except FileNotFoundError:
+        return None
+    body = raw[len(_INDEX_MAGIC) :]
+    if not raw.startswith(_INDEX_MAGIC) or not body or len(body) % _PAIR.size:
+        return None
+    values = array("Q")
+    values.frombytes(body)
+    if sys.byteorder != "little":
+        values.byteswap()
+    ustarts, cstarts = values[0::2], values[1::2]
+    if cstarts[-1] != compressed_size:
+        return None
+    return ustarts, cstarts
+
+
+class BlockReader:
+    """Read-only, seekable view of a block-compressed file (see `compress_file`).
+
+    Supports the subset of the binary file API that LogReader uses: seek to
+    an uncompressed offset, readline and line iteration. Only the block
+    holding the current position is decompressed and kept in memory.
+    """
+
+    def __init__(self, f: IO[bytes], codec: str, ustarts: array, cstarts: array) -> None:
+        self._f = f
+        self._codec = codec
+        self._ustarts = ustarts
+        self._cstarts = cstarts
+        self._block = -1
+        self._buf = b""
+        self._pos = 0
+
+    def _load(self, i: int) -> None:
+        if i != self._block:
+            self._f.seek(self._cstarts[i])
+            self._buf = _decompress(self._codec, self._f.read(self._cstarts[i + 1] - self._cstarts[i]))
+            self._block = i
+
+    def seek(self, pos: int, whence: int = os.SEEK_SET) -> int:
+        if whence != os.SEEK_SET:
+            raise ValueError("BlockReader only supports absolute seeks")
+        self._pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readline(self) -> bytes:
+        parts: list[bytes] = []
+        end = self._ustarts[-1]
+        while self._pos < end:
+            i = bisect_right(self._ustarts, self._pos) - 1
+            self._load(i)
+            rel = self._pos - self._ustarts[i]
+            nl = self._buf.find(b"\n", rel)
+            if nl >= 0:
+                parts.append(self._buf[rel : nl + 1])
+                self._pos += nl + 1 - rel
+                break
+            parts.append(self._buf[rel:])
+            self._pos += len(self._buf) - rel
+        return b"".join(parts)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self) -> None:
+        self._f.close()
+        self._buf = b""
+
+    def __enter__(self) -> "BlockReader":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+
+def open_compressed(path: Path) -> IO[bytes] | BlockReader:
+    """Open a compressed segment for reading; raises FileNotFoundError if it is gone.
+
+    Files with a matching block index are seekable block by block. Files
+    compressed as one stream (older segments, or a missing index) fall back
+    to gzip/lzma, where seeking decompresses everything before the target.
+    """
+    codec = codec_of(path.name)
+    f = path.open("rb")
+    index = load_index(path, os.fstat(f.fileno()).st_size)
+    if index is not None:
+        return BlockReader(f, codec, *index)  # type: ignore[arg-type]
+    f.close()
+    if codec == "gzip":
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+    return lzma.open(path, "rb")  # type: ignore[return-value]
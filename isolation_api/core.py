@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+
+from .metrics import CORE_HASH_SECONDS
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with CORE_HASH_SECONDS.time(), path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _stat_key(st: os.stat_result) -> tuple[int, int, int]:
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+@dataclass(frozen=True)
+class CoreDigest:
+    sha256: str
+    from_cache: bool
+    verified_at: int
+
+
+class CoreDigestCache:
+    """SHA-256 of the core file, recomputed only when the file changes.
+
+    The cache is keyed on (inode, size, mtime_ns). A stat() per lookup is
+    enough to notice replaced or rewritten files without rereading them; an
+    optional background thread re-hashes on an interval to catch in-place
+    edits that preserve all three.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # (key, sha256, verified_at), replaced as a whole so hits need no lock.
+        self._cached: tuple[tuple[int, int, int], str, int] | None = None
+        # Hashes in progress by key; concurrent misses wait on the same one.
+        self._inflight: dict[tuple[int, int, int], Future[CoreDigest]] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def digest(self) -> CoreDigest:
+        key = _stat_key(self.path.stat())
+        cached = self._cached
+        if cached is not None and cached[0] == key:
+            return CoreDigest(sha256=cached[1], from_cache=True, verified_at=cached[2])
+        return self._rehash(key)
+
+    def reverify(self) -> CoreDigest:
+        return self._rehash(_stat_key(self.path.stat()))
+
+    def _rehash(self, key: tuple[int, int, int]) -> CoreDigest:
+        """Hash the file once for `key`, however many callers miss at the same time.
+
+        The hash runs without the lock, so cached lookups are never stuck
+        behind a full read.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if future is None:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            sha = sha256_file(self.path)
+            after = _stat_key(self.path.stat())
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        result = CoreDigest(sha256=sha, from_cache=False, verified_at=int(time.time()))
+        with self._lock:
+            # Only cache when the file was stable for the whole read.
+            self._cached = (key, sha, result.verified_at) if after == key else None
+            del self._inflight[key]
+        future.set_result(result)
+        return result
+
+    def start_reverifier(self, interval_seconds: int) -> None:
+        if interval_seconds <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._reverify_loop,
+            args=(interval_seconds,),
+            name="core-digest-reverifier",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop_reverifier(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _reverify_loop(self, interval_seconds: int) -> None:
+        while not self._stop.wait(interval_seconds):
+            try:
+                self.reverify()
+            except OSError:
+                # Missing/unreadable core is reported by the endpoint itself.
+                continue
+
+
+_INDEX_MAGIC = b"CORELIX1"
+_INDEX_HEADER = struct.Struct("<8s32sQ")
+_OFFSET = struct.Struct("<Q")
+
+
+def _scan_line_offsets(path: Path) -> array:
+    """Byte offsets of every non-blank line start, plus the file size as a sentinel."""
+    offsets = array("Q")
+    pos = 0
+    line_start = 0
+    blank = True
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            i = 0
+            while True:
+                nl = chunk.find(b"\n", i)
+                piece = chunk[i:] if nl < 0 else chunk[i:nl]
+                if blank and piece.strip():
+                    blank = False
+                if nl < 0:
+                    break
+                if not blank:
+                    offsets.append(line_start)
+                line_start = pos + nl + 1
+                blank = True
+                i = nl + 1
+            pos += len(chunk)
+    if not blank:
+        offsets.append(line_start)
+    offsets.append(pos)
+    return offsets
+
+
+class CoreLineIndex:
+    """Persisted line-start offsets for one pinned core hash.
+
+    Sidecar layout: magic, raw sha256, row count, then (count + 1) little
+    endian uint64 offsets; the last one is the file size so every row's end
+    is known without touching the core file.
+    """
+
+    def __init__(self, path: Path, sha256: str, mm: mmap.mmap, count: int) -> None:
+        self.path = path
+        self.sha256 = sha256
+        self._mm = mm
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def offset(self, row: int) -> int:
+        """Start of `row`; `row == len(self)` gives the end of the last row."""
+        if row < 0 or row > self._count:
+            raise IndexError(row)
+        return _OFFSET.unpack_from(self._mm, _INDEX_HEADER.size + row * _OFFSET.size)[0]
+
+    def close(self) -> None:
+        self._mm.close()
+
+    @staticmethod
+    def build(core_file: Path, sha256: str, index_file: Path) -> None:
+        offsets = _scan_line_offsets(core_file)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = index_file.with_name(f"{index_file.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, bytes.fromhex(sha256), len(offsets) - 1))
+            offsets.tofile(f)
+        os.replace(tmp, index_file)
+
+    @staticmethod
+    def open(index_file: Path, sha256: str) -> "CoreLineIndex | None":
+        """Map an existing sidecar; returns None if it is missing or for another hash."""
+        try:
+            with index_file.open("rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        if len(mm) < _INDEX_HEADER.size:
+            mm.close()
+            return None
+        magic, raw_sha, count = _INDEX_HEADER.unpack_from(mm, 0)
+        expected_size = _INDEX_HEADER.size + (count + 1) * _OFFSET.size
+        if magic != _INDEX_MAGIC or raw_sha.hex() != sha256 or len(mm) != expected_size:
+            mm.close()
+            return None
+        return CoreLineIndex(index_file, sha256, mm, count)
+
+
+class CoreLineIndexStore:
+    """Opens (or builds once) the line index for whichever core hash is pinned."""
+
+    def __init__(self, core_file: Path, index_dir: Path) -> None:
+        self.core_file = core_file
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._current: CoreLineIndex | None = None
+
+    def get(self, sha256: str) -> CoreLineIndex:
+        with self._lock:
+            if self._current is not None and self._current.sha256 == sha256:
+                return self._current
+            index_file = self.index_dir / f"core-{sha256}.offsets"
+            index = CoreLineIndex.open(index_file, sha256)
+            if index is None:
+                CoreLineIndex.build(self.core_file, sha256, index_file)
+                index = CoreLineIndex.open(index_file, sha256)
+                if index is None:
+                    raise OSError(f"Failed to build core line index at {index_file}")
+            # Readers may still hold the previous index; let GC unmap it.
+            self._current = index
+            return index
+
+
+def compact_json_line(line: bytes) -> bytes:
+    """A stored JSON line without its newline, re-encoded compactly only if needed."""
+    body = line.rstrip(b"\r\n")
+    if body[:1] == b"{" and body[-1:] == b"}":
+        return body
+    return json.dumps(json.loads(body), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@dataclass(frozen=True)
+class CoreSnapshot:
+    """The pinned core held in memory, ready to serve.
+
+    `lines[i]` is row i already in response form (see `compact_json_line`)
+    and `ends[i]` the byte offset just past it in the core file, which keeps
+    cursors interchangeable with reads from disk.
+    """
+
+    sha256: str
+    lines: tuple[bytes, ...]
+    ends: array
+
+
+class CoreSnapshotStore:
+    """Loads the core into memory once per pinned hash, if it fits in `max_bytes`.
+
+    The bytes are hashed as they are loaded, so a snapshot is only ever
+    built from exactly the pinned content. `max_bytes <= 0` disables it.
+    """
+
+    def __init__(self, core_file: Path, max_bytes: int) -> None:
+        self.core_file = core_file
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._current: CoreSnapshot | None = None
+
+    def get(self, sha256: str) -> CoreSnapshot | None:
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            if self._current is not None and self._current.sha256 == sha256:
+                return self._current
+            if self.core_file.stat().st_size > self.max_bytes:
+                return None
+            data = self.core_file.read_bytes()
+            with CORE_HASH_SECONDS.time():
+                matches = hashlib.sha256(data).hexdigest() == sha256
+            if len(data) > self.max_bytes or not matches:
+                return None
+            lines: list[bytes] = []
+            ends = array("Q")
+            pos = 0
+            while pos < len(data):
+                nl = data.find(b"\n", pos)
+                end = len(data) if nl < 0 else nl + 1
+                line = data[pos:end]
+                if line.strip():
+                    lines.append(compact_json_line(line))
+                    ends.append(end)
+                pos = end
+            self._current = CoreSnapshot(sha256=sha256, lines=tuple(lines), ends=ends)
+            return self._current
@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, *, labels: tuple[str, ...] = ()) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            return {json.dumps(list(k)): v for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(into: dict[str, Any], other: dict[str, Any]) -> None:
+        for key, value in other.items():
+            into[key] = into.get(key, 0.0) + value
+
+    def render(self, merged: dict[str, Any]) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, json.loads(key))} {_format_value(value)}"
+            for key, value in sorted(merged.items())
+        ]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> per-bucket counts (last slot is +Inf), then sum.
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *, labels: tuple[str, ...] = ()) -> None:
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            counts[slot] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *, labels: tuple[str, ...] = ()) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels=labels)
+
+    def snapshot(self) -> dict[str, list[float]]:
+        with self._lock:
+            return {json.dumps(list(k)): list(v) for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(into: dict[str, Any], other: dict[str, Any]) -> None:
+        for key, counts in other.items():
+            current = into.get(key)
+            if current is None or len(current) != len(counts):
+                into[key] = list(counts)
+            else:
+                into[key] = [a + b for a, b in zip(current, counts)]
+
+    def render(self, merged: dict[str, Any]) -> list[str]:
+        lines: list[str] = []
+        for key, counts in sorted(merged.items()):
+            values = json.loads(key)
+            if len(counts) != len(self.buckets) + 2:
+                continue
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics[name] = metric
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics[name] = metric
+        return metric
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def merge(self, snapshots: Iterable[dict[str, dict[str, Any]]]) -> dict[str, dict[str, Any]]:
+        """Sum of `snapshots`, in snapshot form; unknown metrics are dropped."""
+        merged: dict[str, dict[str, Any]] = {name: {} for name in self._metrics}
+        for snap in snapshots:
+            for name, values in snap.items():
+                metric = self._metrics.get(name)
+                if metric is not None:
+                    metric.merge(merged[name], values)
+        return merged
+
+    def render(self, snapshots: Iterable[dict[str, dict[str, Any]]]) -> str:
+        """Prometheus text exposition of the sum of `snapshots` (one per process)."""
+        merged = self.merge(snapshots)
+        lines: list[str] = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged[name]))
+        return "\n".join(lines) + "\n"
+
+
+DEAD_NAME = "metrics-dead.json"
+
+
+def _snapshot_pid(name: str, prefix: str, suffix: str) -> int | None:
+    digits = name[len(prefix) : len(name) - len(suffix)]
+    return int(digits) if name.startswith(prefix) and name.endswith(suffix) and digits.isdigit() else None
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name != "posix":
+        # os.kill(pid, 0) signals the process on Windows rather than probing it; never fold there.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path: Path) -> dict[str, Any] | None:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class MultiProcessMetrics:
+    """Shares a registry across uvicorn workers through per-process snapshot files.
+
+    Each worker writes its cumulative values to `<directory>/metrics-<pid>.json`
+    (atomically, every `flush_interval_ms` and on every scrape it serves);
+    a scrape on any worker sums all files. On start, the files of workers
+    that have exited are folded into `metrics-dead.json` and deleted, like
+    prometheus_client's multiprocess mode, so restarts keep their counts
+    without growing the file set.
+    """
+
+    def __init__(self, registry: Registry, directory: Path, *, flush_interval_ms: int = 1000) -> None:
+        self.registry = registry
+        self.directory = directory
+        self.flush_interval_ms = flush_interval_ms
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._flushed = False
+
+    def flush(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._flushed = True
+        pid = os.getpid()
+        path = self.directory / f"metrics-{pid}.json"
+        tmp = self.directory / f".metrics-{pid}.json.tmp"
+        tmp.write_text(json.dumps(self.registry.snapshot(), separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def collect(self) -> str:
+        self.flush()
+        snapshots = []
+        for path in sorted(self.directory.glob("metrics-*.json")):
+            snapshot = _read_snapshot(path)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return self.registry.render(snapshots)
+
+    def fold_dead(self) -> None:
+        """Merge the snapshot files of exited workers into `metrics-dead.json`.
+
+        A file carrying this process's pid is a previous owner's until this
+        process first flushes. Holds an exclusive lock on the directory so
+        workers starting together fold each file once.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        own = os.getpid()
+        with open(self.directory / ".metrics.lock", "a+b") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            dead_path = self.directory / DEAD_NAME
+            snapshots = [snapshot for snapshot in (_read_snapshot(dead_path),) if snapshot is not None]
+            folded = []
+            for path in sorted(self.directory.glob("metrics-*.json")):
+                pid = _snapshot_pid(path.name, "metrics-", ".json")
+                if pid is None or (pid == own and self._flushed) or (pid != own and _pid_alive(pid)):
+                    continue
+                snapshot = _read_snapshot(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+                folded.append(path)
+            for tmp in self.directory.glob(".metrics-*.json.tmp"):
+                pid = _snapshot_pid(tmp.name, ".metrics-", ".json.tmp")
+                if pid is not None and pid != own and not _pid_alive(pid):
+                    tmp.unlink(missing_ok=True)
+            if not folded:
+                return
+            tmp = self.directory / ".metrics-dead.json.tmp"
+            tmp.write_text(json.dumps(self.registry.merge(snapshots), separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp, dead_path)
+            for path in folded:
+                path.unlink(missing_ok=True)
+
+    def start(self) -> None:
+        try:
+            self.fold_dead()
+        except OSError:
+            pass
+        if self.flush_interval_ms <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="metrics-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.flush_interval_ms / 1000):
+            try:
+                self.flush()
+            except OSError:
+                continue
+
+
+class RequestTimingMiddleware:
+    """ASGI middleware observing `REQUEST_SECONDS` for every HTTP request.
+
+    The route label is the matched path template (e.g. `/v1/aggregate`), so
+    label cardinality stays bounded; unmatched paths are grouped together.
+    Streaming responses are timed until their last byte is sent.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, labels=(scope["method"], path, status))
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "isolation_api_request_duration_seconds",
+    "Time from request start to the last response byte, by route.",
+    ("method", "route", "status"),
+)
+HMAC_VERIFY_SECONDS = REGISTRY.histogram(
+    "isolation_api_hmac_verify_seconds", "Time spent verifying X-Signature on writes."
+)
+CORE_HASH_SECONDS = REGISTRY.histogram(
+    "isolation_api_core_hash_seconds",
+    "Time spent hashing the core file (sha256_file and snapshot loads).",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+APPEND_SECONDS = REGISTRY.histogram(
+    "isolation_api_append_seconds", "Time spent appending (and fsyncing) one batch to a namespace log."
+)
+LINES_WRITTEN = REGISTRY.counter(
+    "isolation_api_namespace_lines_written_total", "Entries appended per namespace.", ("namespace",)
+)
+BYTES_WRITTEN = REGISTRY.counter(
+    "isolation_api_namespace_bytes_written_total", "Bytes appended per namespace.", ("namespace",)
+)
+AGGREGATE_LINES_SCANNED = REGISTRY.counter(
+    "isolation_api_aggregate_lines_scanned_total", "Stored lines read while serving aggregate queries.", ("source",)
+)
+TAIL_LINES_SCANNED = REGISTRY.counter(
+    "isolation_api_tail_lines_scanned_total", "Stored lines read while polling for the live tail.", ("source",)
+)
+AGGREGATE_LINES_RETURNED = REGISTRY.counter(
+    "isolation_api_aggregate_lines_returned_total", "Rows returned by /v1/aggregate."
+)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+# Shared bucket state: tokens, then the time.monotonic() they were counted at.
+_BUCKET_STATE = struct.Struct("<dd")
+
+
+class RateLimited(Exception):
+    """A write was refused; `retry_after` is the suggested wait in seconds."""
+
+    def __init__(self, detail: str, retry_after: float) -> None:
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Sustained entries per second and the burst allowed on top of it."""
+
+    rate: float
+    burst: float
+
+    @staticmethod
+    def parse(spec: str) -> "RateLimit":
+        """Parse "<rate>" or "<rate>/<burst>"; the burst defaults to one second's worth."""
+        rate_s, _, burst_s = spec.partition("/")
+        try:
+            rate = float(rate_s)
+            burst = float(burst_s) if burst_s else max(1.0, rate)
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {spec!r}; expected <rate> or <rate>/<burst>") from None
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit {spec!r}; rate must be > 0 and burst >= 1")
+        return RateLimit(rate=rate, burst=burst)
+
+
+class TokenBucket:
+    """Classic token bucket. A request may overdraw it, so a large batch is
+    admitted once enough tokens for (up to) a full burst are available and
+    then paid back before anything else from the same namespace is admitted.
+    """
+
+    def __init__(self, limit: RateLimit, now: float) -> None:
+        self.limit = limit
+        self.tokens = limit.burst
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Consume `cost` tokens and return 0, or return the seconds to wait."""
+        self.tokens = min(self.limit.burst, self.tokens + (now - self.updated) * self.limit.rate)
+        self.updated = now
+        need = min(cost, self.limit.burst)
+        if self.tokens < need:
+            return (need - self.tokens) / self.limit.rate
+        self.tokens -= cost
+        return 0.0
+
+
+class WriteAdmission:
+    """Per-namespace admission control for partner writes.
+
+    Each namespace gets its own token bucket (`default` unless overridden in
+    `overrides`; None means unlimited) and its own cap on writes that are
+    accepted but not yet committed. A noisy namespace therefore hits its own
+    limits instead of queueing ahead of everyone else.
+
+    With `state_dir`, each bucket lives in `<state_dir>/<namespace>.bucket`
+    and is updated under an exclusive flock, so every worker process on the
+    host draws from the same bucket (time.monotonic() is system-wide there).
+    The in-flight cap guards each worker's own writer queue and stays per
+    process.
+    """
+
+    def __init__(
+        self,
+        *,
+        default: RateLimit | None = None,
+        overrides: dict[str, RateLimit] | None = None,
+        max_inflight: int = 0,
+        state_dir: Path | None = None,
+    ) -> None:
+        self.default = default
+        self.overrides = dict(overrides or {})
+        self.max_inflight = max_inflight
+        self.state_dir = state_dir if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+        # Guards the state files: flock does not exclude threads sharing a descriptor.
+        # Never held together with `_lock`, so release() does not wait on other processes.
+        self._state_lock = threading.Lock()
+        self._state_fds: dict[str, int] = {}
+        self._inflight: dict[str, int] = {}
+
+    def _limit_for(self, namespace: str) -> RateLimit | None:
+        return self.overrides.get(namespace, self.default)
+
+    def blocks(self, namespace: str) -> bool:
+        """Whether `acquire(namespace)` may wait on a lock held by another
+        process; async callers should run it in a thread then."""
+        return self.state_dir is not None and self._limit_for(namespace) is not None
+
+    def acquire(self, namespace: str, cost: int = 1) -> None:
+        """Take one in-flight slot for a write of `cost` entries, or raise RateLimited.
+
+        Every successful call must be paired with `release(namespace)` once
+        the write is committed (or failed).
+        """
+        limit = self._limit_for(namespace)
+        shared = limit is not None and self.state_dir is not None
+        with self._lock:
+            inflight = self._inflight.get(namespace, 0)
+            if self.max_inflight > 0 and inflight >= self.max_inflight:
+                raise RateLimited("Too many writes in flight for this namespace", retry_after=1.0)
+            if limit is not None and not shared:
+                now = time.monotonic()
+                bucket = self._buckets.get(namespace)
+                if bucket is None:
+                    bucket = self._buckets[namespace] = TokenBucket(limit, now)
+                wait = bucket.take(cost, now)
+                if wait > 0:
+                    raise RateLimited("Rate limit exceeded for this namespace", retry_after=wait)
+            self._inflight[namespace] = inflight + 1
+        if not shared:
+            return
+        assert limit is not None
+        # The slot is held while waiting on the file lock, so the in-flight cap still applies.
+        try:
+            with self._state_lock:
+                wait = self._take_shared(namespace, limit, cost)
+        except BaseException:
+            self.release(namespace)
+            raise
+        if wait > 0:
+            self.release(namespace)
+            raise RateLimited("Rate limit exceeded for this namespace", retry_after=wait)
+
+    def _take_shared(self, namespace: str, limit: RateLimit, cost: int) -> float:
+        assert self.state_dir is not None
+        fd = self._state_fds.get(namespace)
+        if fd is None:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            path = self.state_dir / f"{namespace}.bucket"
+            fd = self._state_fds[namespace] = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            now = time.monotonic()
+            bucket = TokenBucket(limit, now)
+            raw = os.pread(fd, _BUCKET_STATE.size, 0)
+            if len(raw) == _BUCKET_STATE.size:
+                bucket.tokens, bucket.updated = _BUCKET_STATE.unpack(raw)
+                # A state file from before a reboot carries a later clock; start full.
+                if bucket.updated > now:
+                    bucket.tokens, bucket.updated = limit.burst, now
+            wait = bucket.take(cost, now)
+            os.pwrite(fd, _BUCKET_STATE.pack(bucket.tokens, bucket.updated), 0)
+            return wait
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        with self._state_lock:
+            for fd in self._state_fds.values():
+                os.close(fd)
+            self._state_fds.clear()
+
+    def release(self, namespace: str) -> None:
+        with self._lock:
+            remaining = self._inflight[namespace] - 1
+            if remaining:
+                self._inflight[namespace] = remaining
+            else:
+                del self._inflight[namespace]
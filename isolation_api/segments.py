@@ -0,0 +1,525 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import IO, Iterable, Iterator
+
+from .compression import CODECS, DEFAULT_BLOCK_BYTES, codec_of, compress_file, index_path, open_compressed, plain_name
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+ACTIVE_NAME = "entries.jsonl"
+MANIFEST_NAME = "manifest.json"
+
+_NEW_ACTIVE_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0)
+
+
+@dataclass(frozen=True)
+class SegmentPolicy:
+    """Rotation/retention knobs for namespace logs; 0 / None disables each one.
+
+    - max_bytes / max_age_seconds: seal the active `entries.jsonl` once it
+      would exceed this size, or is older than this.
+    - retention_seconds: delete sealed segments whose newest `ts` is older.
+    - compress_after_seconds: compress sealed segments this long after
+      sealing, with `compress_codec` ("gzip" or "lzma") in seekable blocks of
+      about `compress_block_bytes` (see compression.py).
+    """
+
+    max_bytes: int = 0
+    max_age_seconds: int = 0
+    retention_seconds: int = 0
+    compress_after_seconds: int | None = None
+    compress_codec: str = "gzip"
+    compress_block_bytes: int = DEFAULT_BLOCK_BYTES
+
+    @property
+    def rotates(self) -> bool:
+        return self.max_bytes > 0 or self.max_age_seconds > 0
+
+    @property
+    def maintains(self) -> bool:
+        return self.retention_seconds > 0 or self.compress_after_seconds is not None
+
+
+@dataclass(frozen=True)
+class Segment:
+    """A sealed, immutable part of a namespace log.
+
+    Offsets are logical: `base` is where this segment starts in the
+    concatenation of every segment ever written, so positions (cursors,
+    index entries) survive rotation, compression and pruning.
+    """
+
+    seq: int
+    file: str
+    base: int
+    bytes: int
+    lines: int
+    ts_min: int | None
+    ts_max: int | None
+    sealed_at: int
+
+    @property
+    def end(self) -> int:
+        return self.base + self.bytes
+
+    def overlaps(self, since: int | None, until: int | None) -> bool:
+        if self.ts_min is None or self.ts_max is None:
+            return True
+        if since is not None and self.ts_max < since:
+            return False
+        if until is not None and self.ts_min > until:
+            return False
+        return True
+
+
+@dataclass(frozen=True)
+class Manifest:
+    segments: tuple[Segment, ...] = ()
+    active_base: int = 0
+    active_since: int | None = None
+    active_ino: int | None = None
+    next_seq: int = 1
+
+    @staticmethod
+    def load(ns_dir: Path) -> "Manifest":
+        try:
+            raw = json.loads((ns_dir / MANIFEST_NAME).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return Manifest()
+        return Manifest(
+            segments=tuple(Segment(**seg) for seg in raw.get("segments", [])),
+            active_base=raw.get("active_base", 0),
+            active_since=raw.get("active_since"),
+            active_ino=raw.get("active_ino"),
+            next_seq=raw.get("next_seq", 1),
+        )
+
+    def save(self, ns_dir: Path) -> None:
+        payload = asdict(self)
+        payload["segments"] = [asdict(seg) for seg in self.segments]
+        tmp = ns_dir / f".{MANIFEST_NAME}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n", encoding="utf-8")
+        os.replace(tmp, ns_dir / MANIFEST_NAME)
+
+
+_TS_PREFIX = b'{"ts":'
+
+
+def row_ts(line: bytes) -> int:
+    """Read the `ts` of a stored namespace line, decoding JSON only as a fallback.
+
+    The API writes `ts` as the first key, so it is normally parsed straight
+    from the raw bytes. Lines without an integer `ts` sort as 0.
+    """
+    if line.startswith(_TS_PREFIX):
+        end = len(_TS_PREFIX)
+        while end < len(line) and 48 <= line[end] <= 57:
+            end += 1
+        if end > len(_TS_PREFIX) and line[end : end + 1] in (b",", b"}"):
+            return int(line[len(_TS_PREFIX) : end])
+    try:
+        ts = json.loads(line).get("ts")
+    except (ValueError, AttributeError):
+        return 0
+    return ts if isinstance(ts, int) and not isinstance(ts, bool) else 0
+
+
+def _line_ts(line: bytes) -> int | None:
+    ts = row_ts(line)
+    return ts if ts else None
+
+
+def _scan_sealed(path: Path, size: int) -> tuple[int, int | None, int | None]:
+    lines = 0
+    ts_min: int | None = None
+    ts_max: int | None = None
+    with path.open("rb") as f:
+        remaining = size
+        for line in f:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            if not line.strip():
+                continue
+            lines += 1
+            ts = _line_ts(line)
+            if ts is not None:
+                ts_min = ts if ts_min is None else min(ts_min, ts)
+                ts_max = ts if ts_max is None else max(ts_max, ts)
+    return lines, ts_min, ts_max
+
+
+def active_since(ns_dir: Path, manifest: Manifest, active_ino: int) -> int | None:
+    """When the current active segment started (first line's ts for pre-segment logs)."""
+    if manifest.active_ino == active_ino and manifest.active_since is not None:
+        return manifest.active_since
+    try:
+        with (ns_dir / ACTIVE_NAME).open("rb") as f:
+            first = f.readline()
+    except FileNotFoundError:
+        return None
+    return _line_ts(first) if first.endswith(b"\n") else None
+
+
+def rotate_locked(ns_dir: Path, active_fd: int, *, now: int | None = None) -> int:
+    """Seal the active segment and return a new active fd.
+
+    The caller must hold LOCK_EX on `active_fd`, which must still be the file
+    at `ns_dir/entries.jsonl`. The returned fd is already LOCK_EX-locked, so
+    readers and other workers wait until the manifest describes it; the
+    caller unlocks both. There is never a moment without an `entries.jsonl`
+    that another worker could accidentally create.
+    """
+    now = int(time.time()) if now is None else now
+    manifest = Manifest.load(ns_dir)
+    size = os.fstat(active_fd).st_size
+    active = ns_dir / ACTIVE_NAME
+    lines, ts_min, ts_max = _scan_sealed(active, size)
+
+    seq = manifest.next_seq
+    sealed_name = f"entries-{seq:06d}.jsonl"
+    tmp = ns_dir / f".entries.{os.getpid()}.{seq}.new"
+    new_fd = os.open(tmp, _NEW_ACTIVE_FLAGS, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(new_fd, fcntl.LOCK_EX)
+        try:
+            os.link(active, ns_dir / sealed_name)
+        except FileExistsError:
+            # Left over by a rotation that died before saving the manifest.
+            (ns_dir / sealed_name).unlink()
+            os.link(active, ns_dir / sealed_name)
+        os.replace(tmp, active)
+    except BaseException:
+        os.close(new_fd)
+        tmp.unlink(missing_ok=True)
+        raise
+
+    segment = Segment(
+        seq=seq,
+        file=sealed_name,
+        base=manifest.active_base,
+        bytes=size,
+        lines=lines,
+        ts_min=ts_min,
+        ts_max=ts_max,
+        sealed_at=now,
+    )
+    Manifest(
+        segments=manifest.segments + (segment,),
+        active_base=manifest.active_base + size,
+        active_since=now,
+        active_ino=os.fstat(new_fd).st_ino,
+        next_seq=seq + 1,
+    ).save(ns_dir)
+    return new_fd
+
+
+def _open_segment(ns_dir: Path, seg: Segment) -> IO[bytes] | None:
+    """Open a sealed segment, following a concurrent compression; None if pruned."""
+    plain = plain_name(seg.file)
+    for name in (seg.file, plain, *(plain + suffix for suffix in CODECS.values())):
+        path = ns_dir / name
+        try:
+            if codec_of(name) is not None:
+                return open_compressed(path)  # type: ignore[return-value]
+            return path.open("rb")
+        except FileNotFoundError:
+            continue
+    return None
+
+
+class LogReader:
+    """Consistent view of one namespace log: sealed segments plus the active file.
+
+    The active file is opened and share-locked before the manifest is read,
+    so a concurrent rotation (which holds the exclusive lock on both the old
+    and new active file) cannot leave the two out of sync. Pass `lock=False`
+    when the caller already holds the exclusive lock on the active file.
+    """
+
+    def __init__(self, ns_dir: Path, *, lock: bool = True) -> None:
+        self.ns_dir = ns_dir
+        self.lock = lock and fcntl is not None
+        self.manifest = Manifest()
+        self.active: IO[bytes] | None = None
+
+    def __enter__(self) -> "LogReader":
+        active_path = self.ns_dir / ACTIVE_NAME
+        while True:
+            try:
+                f = active_path.open("rb")
+            except FileNotFoundError:
+                self.manifest = Manifest.load(self.ns_dir)
+                return self
+            if self.lock:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            try:
+                if os.fstat(f.fileno()).st_ino != os.stat(active_path).st_ino:
+                    f.close()
+                    continue
+                self.manifest = Manifest.load(self.ns_dir)
+            except FileNotFoundError:
+                f.close()
+                continue
+            finally:
+                if self.lock and not f.closed:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            self.active = f
+            return self
+
+    def __exit__(self, *exc: object) -> None:
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+    @property
+    def start(self) -> int:
+        """Lowest logical offset still on disk (after pruning)."""
+        if self.manifest.segments:
+            return self.manifest.segments[0].base
+        return self.manifest.active_base
+
+    def end(self) -> int:
+        """Logical offset just past the last complete line."""
+        if self.active is None:
+            return self.manifest.active_base
+        f = self.active
+        pos = os.fstat(f.fileno()).st_size
+        while pos > 0:
+            step = min(pos, 64 * 1024)
+            f.seek(pos - step)
+            nl = f.read(step).rfind(b"\n")
+            if nl >= 0:
+                return self.manifest.active_base + pos - step + nl + 1
+            pos -= step
+        return self.manifest.active_base
+
+    def iter_lines(
+        self, start: int = 0, *, since: int | None = None, until: int | None = None
+    ) -> Iterator[tuple[bytes, int]]:
+        """(line, logical end) for every complete non-blank line at or after `start`.
+
+        Sealed segments whose ts range misses [since, until] are skipped
+        without being opened; rows themselves are not filtered here.
+        """
+        if start > self.end():
+            # The log is shorter than the cursor, so it was replaced: start over.
+            start = 0
+        start = max(start, self.start)
+
+        for seg in self.manifest.segments:
+            if seg.end <= start or not seg.overlaps(since, until):
+                continue
+            f = _open_segment(self.ns_dir, seg)
+            if f is None:
+                continue
+            with f:
+                rel = max(0, start - seg.base)
+                f.seek(rel)
+                pos = seg.base + rel
+                for line in f:
+                    pos += len(line)
+                    if line.strip():
+                        yield line, pos
+
+        if self.active is None:
+            return
+        base = self.manifest.active_base
+        rel = max(0, start - base)
+        self.active.seek(rel)
+        pos = base + rel
+        for line in self.active:
+            if not line.endswith(b"\n"):
+                # A batch is still being appended; resume here next time.
+                return
+            pos += len(line)
+            if line.strip():
+                yield line, pos
+
+    def lines_at(
+        self, offsets: Iterable[int], *, since: int | None = None, until: int | None = None
+    ) -> Iterator[tuple[bytes, int]]:
+        """(line, logical end) for the lines starting at each of `offsets` (ascending).
+
+        Offsets that were pruned, lie past the last complete line, or fall in
+        a sealed segment outside [since, until] are skipped; each segment is
+        opened at most once.
+        """
+        end = self.end()
+        segments = self.manifest.segments
+        i = 0
+        current: Segment | None = None
+        f: IO[bytes] | None = None
+        try:
+            for offset in offsets:
+                if offset < self.start or offset >= end:
+                    continue
+                while i < len(segments) and segments[i].end <= offset:
+                    i += 1
+                if i < len(segments):
+                    seg = segments[i]
+                    if offset < seg.base or not seg.overlaps(since, until):
+                        continue
+                    if seg is not current:
+                        if f is not None:
+                            f.close()
+                        f = _open_segment(self.ns_dir, seg)
+                        current = seg
+                    if f is None:
+                        continue
+                    fh, base = f, seg.base
+                elif self.active is not None:
+                    fh, base = self.active, self.manifest.active_base
+                else:
+                    continue
+                fh.seek(offset - base)
+                line = fh.readline()
+                if line.endswith(b"\n") and line.strip():
+                    yield line, offset + len(line)
+        finally:
+            if f is not None:
+                f.close()
+
+
+    def at_line_start(self, offset: int) -> bool:
+        """Whether `offset` is a line start, as every offset the server hands out is.
+
+        Offsets before `start` or past `end()` pass: readers already resolve
+        them (pruned, or the log was replaced). Anything else must directly
+        follow a newline or begin a segment.
+        """
+        if offset <= self.start or offset >= self.end():
+            return True
+        for seg in self.manifest.segments:
+            if seg.base <= offset < seg.end:
+                if offset == seg.base:
+                    return True
+                f = _open_segment(self.ns_dir, seg)
+                if f is None:
+                    return True
+                with f:
+                    # Block-compressed readers only offer readline(); it is just b"\n" at a line end.
+                    f.seek(offset - seg.base - 1)
+                    return f.readline() == b"\n"
+        if self.active is None or offset <= self.manifest.active_base:
+            return True
+        self.active.seek(offset - self.manifest.active_base - 1)
+        return self.active.read(1) == b"\n"
+
+
+def lock_active(ns_dir: Path) -> IO[bytes] | None:
+    """Exclusive lock on the active file, serializing manifest and index edits with appends."""
+    active_path = ns_dir / ACTIVE_NAME
+    while True:
+        try:
+            f = active_path.open("rb")
+        except FileNotFoundError:
+            return None
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            same = os.fstat(f.fileno()).st_ino == os.stat(active_path).st_ino
+        except FileNotFoundError:
+            same = False
+        if same:
+            return f
+        f.close()
+
+
+def maintain_namespace(ns_dir: Path, policy: SegmentPolicy, *, now: int | None = None) -> None:
+    """Apply retention and compression to sealed segments; never touches the active file."""
+    now = int(time.time()) if now is None else now
+    manifest = Manifest.load(ns_dir)
+
+    # Compress outside the lock: sealed segments never change.
+    compressed: dict[int, str] = {}
+    if policy.compress_after_seconds is not None:
+        suffix = CODECS[policy.compress_codec]
+        for seg in manifest.segments:
+            if codec_of(seg.file) is not None or seg.sealed_at > now - policy.compress_after_seconds:
+                continue
+            dst = ns_dir / f"{seg.file}{suffix}"
+            try:
+                compress_file(ns_dir / seg.file, dst, block_bytes=policy.compress_block_bytes)
+            except FileNotFoundError:
+                continue
+            compressed[seg.seq] = dst.name
+
+    lock = lock_active(ns_dir)
+    if lock is None:
+        return
+    removed: list[Path] = []
+    with lock:
+        manifest = Manifest.load(ns_dir)
+        kept: list[Segment] = []
+        for seg in manifest.segments:
+            expired = (
+                policy.retention_seconds > 0
+                and seg.ts_max is not None
+                and seg.ts_max < now - policy.retention_seconds
+            )
+            if expired:
+                removed.append(ns_dir / seg.file)
+                if seg.seq in compressed:
+                    removed.append(ns_dir / compressed[seg.seq])
+                if codec_of(removed[-1].name) is not None:
+                    removed.append(index_path(removed[-1]))
+                continue
+            if seg.seq in compressed:
+                removed.append(ns_dir / seg.file)
+                seg = replace(seg, file=compressed[seg.seq])
+            kept.append(seg)
+        if removed:
+            replace(manifest, segments=tuple(kept)).save(ns_dir)
+    # Readers that still hold an old manifest follow the rename or skip the gap.
+    for path in removed:
+        path.unlink(missing_ok=True)
+
+
+class SegmentMaintainer:
+    """Background thread applying `maintain_namespace` to every namespace on an interval."""
+
+    def __init__(self, agents_root: Path, policy: SegmentPolicy, interval_seconds: int = 60) -> None:
+        self.agents_root = agents_root
+        self.policy = policy
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> None:
+        if not self.agents_root.exists():
+            return
+        for ns_dir in sorted(self.agents_root.iterdir()):
+            if (ns_dir / MANIFEST_NAME).is_file():
+                maintain_namespace(ns_dir, self.policy)
+
+    def start(self) -> None:
+        if not self.policy.maintains or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="segment-maintainer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except OSError:
+                continue
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import os
+from itertools import islice
+from pathlib import Path
+
+from .aggregate import Row, iter_namespace_rows, merge_namespace_rows, namespace_logs
+from .metrics import TAIL_LINES_SCANNED
+from .segments import ACTIVE_NAME, LogReader
+
+# Rows read per namespace per poll; the rest is picked up by the next poll.
+_POLL_READ_LIMIT = 10_000
+
+
+class TailSubscription:
+    """One consumer of the hub; `offsets` is what it has already been sent."""
+
+    def __init__(self, offsets: dict[str, int], max_pending: int) -> None:
+        self.offsets = dict(offsets)
+        self.queue: asyncio.Queue[Row] = asyncio.Queue(maxsize=max_pending)
+        # Rows below the hub's position that must be read from disk first.
+        self.catching_up = True
+        self.overflowed = False
+
+    def accept(self, rows: list[Row]) -> list[Row]:
+        fresh: list[Row] = []
+        for row in rows:
+            # Rows can arrive twice (catch-up read and live queue); offsets dedupe them.
+            if row.end > self.offsets.get(row.source, 0):
+                self.offsets[row.source] = row.end
+                fresh.append(row)
+        return fresh
+
+
+class TailHub:
+    """Single watcher over all namespace logs that fans new rows out to subscribers.
+
+    While anyone is subscribed, one task stats each namespace's log every
+    `poll_interval_ms` (or right after a local write calls `wake()`), reads
+    only the newly completed lines, and pushes them to every subscription.
+    Subscribers that resume from older offsets, or fall behind and overflow
+    their queue, read the gap from disk themselves and then rejoin the live
+    feed.
+    """
+
+    def __init__(self, agents_root: Path, *, poll_interval_ms: int = 250, max_pending: int = 10_000) -> None:
+        self.agents_root = agents_root
+        self.poll_interval = poll_interval_ms / 1000
+        self.max_pending = max_pending
+        self._subs: set[TailSubscription] = set()
+        self._positions: dict[str, int] | None = None
+        # (inode, size) of each active file at the last poll; unchanged files are not reopened.
+        self._seen: dict[str, tuple[int, int]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._wake: asyncio.Event | None = None
+
+    def _ends(self) -> dict[str, int]:
+        ends: dict[str, int] = {}
+        for ns, ns_dir in namespace_logs(self.agents_root):
+            with LogReader(ns_dir) as log:
+                ends[f"agent:{ns}"] = log.end()
+        return ends
+
+    async def subscribe(self, offsets: dict[str, int] | None = None) -> TailSubscription:
+        """Register a subscriber. Without `offsets` it only sees rows written from now on."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            ends = await asyncio.to_thread(self._ends)
+            # Another subscriber may have started the watcher while we read.
+            if self._task is None or self._task.done() or self._loop is not loop:
+                self._loop = loop
+                self._wake = asyncio.Event()
+                self._subs = set()
+                self._positions = ends
+                self._seen = {}
+                self._task = loop.create_task(self._run())
+        assert self._positions is not None
+        sub = TailSubscription(self._positions if offsets is None else offsets, self.max_pending)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: TailSubscription) -> None:
+        self._subs.discard(sub)
+
+    def wake(self) -> None:
+        """Poll now instead of waiting for the interval (called after local writes)."""
+        if self._wake is not None and self._loop is not None:
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self._loop:
+                self._wake.set()
+
+    def _read_new(self, positions: dict[str, int]) -> tuple[list[Row], dict[str, int]]:
+        streams = []
+        for ns, ns_dir in namespace_logs(self.agents_root):
+            source = f"agent:{ns}"
+            try:
+                st = os.stat(ns_dir / ACTIVE_NAME)
+            except FileNotFoundError:
+                continue
+            if self._seen.get(source) == (st.st_ino, st.st_size):
+                continue
+            rows = list(
+                islice(
+                    iter_namespace_rows(ns, ns_dir, positions.get(source, 0), scan_counter=TAIL_LINES_SCANNED),
+                    _POLL_READ_LIMIT,
+                )
+            )
+            if len(rows) < _POLL_READ_LIMIT:
+                self._seen[source] = (st.st_ino, st.st_size)
+            streams.append(rows)
+        rows = list(heapq.merge(*streams, key=lambda row: row.ts))
+        new_positions = dict(positions)
+        for row in rows:
+            new_positions[row.source] = row.end
+        return rows, new_positions
+
+    async def _run(self) -> None:
+        assert self._wake is not None and self._positions is not None
+        while self._subs:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            rows, self._positions = await asyncio.to_thread(self._read_new, self._positions)
+            if not rows:
+                continue
+            for sub in list(self._subs):
+                if sub.overflowed:
+                    continue
+                for row in rows:
+                    try:
+                        sub.queue.put_nowait(row)
+                    except asyncio.QueueFull:
+                        sub.overflowed = True
+                        break
+
+    async def next_rows(self, sub: TailSubscription, *, timeout: float, limit: int = 1000) -> list[Row]:
+        """New rows for `sub` (at most `limit`), or [] if none arrived within `timeout`."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if sub.overflowed:
+                # Everything queued is also on disk past sub.offsets; reread from there.
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.overflowed = False
+                sub.catching_up = True
+            if sub.catching_up:
+                rows = await asyncio.to_thread(
+                    lambda: list(
+                        islice(
+                            merge_namespace_rows(
+                                self.agents_root, offsets=sub.offsets, scan_counter=TAIL_LINES_SCANNED
+                            ),
+                            limit,
+                        )
+                    )
+                )
+                fresh = sub.accept(rows)
+                if fresh:
+                    return fresh
+                sub.catching_up = False
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return []
+            try:
+                first = await asyncio.wait_for(sub.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return []
+            batch = [first]
+            while len(batch) < limit and not sub.queue.empty():
+                batch.append(sub.queue.get_nowait())
+            fresh = sub.accept(batch)
+            if fresh:
+                return fresh
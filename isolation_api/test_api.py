@@ -1,16 +1,41 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import fcntl
+import gzip
 import hashlib
 import hmac
 import json
+import lzma
+import multiprocessing
+import shutil
+import os
+import subprocess
+import sys
 import tempfile
+import threading
 import time
 import unittest
+from dataclasses import replace
 from pathlib import Path
+from typing import Any
+from unittest import mock
 
 from fastapi.testclient import TestClient
 
-from isolation_api.app import IsolationApiSettings, create_app, sha256_file
+from isolation_api.app import IsolationApiSettings, create_app
+from isolation_api import compaction, compression, segments
+from isolation_api.aggregate import PayloadMatch, advance_offsets, iter_aggregate, iter_namespace_rows
+from isolation_api.bench import generate_core, peak_rss_bytes, percentile, reset_peak_rss, summarize
+from isolation_api.compaction import AggregateSnapshotStore, compact_namespaces
+from isolation_api.core import CoreDigestCache, sha256_file
+from isolation_api.bucket_index import BucketIndex, rebuild_bucket_index
+from isolation_api.metrics import AGGREGATE_LINES_SCANNED, TAIL_LINES_SCANNED, MultiProcessMetrics, Registry
+from isolation_api.ratelimit import RateLimit, RateLimited, TokenBucket, WriteAdmission
+from isolation_api.segments import LogReader, Manifest, SegmentPolicy, maintain_namespace
+from isolation_api.tail import TailHub
+from isolation_api.writer import GroupCommitWriter
 
 
 class TestIsolationApi(unittest.TestCase):
@@ -58,6 +83,180 @@ class TestIsolationApi(unittest.TestCase):
             self.assertEqual(r.status_code, 200)
             self.assertEqual(len(r.json()["items"]), 1)
 
+    def test_core_hash_cached_until_file_changes(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+
+            first = client.get("/v1/core/hash").json()
+            self.assertFalse(first["from_cache"])
+            second = client.get("/v1/core/hash").json()
+            self.assertTrue(second["from_cache"])
+            self.assertEqual(second["core_sha256_current"], first["core_sha256_current"])
+            self.assertEqual(second["verified_at"], first["verified_at"])
+
+            with core_file.open("a", encoding="utf-8") as f:
+                f.write(json.dumps({"S1": "CORE-0003", "S2": "acme.widgets"}, separators=(",", ":")) + "\n")
+
+            third = client.get("/v1/core/hash").json()
+            self.assertFalse(third["from_cache"])
+            self.assertFalse(third["matches"])
+            self.assertEqual(third["core_sha256_current"], sha256_file(core_file))
+
+    def test_core_reverify_does_not_block_cached_digests(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            core_file, _ = self._make_core(Path(td))
+            cache = CoreDigestCache(core_file)
+            first = cache.digest()
+
+            hashing, release = threading.Event(), threading.Event()
+
+            def slow_sha256_file(path: Path) -> str:
+                hashing.set()
+                release.wait(5)
+                return sha256_file(path)
+
+            with mock.patch("isolation_api.core.sha256_file", slow_sha256_file):
+                thread = threading.Thread(target=cache.reverify)
+                thread.start()
+                try:
+                    self.assertTrue(hashing.wait(5))
+                    started = time.monotonic()
+                    cached = cache.digest()
+                    self.assertLess(time.monotonic() - started, 1)
+                finally:
+                    release.set()
+                    thread.join()
+            self.assertTrue(cached.from_cache)
+            self.assertEqual(cached.sha256, first.sha256)
+            self.assertTrue(cache.digest().from_cache)
+
+    def test_concurrent_core_digest_misses_hash_once(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            core_file, _ = self._make_core(Path(td))
+            cache = CoreDigestCache(core_file)
+            calls = 0
+            calls_lock = threading.Lock()
+            release = threading.Event()
+
+            def slow_sha256_file(path: Path) -> str:
+                nonlocal calls
+                with calls_lock:
+                    calls += 1
+                release.wait(5)
+                return sha256_file(path)
+
+            with mock.patch("isolation_api.core.sha256_file", slow_sha256_file):
+                results: list[str] = []
+                threads = [threading.Thread(target=lambda: results.append(cache.digest().sha256)) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                time.sleep(0.2)
+                release.set()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual(calls, 1)
+            self.assertEqual(results, [sha256_file(core_file)] * 8)
+            self.assertTrue(cache.digest().from_cache)
+
+    def test_core_read_offset_and_cursor_pagination(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+            rows = [{"S1": f"CORE-{i:04d}", "S2": "acme.widgets"} for i in range(1, 8)]
+            core_file.write_text("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in rows), encoding="utf-8")
+            core_sha_file.write_text(f"{sha256_file(core_file)}  core.jsonl\n", encoding="utf-8")
+
+            # From disk through the line index, and from the in-memory snapshot.
+            for snapshot_max_bytes in (0, 1 << 20):
+                with self.subTest(snapshot_max_bytes=snapshot_max_bytes):
+                    settings = IsolationApiSettings(
+                        data_dir=data_dir / str(snapshot_max_bytes),
+                        core_file=core_file,
+                        core_sha_file=core_sha_file,
+                        token_to_namespace={},
+                        hmac_secrets_by_namespace={},
+                        require_hmac=False,
+                        hmac_max_skew_seconds=300,
+                        core_snapshot_max_bytes=snapshot_max_bytes,
+                    )
+                    client = TestClient(create_app(settings))
+
+                    r = client.get("/v1/core/read?offset=5&limit=10")
+                    self.assertEqual(r.status_code, 200)
+                    self.assertEqual([i["S1"] for i in r.json()["items"]], ["CORE-0006", "CORE-0007"])
+                    self.assertEqual(r.json()["total"], 7)
+                    self.assertIsNone(r.json()["next_cursor"])
+                    index_file = settings.data_dir / "index" / f"core-{sha256_file(core_file)}.offsets"
+                    self.assertEqual(index_file.exists(), snapshot_max_bytes == 0)
+
+                    seen: list[str] = []
+                    url = "/v1/core/read?limit=3"
+                    while url:
+                        payload = client.get(url).json()
+                        seen.extend(i["S1"] for i in payload["items"])
+                        url = f"/v1/core/read?limit=3&cursor={payload['next_cursor']}" if payload["next_cursor"] else ""
+                    self.assertEqual(seen, [r["S1"] for r in rows])
+
+                    r = client.get("/v1/core/read?cursor=not-a-cursor")
+                    self.assertEqual(r.status_code, 400)
+
+    def test_core_read_etag_and_snapshot_aggregate(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            core_file, core_sha_file = self._make_core(root)
+            sha = sha256_file(core_file)
+
+            clients = {}
+            for snapshot_max_bytes in (0, 1 << 20):
+                settings = IsolationApiSettings(
+                    data_dir=root / f"data-{snapshot_max_bytes}",
+                    core_file=core_file,
+                    core_sha_file=core_sha_file,
+                    token_to_namespace={},
+                    hmac_secrets_by_namespace={},
+                    require_hmac=False,
+                    hmac_max_skew_seconds=300,
+                    core_snapshot_max_bytes=snapshot_max_bytes,
+                )
+                clients[snapshot_max_bytes] = TestClient(create_app(settings))
+            client = clients[1 << 20]
+
+            r = client.get("/v1/core/read")
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers["ETag"], f'"{sha}"')
+            for header in (f'"{sha}"', f'W/"{sha}"', f'"other", "{sha}"', "*"):
+                r = client.get("/v1/core/read?offset=1", headers={"If-None-Match": header})
+                self.assertEqual(r.status_code, 304)
+                self.assertEqual(r.content, b"")
+                self.assertEqual(r.headers["ETag"], f'"{sha}"')
+            self.assertEqual(client.get("/v1/core/read", headers={"If-None-Match": '"other"'}).status_code, 200)
+
+            # Snapshot-backed aggregation matches the disk path, cursors included.
+            first = [c.get("/v1/aggregate?limit=1").json() for c in clients.values()]
+            self.assertEqual(first[0], first[1])
+            rest = [c.get(f"/v1/aggregate?cursor={first[0]['next_cursor']}").json() for c in clients.values()]
+            self.assertEqual(rest[0]["items"], rest[1]["items"])
+            self.assertEqual([i["S1"] for i in rest[1]["items"]], ["CORE-0002"])
+
+            # A core that no longer matches its pin is never served, cached or not.
+            core_file.write_text(core_file.read_text(encoding="utf-8") + '{"S1":"CORE-9999"}\n', encoding="utf-8")
+            r = client.get("/v1/core/read", headers={"If-None-Match": f'"{sha}"'})
+            self.assertEqual(r.status_code, 500)
+
     def test_namespace_bound_write(self) -> None:
         with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
             root = Path(td)
@@ -100,6 +299,496 @@ class TestIsolationApi(unittest.TestCase):
             self.assertIn('"namespace":"partner_alpha"', a_path.read_text(encoding="utf-8"))
             self.assertIn('"namespace":"partner_beta"', b_path.read_text(encoding="utf-8"))
 
+    def test_aggregate_ndjson_stream_matches_json(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            token = "token-a"
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={token: "partner_alpha"},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+            for claim in ("x", "y"):
+                r = client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": f"Bearer {token}"},
+                    json={"s_bucket": "S4_EVIDENCE", "payload": {"claim": claim}},
+                )
+                self.assertEqual(r.status_code, 200)
+
+            expected = client.get("/v1/aggregate").json()["items"]
+            self.assertEqual(len(expected), 4)
+
+            r = client.get("/v1/aggregate", headers={"Accept": "application/x-ndjson"})
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(r.headers["content-type"].startswith("application/x-ndjson"))
+            self.assertEqual([json.loads(line) for line in r.text.splitlines()], expected)
+
+            # A truncated stream always ends with a trailer, cursor or not.
+            r = client.get("/v1/aggregate?stream=1&limit=3")
+            lines = [json.loads(line) for line in r.text.splitlines()]
+            self.assertEqual(lines[:3], expected[:3])
+            self.assertTrue(lines[3]["has_more"])
+            r = client.get(f"/v1/aggregate?stream=1&cursor={lines[3]['next_cursor']}")
+            lines = [json.loads(line) for line in r.text.splitlines()]
+            self.assertEqual(lines[:1], expected[3:])
+            self.assertFalse(lines[1]["has_more"])
+
+    def test_aggregate_splices_source_into_raw_lines(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+            ns_dir = data_dir / "agents" / "partner_alpha"
+            ns_dir.mkdir(parents=True)
+            (ns_dir / "entries.jsonl").write_bytes(
+                '{"ts":1,"payload":{"claim":"caf\u00e9 \\"quoted\\""}}\n'.encode("utf-8")
+                + b"{}\n"
+                + b'{ "ts": 2 }  \n'
+            )
+
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+
+            r = client.get("/v1/aggregate")
+            self.assertEqual(r.status_code, 200)
+            payload = r.json()
+            self.assertEqual(payload["count"], 5)
+            self.assertEqual(payload["items"][0], {"source": "core", "S1": "CORE-0001", "S2": "acme.widgets"})
+            self.assertEqual(
+                payload["items"][2:],
+                [
+                    {"source": "agent:partner_alpha", "ts": 1, "payload": {"claim": 'caf\u00e9 "quoted"'}},
+                    {"source": "agent:partner_alpha"},
+                    {"source": "agent:partner_alpha", "ts": 2},
+                ],
+            )
+
+            r = client.get("/v1/core/read?limit=2")
+            self.assertEqual(r.json()["items"][1], {"S1": "CORE-0002", "S2": "acme.widgets"})
+
+    def test_aggregate_merges_namespaces_by_ts(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+            logs = {"zeta": [1, 4, 4, 9], "alpha": [2, 4, 7], "mid": [3, 8]}
+            for ns, stamps in logs.items():
+                ns_dir = data_dir / "agents" / ns
+                ns_dir.mkdir(parents=True)
+                (ns_dir / "entries.jsonl").write_text(
+                    "".join(json.dumps({"ts": t, "namespace": ns}, separators=(",", ":")) + "\n" for t in stamps),
+                    encoding="utf-8",
+                )
+
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+
+            items = client.get("/v1/aggregate").json()["items"]
+            self.assertEqual([i["source"] for i in items[:2]], ["core", "core"])
+            self.assertEqual(
+                [(i["ts"], i["namespace"]) for i in items[2:]],
+                [(1, "zeta"), (2, "alpha"), (3, "mid"), (4, "alpha"), (4, "zeta"), (4, "zeta"),
+                 (7, "alpha"), (8, "mid"), (9, "zeta")],
+            )
+
+            items = client.get("/v1/aggregate?per_namespace=1").json()["items"]
+            self.assertEqual([(i["ts"], i["namespace"]) for i in items[2:]], [(1, "zeta"), (2, "alpha"), (3, "mid")])
+
+    def test_aggregate_cursor_resumes_and_picks_up_new_rows(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            tokens = {"token-a": "partner_alpha", "token-b": "partner_beta"}
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace=tokens,
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+
+            def write(token: str, claim: str) -> None:
+                r = client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": f"Bearer {token}"},
+                    json={"s_bucket": "S4_EVIDENCE", "payload": {"claim": claim}},
+                )
+                self.assertEqual(r.status_code, 200)
+
+            for i in range(3):
+                write("token-a", f"a{i}")
+                write("token-b", f"b{i}")
+
+            seen: list[str] = []
+            cursor = None
+            while True:
+                url = "/v1/aggregate?limit=2" + (f"&cursor={cursor}" if cursor else "")
+                payload = client.get(url).json()
+                seen.extend(i.get("payload", {}).get("claim", i["source"]) for i in payload["items"])
+                cursor = payload["next_cursor"]
+                if not payload["has_more"]:
+                    break
+            self.assertEqual(sorted(seen), ["a0", "a1", "a2", "b0", "b1", "b2", "core", "core"])
+
+            write("token-b", "b3")
+            write("token-a", "a3")
+            payload = client.get(f"/v1/aggregate?cursor={cursor}").json()
+            self.assertEqual(sorted(i["payload"]["claim"] for i in payload["items"]), ["a3", "b3"])
+
+            r = client.get(f"/v1/aggregate?stream=1&limit=1&cursor={cursor}")
+            lines = [json.loads(line) for line in r.text.splitlines()]
+            self.assertEqual(len(lines), 2)
+            self.assertTrue(lines[-1]["has_more"])
+            r = client.get(f"/v1/aggregate?limit=5&cursor={lines[-1]['next_cursor']}")
+            self.assertEqual(r.json()["count"], 1)
+
+            self.assertEqual(client.get("/v1/aggregate?cursor=bm9wZQ").status_code, 400)
+
+            # Offsets that land mid-line are refused instead of failing on a partial line.
+            def cursor_for(offsets: dict[str, int]) -> str:
+                raw = json.dumps({"v": 1, "offsets": offsets}).encode("utf-8")
+                return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+            for offsets in ({"agent:partner_alpha": 7}, {"core": 3}):
+                bad = cursor_for(offsets)
+                for url in (
+                    f"/v1/aggregate?cursor={bad}",
+                    f"/v1/aggregate?stream=1&cursor={bad}",
+                    f"/v1/aggregate/tail?mode=poll&timeout=0&cursor={bad}",
+                ):
+                    self.assertEqual(client.get(url).status_code, 400, url)
+            line_end = len((data_dir / "agents" / "partner_alpha" / "entries.jsonl").read_bytes().split(b"\n", 1)[0]) + 1
+            r = client.get(f"/v1/aggregate?source=agent:partner_alpha&cursor={cursor_for({'agent:partner_alpha': line_end})}")
+            self.assertEqual([i["payload"]["claim"] for i in r.json()["items"]], ["a1", "a2", "a3"])
+
+    def test_aggregate_reads_across_rotated_segments(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={"token-a": "partner_alpha"},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+                segment_max_bytes=256,
+            )
+            client = TestClient(create_app(settings))
+
+            def write(claim: str) -> None:
+                r = client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": "Bearer token-a"},
+                    json={"s_bucket": "S4_EVIDENCE", "payload": {"claim": claim}},
+                )
+                self.assertEqual(r.status_code, 200)
+
+            for i in range(4):
+                write(f"a{i}")
+            payload = client.get("/v1/aggregate?limit=4").json()
+            cursor = payload["next_cursor"]
+
+            for i in range(4, 10):
+                write(f"a{i}")
+            ns_dir = data_dir / "agents" / "partner_alpha"
+            self.assertGreater(len(list(ns_dir.glob("entries-*.jsonl"))), 2)
+
+            items = client.get("/v1/aggregate").json()["items"]
+            self.assertEqual([i["payload"]["claim"] for i in items[2:]], [f"a{i}" for i in range(10)])
+            items = client.get(f"/v1/aggregate?cursor={cursor}").json()["items"]
+            self.assertEqual([i["payload"]["claim"] for i in items], [f"a{i}" for i in range(2, 10)])
+
+    def test_aggregate_filters_by_s_bucket_index(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            tokens = {"token-a": "partner_alpha", "token-b": "partner_beta"}
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace=tokens,
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+                segment_max_bytes=400,
+            )
+            client = TestClient(create_app(settings))
+
+            # Entries written before the index existed are picked up by the first indexed append.
+            legacy = data_dir / "agents" / "partner_alpha" / "entries.jsonl"
+            legacy.parent.mkdir(parents=True)
+            legacy.write_text('{"ts":1,"namespace":"partner_alpha","s_bucket":"S3_RISK","payload":{"claim":"old"}}\n')
+
+            buckets = ["S1_IDENTITY", "S3_RISK", "S4_EVIDENCE"]
+            for i in range(12):
+                r = client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": f"Bearer {'token-a' if i % 2 else 'token-b'}"},
+                    json={"s_bucket": buckets[i % 3], "payload": {"claim": f"c{i}"}},
+                )
+                self.assertEqual(r.status_code, 200)
+
+            def claims(query: str) -> list[str]:
+                items = client.get(f"/v1/aggregate?{query}").json()["items"]
+                return sorted(i["payload"]["claim"] for i in items if i["source"] != "core")
+
+            everything = client.get("/v1/aggregate").json()["items"][2:]
+            expected = sorted(i["payload"]["claim"] for i in everything if i["s_bucket"] == "S3_RISK")
+            self.assertIn("old", expected)
+            self.assertEqual(claims("s_bucket=S3_RISK"), expected)
+            expected_two = sorted(i["payload"]["claim"] for i in everything if i["s_bucket"] != "S1_IDENTITY")
+            self.assertEqual(claims("s_bucket=S3_RISK&s_bucket=S4_EVIDENCE"), expected_two)
+            self.assertEqual(claims("s_bucket=S9_NONE"), [])
+            # Core rows have no bucket, so a bucket filter never returns them, even for source=core.
+            sources = [i["source"] for i in client.get("/v1/aggregate?s_bucket=S3_RISK").json()["items"]]
+            self.assertEqual(len(sources), len(expected))
+            self.assertNotIn("core", sources)
+            sources = [i["source"] for i in client.get("/v1/aggregate?s_bucket=S9_NONE&source=core").json()["items"]]
+            self.assertEqual(sources, [])
+
+            ns_dir = data_dir / "agents" / "partner_alpha"
+            self.assertGreater(len(list(ns_dir.glob("entries-*.jsonl"))), 0)
+            index = BucketIndex(ns_dir)
+            with LogReader(ns_dir) as log:
+                self.assertEqual(index.watermark(), log.end())
+            before = {p.name: p.read_bytes() for p in index.dir.iterdir()}
+
+            # Without the index, reads fall back to scanning; a rebuild restores it byte for byte.
+            for path in index.dir.iterdir():
+                path.unlink()
+            self.assertEqual(claims("s_bucket=S3_RISK"), expected)
+            rebuild_bucket_index(ns_dir)
+            self.assertEqual({p.name: p.read_bytes() for p in index.dir.iterdir()}, before)
+
+            page = client.get("/v1/aggregate?s_bucket=S3_RISK&limit=3").json()
+            rest = client.get(f"/v1/aggregate?s_bucket=S3_RISK&cursor={page['next_cursor']}").json()
+            resumed = [i["payload"]["claim"] for i in page["items"] + rest["items"] if i["source"] != "core"]
+            self.assertEqual(sorted(resumed), expected)
+
+    def test_aggregate_reads_compacted_snapshot(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+            tokens = {"token-a": "partner_alpha", "token-b": "partner_beta"}
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace=tokens,
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+                aggregate_snapshot_interval_seconds=3600,
+            )
+            # Not entered as a context manager, so the background compactor does not run.
+            client = TestClient(create_app(settings))
+            plain = TestClient(create_app(replace(settings, aggregate_snapshot_interval_seconds=0)))
+
+            def write(token: str, claim: str) -> None:
+                r = client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": f"Bearer {token}"},
+                    json={"s_bucket": "S4_EVIDENCE", "payload": {"claim": claim}},
+                )
+                self.assertEqual(r.status_code, 200)
+
+            for i in range(3):
+                write("token-a", f"a{i}")
+                write("token-b", f"b{i}")
+            snapshot = compact_namespaces(data_dir / "agents", data_dir / "aggregate")
+            assert snapshot is not None
+            self.assertEqual(snapshot.rows, 6)
+            write("token-b", "b3")
+
+            for query in ("limit=100", "limit=3", "per_namespace=2", "where=payload.claim:b3"):
+                with self.subTest(query=query):
+                    got = client.get(f"/v1/aggregate?{query}").json()
+                    self.assertEqual(got, plain.get(f"/v1/aggregate?{query}").json())
+            items = client.get("/v1/aggregate?limit=100").json()["items"]
+            self.assertEqual([item["payload"]["claim"] for item in items[2:]][-1], "b3")
+            self.assertEqual(len(items), 2 + 7)
+
+    def test_aggregate_pushes_down_source_and_payload_filters(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            tokens = {"token-a": "partner_alpha", "token-b": "partner_beta"}
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace=tokens,
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+
+            payloads = [
+                ("token-a", {"claim": "a0", "severity": "high", "count": 3}),
+                ("token-a", {"claim": "a1", "severity": "low", "count": "3", "flag": 1}),
+                ("token-a", {"claim": "a2", "note": "severity high", "flag": True}),
+                ("token-b", {"claim": "b0", "severity": "high"}),
+                ("token-b", {"claim": "b1", "nested": {"severity": "high"}}),
+            ]
+            for token, payload in payloads:
+                r = client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": f"Bearer {token}"},
+                    json={"s_bucket": "S4_EVIDENCE", "payload": payload},
+                )
+                self.assertEqual(r.status_code, 200)
+
+            def sources_and_claims(query: str) -> list[str]:
+                r = client.get(f"/v1/aggregate?{query}")
+                self.assertEqual(r.status_code, 200)
+                return sorted(i["payload"]["claim"] if "payload" in i else i["source"] for i in r.json()["items"])
+
+            self.assertEqual(sources_and_claims("where=payload.severity:high"), ["a0", "b0"])
+            self.assertEqual(
+                sources_and_claims("where=payload.severity:high&namespace=partner_beta&source=core"), ["b0"]
+            )
+            self.assertEqual(sources_and_claims("where=payload.severity:high&source=agent:partner_alpha"), ["a0"])
+            self.assertEqual(sources_and_claims("namespace=partner_beta"), ["b0", "b1"])
+            self.assertEqual(sources_and_claims("source=core"), ["core", "core"])
+            self.assertEqual(sources_and_claims("namespace=partner_beta&source=core"), ["b0", "b1", "core", "core"])
+            # The core is only loaded and verified when the query can return core rows.
+            core_digest = client.app.state.core_digest
+            with mock.patch.object(core_digest, "digest", wraps=core_digest.digest) as digest:
+                sources_and_claims("namespace=partner_beta")
+                sources_and_claims("where=payload.severity:high&source=core")
+                self.assertEqual(digest.call_count, 0)
+                sources_and_claims("source=core")
+                self.assertEqual(digest.call_count, 1)
+            self.assertEqual(sources_and_claims("namespace=partner_alpha&where=payload.count:3"), ["a0", "a1"])
+            self.assertEqual(sources_and_claims("source=agent:partner_alpha&where=payload.flag:true"), ["a2"])
+            self.assertEqual(
+                sources_and_claims("namespace=partner_alpha&where=payload.severity:low&where=payload.count:3"), ["a1"]
+            )
+
+            self.assertEqual(client.get("/v1/aggregate?where=severity:high").status_code, 400)
+            self.assertEqual(client.get("/v1/aggregate?source=partner_alpha").status_code, 400)
+
+            # Lines whose raw bytes cannot match are never decoded.
+            ns_dir = data_dir / "agents" / "partner_alpha"
+            where = (PayloadMatch.parse("payload.severity:low"),)
+            with mock.patch("json.loads", side_effect=json.loads) as loads:
+                rows = list(iter_namespace_rows("partner_alpha", ns_dir, where=where))
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(loads.call_count, 1)
+
+    def test_tail_long_poll_and_sse_resume(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            token = "token-a"
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={token: "partner_alpha"},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+
+            def write(claim: str) -> None:
+                r = client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": f"Bearer {token}"},
+                    json={"s_bucket": "S4_EVIDENCE", "payload": {"claim": claim}},
+                )
+                self.assertEqual(r.status_code, 200)
+
+            write("old")
+            r = client.get("/v1/aggregate/tail?mode=poll&timeout=0")
+            self.assertEqual(r.json()["count"], 0)
+            cursor = r.json()["next_cursor"]
+
+            write("x")
+            write("y")
+            payload = client.get(f"/v1/aggregate/tail?mode=poll&timeout=1&cursor={cursor}").json()
+            self.assertEqual([i["payload"]["claim"] for i in payload["items"]], ["x", "y"])
+            self.assertEqual(payload["items"][0]["source"], "agent:partner_alpha")
+
+            write("z")
+            r = client.get(f"/v1/aggregate/tail?cursor={cursor}&max_events=2")
+            self.assertTrue(r.headers["content-type"].startswith("text/event-stream"))
+            events = [block for block in r.text.split("\n\n") if block.startswith("id: ")]
+            self.assertEqual(len(events), 2)
+            fields = dict(line.split(": ", 1) for line in events[-1].splitlines())
+            self.assertEqual(json.loads(fields["data"])["payload"]["claim"], "y")
+
+            payload = client.get(
+                "/v1/aggregate/tail?mode=poll&timeout=0", headers={"Last-Event-ID": fields["id"]}
+            ).json()
+            self.assertEqual([i["payload"]["claim"] for i in payload["items"]], ["z"])
+
+    def test_misconfigured_namespace_fails_at_startup(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            core_file, core_sha_file = self._make_core(root)
+
+            for data_dir, namespace in (
+                (root / "data", "../escape"),
+                (root / "data", ".."),
+                (core_file.parent, "partner_alpha"),
+            ):
+                settings = IsolationApiSettings(
+                    data_dir=data_dir,
+                    core_file=core_file,
+                    core_sha_file=core_sha_file,
+                    token_to_namespace={"token": namespace},
+                    hmac_secrets_by_namespace={},
+                    require_hmac=False,
+                    hmac_max_skew_seconds=300,
+                )
+                with self.subTest(data_dir=str(data_dir), namespace=namespace), self.assertRaises(ValueError):
+                    create_app(settings)
+
     def test_hmac_required_for_writes(self) -> None:
         with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
             root = Path(td)
@@ -146,6 +835,705 @@ class TestIsolationApi(unittest.TestCase):
             self.assertEqual(r.status_code, 200)
             self.assertEqual(r.json()["namespace"], ns)
 
+    def test_noisy_namespace_gets_429_without_affecting_others(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={"token-a": "partner_alpha", "token-b": "partner_beta"},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+                rate_limits_by_namespace={"partner_alpha": "0.01/2"},
+            )
+            client = TestClient(create_app(settings))
+
+            def write(token: str) -> Any:
+                return client.post(
+                    "/v1/agent/entries",
+                    headers={"Authorization": f"Bearer {token}"},
+                    json={"s_bucket": "S4_EVIDENCE", "payload": {}},
+                )
+
+            self.assertEqual([write("token-a").status_code for _ in range(2)], [200, 200])
+            r = write("token-a")
+            self.assertEqual(r.status_code, 429)
+            self.assertGreaterEqual(int(r.headers["Retry-After"]), 1)
+            r = client.post(
+                "/v1/agent/entries:batch",
+                headers={"Authorization": "Bearer token-a"},
+                json=[{"s_bucket": "S4_EVIDENCE", "payload": {}}],
+            )
+            self.assertEqual(r.status_code, 429)
+
+            # Another worker holding partner_alpha's shared bucket only stalls partner_alpha's
+            # writes. Entering the client runs every request on one event loop, as in a worker.
+            with client, (data_dir / "ratelimit" / "partner_alpha.bucket").open("rb") as held:
+                fcntl.flock(held.fileno(), fcntl.LOCK_EX)
+                # Let go after a while even if the loop is stuck, so a regression fails instead of hanging.
+                unlock = threading.Timer(3, fcntl.flock, (held.fileno(), fcntl.LOCK_UN))
+                unlock.start()
+                stalled: list[int] = []
+                thread = threading.Thread(target=lambda: stalled.append(write("token-a").status_code))
+                thread.start()
+                try:
+                    time.sleep(0.2)
+                    started = time.monotonic()
+                    self.assertEqual(write("token-b").status_code, 200)
+                    self.assertLess(time.monotonic() - started, 1)
+                    self.assertEqual(stalled, [])
+                finally:
+                    unlock.cancel()
+                    fcntl.flock(held.fileno(), fcntl.LOCK_UN)
+                    thread.join()
+            self.assertEqual(stalled, [429])
+
+            self.assertEqual({write("token-b").status_code for _ in range(20)}, {200})
+            entries = (data_dir / "agents" / "partner_alpha" / "entries.jsonl").read_text(encoding="utf-8")
+            self.assertEqual(len(entries.splitlines()), 2)
+
+            bad = IsolationApiSettings(**{**settings.__dict__, "rate_limits_by_namespace": {"partner_alpha": "fast"}})
+            with self.assertRaises(ValueError):
+                create_app(bad)
+
+    def test_metrics_endpoint_reports_routes_writes_and_scans(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={"token-a": "partner_alpha"},
+                hmac_secrets_by_namespace={},
+                require_hmac=False,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+            # The registry is process-wide, so compare against a baseline.
+            before = client.get("/v1/metrics").text
+
+            r = client.post(
+                "/v1/agent/entries:batch",
+                headers={"Authorization": "Bearer token-a"},
+                json=[{"s_bucket": "S4_EVIDENCE", "payload": {"n": i}} for i in range(3)],
+            )
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(client.get("/v1/aggregate?where=payload.n:1").json()["count"], 1)
+            self.assertEqual(client.get("/v1/aggregate").json()["count"], 5)
+
+            r = client.get("/v1/metrics")
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(r.headers["content-type"].startswith("text/plain; version=0.0.4"))
+            after = r.text
+
+            def delta(sample: str) -> float:
+                return _metric_value(after, sample) - _metric_value(before, sample)
+
+            written = data_dir / "agents" / "partner_alpha" / "entries.jsonl"
+            ns = '{namespace="partner_alpha"}'
+            self.assertEqual(delta(f"isolation_api_namespace_lines_written_total{ns}"), 3)
+            self.assertEqual(delta(f"isolation_api_namespace_bytes_written_total{ns}"), written.stat().st_size)
+            self.assertEqual(delta('isolation_api_aggregate_lines_scanned_total{source="namespace"}'), 6)
+            self.assertEqual(delta('isolation_api_aggregate_lines_scanned_total{source="core"}'), 2)
+            self.assertEqual(delta("isolation_api_aggregate_lines_returned_total"), 6)
+            self.assertEqual(delta("isolation_api_append_seconds_count"), 1)
+            route = 'method="POST",route="/v1/agent/entries:batch",status="200"'
+            self.assertEqual(delta(f"isolation_api_request_duration_seconds_count{{{route}}}"), 1)
+            self.assertEqual(delta(f'isolation_api_request_duration_seconds_bucket{{{route},le="+Inf"}}'), 1)
+            self.assertTrue(list((data_dir / "metrics").glob("metrics-*.json")))
+
+    def test_batch_write_single_signature_and_per_entry_results(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            data_dir = root / "data"
+            core_file, core_sha_file = self._make_core(root)
+
+            token = "token-x"
+            ns = "partner_merlin"
+            secret = "supersecret"
+            settings = IsolationApiSettings(
+                data_dir=data_dir,
+                core_file=core_file,
+                core_sha_file=core_sha_file,
+                token_to_namespace={token: ns},
+                hmac_secrets_by_namespace={ns: secret},
+                require_hmac=True,
+                hmac_max_skew_seconds=300,
+            )
+            client = TestClient(create_app(settings))
+
+            def signed(body: bytes) -> dict[str, str]:
+                ts = int(time.time())
+                sig = hmac.new(secret.encode("utf-8"), msg=f"{ts}.".encode("utf-8") + body, digestmod=hashlib.sha256)
+                return {"Authorization": f"Bearer {token}", "X-Timestamp": str(ts), "X-Signature": sig.hexdigest()}
+
+            entries = [
+                {"s_bucket": "S4_EVIDENCE", "payload": {"claim": "a"}},
+                {"payload": {"claim": "missing bucket"}},
+                {"s_bucket": "S3", "payload": {"claim": "b"}},
+            ]
+            body = json.dumps(entries).encode("utf-8")
+            r = client.post("/v1/agent/entries:batch", headers=signed(body), content=body)
+            self.assertEqual(r.status_code, 200)
+            payload = r.json()
+            self.assertEqual((payload["accepted"], payload["rejected"]), (2, 1))
+            self.assertEqual([res["ok"] for res in payload["results"]], [True, False, True])
+            self.assertIn("s_bucket", payload["results"][1]["error"])
+
+            ndjson = b"\n".join(json.dumps(e).encode("utf-8") for e in (entries[0], entries[2])) + b"\n"
+            r = client.post("/v1/agent/entries:batch", headers=signed(ndjson), content=ndjson)
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(r.json()["ok"])
+
+            r = client.post("/v1/agent/entries:batch", headers={**signed(body), "X-Signature": "0" * 64}, content=body)
+            self.assertEqual(r.status_code, 401)
+
+            stored = [json.loads(line) for line in (data_dir / "agents" / ns / "entries.jsonl").read_text().splitlines()]
+            self.assertEqual([row["payload"]["claim"] for row in stored], ["a", "b", "a", "b"])
+            self.assertEqual([row["hmac"]["batch_index"] for row in stored], [0, 2, 0, 1])
+
+
+def _metrics_worker(directory: str, amount: int) -> None:
+    registry = Registry()
+    registry.counter("demo_total", "Demo counter.", ("namespace",)).inc(amount, labels=("partner_alpha",))
+    registry.histogram("demo_seconds", "Demo histogram.", buckets=(0.1, 1.0)).observe(0.5)
+    MultiProcessMetrics(registry, Path(directory)).flush()
+
+
+def _metric_value(text: str, sample: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def _stress_append_worker(path: str, worker: int, count: int, size: int, segment_bytes: int = 0) -> None:
+    writer = GroupCommitWriter(
+        fsync_policy="none", max_batch_records=8, segment_policy=SegmentPolicy(max_bytes=segment_bytes)
+    )
+    pad = chr(ord("a") + worker) * size
+
+    async def run() -> None:
+        await asyncio.gather(
+            *(
+                writer.append(Path(path), (json.dumps({"w": worker, "i": i, "pad": pad}) + "\n").encode("utf-8"))
+                for i in range(count)
+            )
+        )
+        await writer.aclose()
+
+    asyncio.run(run())
+
+
+class TestAggregateSnapshot(unittest.TestCase):
+    def _append(self, agents_root: Path, namespace: str, stamps: list[int]) -> None:
+        ns_dir = agents_root / namespace
+        ns_dir.mkdir(parents=True, exist_ok=True)
+        with (ns_dir / "entries.jsonl").open("a", encoding="utf-8") as f:
+            for ts in stamps:
+                record = {"ts": ts, "namespace": namespace, "s_bucket": "S1", "payload": {"n": ts % 3}}
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _pages(self, core_file: Path, agents_root: Path, snapshot: Any, limit: int, **kw: Any) -> list[bytes]:
+        out: list[bytes] = []
+        offsets: dict[str, int] = {}
+        while True:
+            page = list(
+                iter_aggregate(core_file, agents_root, limit=limit, offsets=offsets, namespace_snapshot=snapshot, **kw)
+            )
+            out.extend(row.line for row in page)
+            if len(page) < limit:
+                return out
+            offsets = advance_offsets(offsets, page)
+
+    def test_snapshot_plus_tails_matches_reading_every_log(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            agents_root = root / "agents"
+            core_file = root / "core.jsonl"
+            core_file.write_text('{"S1":"CORE-1"}\n', encoding="utf-8")
+            for i, namespace in enumerate(("partner_a", "partner_b", "partner_c")):
+                self._append(agents_root, namespace, list(range(100 + i, 400, 3)) + [400])
+
+            with mock.patch.object(compaction, "BLOCK_ROWS", 16), mock.patch.object(compaction, "CHECKPOINT_EVERY", 8):
+                snapshot = compact_namespaces(agents_root, root / "aggregate")
+            assert snapshot is not None
+            self.assertEqual(snapshot.rows, 303)
+            self.assertGreater(len(snapshot.blocks), 10)
+
+            # Appends after the watermark, plus a namespace created since.
+            self._append(agents_root, "partner_b", [401, 402])
+            self._append(agents_root, "partner_d", [150, 450])
+            store = AggregateSnapshotStore(root / "aggregate")
+            self.assertIs(store.get(), store.get())
+
+            cases: list[dict[str, Any]] = [
+                {},
+                {"per_namespace": 5},
+                {"since": 200, "until": 260},
+                {"where": (PayloadMatch.parse("payload.n:1"),)},
+            ]
+            for kw in cases:
+                with self.subTest(**{k: str(v) for k, v in kw.items()}):
+                    for limit in (100_000, 7):
+                        expected = self._pages(core_file, agents_root, None, limit, **kw)
+                        self.assertEqual(self._pages(core_file, agents_root, store.get(), limit, **kw), expected)
+
+            # Only logs appended to since the snapshot are opened.
+            with mock.patch.object(compaction, "iter_namespace_rows", wraps=compaction.iter_namespace_rows) as reads:
+                list(iter_aggregate(core_file, agents_root, limit=10_000, namespace_snapshot=store.get()))
+            self.assertEqual(sorted(call.args[0] for call in reads.call_args_list), ["partner_b", "partner_d"])
+
+            # A second compaction picks the tails up and keeps one older generation.
+            compact_namespaces(agents_root, root / "aggregate")
+            compact_namespaces(agents_root, root / "aggregate")
+            self.assertEqual(store.get().rows, 307)
+            self.assertEqual(len(list((root / "aggregate").glob("aggregate-*.tsv"))), 2)
+            self.assertEqual(self._pages(core_file, agents_root, store.get(), 7), self._pages(core_file, agents_root, None, 7))
+
+    def test_snapshot_skips_rows_pruned_after_compaction(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            root = Path(td)
+            agents_root = root / "agents"
+            core_file = root / "core.jsonl"
+            core_file.write_text('{"S1":"CORE-1"}\n', encoding="utf-8")
+            policy = SegmentPolicy(max_bytes=100)
+            writer = GroupCommitWriter(segment_policy=policy)
+
+            async def run() -> None:
+                for ts in range(100, 130):
+                    await writer.append(agents_root / "partner_a" / "entries.jsonl", f'{{"ts":{ts}}}\n'.encode())
+                await writer.aclose()
+
+            asyncio.run(run())
+            self._append(agents_root, "partner_b", [105, 125])
+            store = AggregateSnapshotStore(root / "aggregate")
+            compact_namespaces(agents_root, root / "aggregate")
+            snapshot = store.get()
+            self.assertEqual(snapshot.rows, 32)
+
+            ns_dir = agents_root / "partner_a"
+            maintain_namespace(ns_dir, SegmentPolicy(retention_seconds=10), now=120 + 11)
+            self.assertGreater(Manifest.load(ns_dir).segments[0].base, 0)
+            expected = self._pages(core_file, agents_root, None, 100)
+            self.assertLess(len(expected), 33)
+            for limit in (100, 3):
+                self.assertEqual(self._pages(core_file, agents_root, snapshot, limit), self._pages(core_file, agents_root, None, limit))
+
+            # A namespace removed since compaction is not served from the snapshot either.
+            shutil.rmtree(agents_root / "partner_b")
+            self.assertEqual(self._pages(core_file, agents_root, snapshot, 100), self._pages(core_file, agents_root, None, 100))
+
+
+class TestTailHub(unittest.TestCase):
+    def test_one_watcher_fans_out_to_all_subscribers(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            agents_root = Path(td) / "agents"
+            log = agents_root / "partner_alpha" / "entries.jsonl"
+            log.parent.mkdir(parents=True)
+            log.write_text('{"ts":1,"n":0}\n', encoding="utf-8")
+            hub = TailHub(agents_root, poll_interval_ms=10)
+            scanned_before = AGGREGATE_LINES_SCANNED.snapshot()
+            tail_before = TAIL_LINES_SCANNED.snapshot().get('["namespace"]', 0)
+
+            async def run() -> list[list[int]]:
+                subs = [await hub.subscribe() for _ in range(3)]
+                for s in subs:
+                    # Nothing new yet: finishes each subscriber's catch-up from disk.
+                    self.assertEqual(await hub.next_rows(s, timeout=0), [])
+                with log.open("a", encoding="utf-8") as f:
+                    f.write('{"ts":2,"n":1}\n{"ts":3,"n":2}\n{"ts":4,"n":')
+                got = [[json.loads(r.line)["n"] for r in await hub.next_rows(s, timeout=2)] for s in subs]
+                for s in subs:
+                    hub.unsubscribe(s)
+                return got
+
+            self.assertEqual(asyncio.run(run()), [[1, 2]] * 3)
+            # Tail polling is counted apart from /v1/aggregate scans.
+            self.assertEqual(AGGREGATE_LINES_SCANNED.snapshot(), scanned_before)
+            self.assertGreater(TAIL_LINES_SCANNED.snapshot()['["namespace"]'], tail_before)
+
+
+class TestSegmentedLogs(unittest.TestCase):
+    def _write(self, ns_dir: Path, stamps: list[int], policy: SegmentPolicy) -> None:
+        writer = GroupCommitWriter(segment_policy=policy)
+        path = ns_dir / "entries.jsonl"
+
+        async def run() -> None:
+            for ts in stamps:
+                await writer.append(path, (json.dumps({"ts": ts, "n": ts}, separators=(",", ":")) + "\n").encode())
+            await writer.aclose()
+
+        asyncio.run(run())
+
+    def test_rotation_keeps_logical_offsets_and_skips_segments_by_ts(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            ns_dir = Path(td) / "agents" / "partner_alpha"
+            self._write(ns_dir, list(range(100, 130)), SegmentPolicy(max_bytes=100))
+
+            manifest = Manifest.load(ns_dir)
+            self.assertGreater(len(manifest.segments), 3)
+            self.assertEqual([seg.file for seg in manifest.segments][0], "entries-000001.jsonl")
+            active_lines = (ns_dir / "entries.jsonl").read_bytes().count(b"\n")
+            self.assertEqual(sum(seg.lines for seg in manifest.segments) + active_lines, 30)
+
+            with LogReader(ns_dir) as log:
+                lines = list(log.iter_lines())
+            self.assertEqual([json.loads(line)["ts"] for line, _ in lines], list(range(100, 130)))
+            ends = [end for _, end in lines]
+            self.assertEqual(ends, sorted(ends))
+
+            resumed = [row.ts for row in iter_namespace_rows("partner_alpha", ns_dir, ends[11])]
+            self.assertEqual(resumed, list(range(112, 130)))
+
+            opened: list[str] = []
+            original = segments._open_segment
+
+            def counting(ns: Path, seg: segments.Segment):  # type: ignore[no-untyped-def]
+                opened.append(seg.file)
+                return original(ns, seg)
+
+            segments._open_segment = counting  # type: ignore[assignment]
+            try:
+                window = [row.ts for row in iter_namespace_rows("partner_alpha", ns_dir, since=120, until=122)]
+            finally:
+                segments._open_segment = original  # type: ignore[assignment]
+            self.assertEqual(window, [120, 121, 122])
+            self.assertLessEqual(len(opened), 2)
+
+            # The core has no ts: a window leaves it out, even when it is asked for.
+            core_file = Path(td) / "core.jsonl"
+            core_file.write_text('{"S1":"CORE-0001"}\n', encoding="utf-8")
+            agents_root = ns_dir.parent
+            rows = list(iter_aggregate(core_file, agents_root, limit=10, since=120, until=122))
+            self.assertEqual([row.source for row in rows], ["agent:partner_alpha"] * 3)
+            sources = {"core", "agent:partner_alpha"}
+            rows = list(iter_aggregate(core_file, agents_root, limit=10, since=120, until=122, sources=sources))
+            self.assertEqual([row.source for row in rows], ["agent:partner_alpha"] * 3)
+            self.assertEqual(list(iter_aggregate(core_file, agents_root, limit=10, since=10**10, sources=sources)), [])
+
+    def test_compression_and_retention_are_transparent_to_readers(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            ns_dir = Path(td) / "agents" / "partner_alpha"
+            self._write(ns_dir, list(range(1000, 1020)), SegmentPolicy(max_bytes=80))
+            with LogReader(ns_dir) as log:
+                before = list(log.iter_lines())
+
+            maintain_namespace(ns_dir, SegmentPolicy(compress_after_seconds=0))
+            manifest = Manifest.load(ns_dir)
+            self.assertTrue(all(seg.file.endswith(".gz") for seg in manifest.segments))
+            self.assertFalse(list(ns_dir.glob("entries-*.jsonl")))
+            with LogReader(ns_dir) as log:
+                self.assertEqual(list(log.iter_lines()), before)
+                resume = before[7][1]
+                self.assertEqual(list(log.iter_lines(resume)), before[8:])
+                # Line starts are recognized inside compressed segments and the active file alike.
+                self.assertTrue(all(log.at_line_start(end) for _, end in before))
+                self.assertFalse(any(log.at_line_start(end - 3) for _, end in before[1:]))
+
+            cutoff_seg = manifest.segments[1]
+            maintain_namespace(ns_dir, SegmentPolicy(retention_seconds=10), now=cutoff_seg.ts_max + 11)
+            kept = Manifest.load(ns_dir).segments
+            self.assertEqual(kept[0].seq, cutoff_seg.seq + 1)
+            with LogReader(ns_dir) as log:
+                remaining = list(log.iter_lines())
+            self.assertEqual(remaining, [item for item in before if item[1] > kept[0].base])
+
+    def test_block_compression_seeks_without_decompressing_the_prefix(self) -> None:
+        for codec, suffix in compression.CODECS.items():
+            with self.subTest(codec=codec), tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+                ns_dir = Path(td) / "agents" / "partner_alpha"
+                self._write(ns_dir, list(range(1000, 1200)), SegmentPolicy(max_bytes=2000))
+                with LogReader(ns_dir) as log:
+                    before = list(log.iter_lines())
+                plain = {seg.seq: (ns_dir / seg.file).read_bytes() for seg in Manifest.load(ns_dir).segments}
+
+                maintain_namespace(
+                    ns_dir, SegmentPolicy(compress_after_seconds=0, compress_codec=codec, compress_block_bytes=200)
+                )
+                manifest = Manifest.load(ns_dir)
+                first = ns_dir / manifest.segments[0].file
+                self.assertTrue(first.name.endswith(suffix))
+                self.assertTrue(compression.index_path(first).is_file())
+                # Still a regular (multi-member) .gz / .xz file.
+                decompress = gzip.decompress if codec == "gzip" else lzma.decompress
+                self.assertEqual(decompress(first.read_bytes()), plain[manifest.segments[0].seq])
+
+                with LogReader(ns_dir) as log:
+                    self.assertEqual(list(log.iter_lines()), before)
+                    self.assertEqual(list(log.iter_lines(before[50][1])), before[51:])
+                    calls: list[int] = []
+                    original = compression._decompress
+
+                    def counting(c: str, data: bytes) -> bytes:
+                        calls.append(len(data))
+                        return original(c, data)
+
+                    with mock.patch.object(compression, "_decompress", counting):
+                        target = before[8][1]
+                        self.assertEqual(list(log.lines_at([target])), [before[9]])
+                    self.assertEqual(len(calls), 1)
+
+                # Segments compressed as a single stream (no index) still read.
+                compression.index_path(first).unlink()
+                with LogReader(ns_dir) as log:
+                    self.assertEqual(list(log.iter_lines()), before)
+
+                second = ns_dir / manifest.segments[1].file
+                maintain_namespace(ns_dir, SegmentPolicy(retention_seconds=1), now=manifest.segments[1].ts_max + 2)
+                self.assertFalse(second.exists())
+                self.assertFalse(compression.index_path(second).exists())
+
+    def test_multi_process_appends_survive_rotation(self) -> None:
+        workers, count, size = 4, 40, 2048
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            path = Path(td) / "entries.jsonl"
+            procs = [
+                multiprocessing.Process(target=_stress_append_worker, args=(str(path), w, count, size, 16 * 1024))
+                for w in range(workers)
+            ]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join(timeout=120)
+                self.assertEqual(p.exitcode, 0)
+
+            self.assertGreater(len(Manifest.load(path.parent).segments), 5)
+            with LogReader(path.parent) as log:
+                rows = [json.loads(line) for line, _ in log.iter_lines()]
+            self.assertEqual(sorted((r["w"], r["i"]) for r in rows), [(w, i) for w in range(workers) for i in range(count)])
+
+
+class TestMultiProcessMetrics(unittest.TestCase):
+    def test_scrape_sums_every_worker(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            procs = [multiprocessing.Process(target=_metrics_worker, args=(td, n)) for n in (2, 5)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join(timeout=60)
+                self.assertEqual(p.exitcode, 0)
+
+            registry = Registry()
+            counter = registry.counter("demo_total", "Demo counter.", ("namespace",))
+            registry.histogram("demo_seconds", "Demo histogram.", buckets=(0.1, 1.0)).observe(0.05)
+            counter.inc(1, labels=('say "hi"',))
+            text = MultiProcessMetrics(registry, Path(td)).collect()
+
+            self.assertIn("# TYPE demo_total counter", text)
+            self.assertEqual(_metric_value(text, 'demo_total{namespace="partner_alpha"}'), 7)
+            self.assertEqual(_metric_value(text, 'demo_total{namespace="say \\"hi\\""}'), 1)
+            self.assertEqual(_metric_value(text, 'demo_seconds_bucket{le="0.1"}'), 1)
+            self.assertEqual(_metric_value(text, 'demo_seconds_bucket{le="1"}'), 3)
+            self.assertEqual(_metric_value(text, 'demo_seconds_bucket{le="+Inf"}'), 3)
+            self.assertEqual(_metric_value(text, "demo_seconds_count"), 3)
+            self.assertAlmostEqual(_metric_value(text, "demo_seconds_sum"), 1.05)
+
+    def test_exited_workers_are_folded_at_start(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            directory = Path(td)
+            registry = Registry()
+            registry.counter("demo_total", "Demo counter.", ("namespace",))
+            registry.histogram("demo_seconds", "Demo histogram.", buckets=(0.1, 1.0))
+            for round_amounts in ((2, 5), (3,)):
+                procs = [multiprocessing.Process(target=_metrics_worker, args=(td, n)) for n in round_amounts]
+                for p in procs:
+                    p.start()
+                for p in procs:
+                    p.join(timeout=60)
+                    self.assertEqual(p.exitcode, 0)
+                # A file left under this process's pid belongs to an earlier process until it flushes.
+                stale = directory / f"metrics-{os.getpid()}.json"
+                stale.write_text(json.dumps({"demo_total": {'["partner_alpha"]': 1}}), encoding="utf-8")
+                # A live worker's file is left alone.
+                live = directory / f"metrics-{os.getppid()}.json"
+                live.write_text(json.dumps({"demo_total": {'["partner_alpha"]': 100}}), encoding="utf-8")
+
+                MultiProcessMetrics(registry, directory, flush_interval_ms=0).start()
+                self.assertEqual(
+                    sorted(p.name for p in directory.glob("metrics-*.json")),
+                    sorted(["metrics-dead.json", live.name]),
+                )
+                live.unlink()
+
+            text = MultiProcessMetrics(registry, directory).collect()
+            self.assertEqual(_metric_value(text, 'demo_total{namespace="partner_alpha"}'), 2 + 5 + 3 + 2)
+            self.assertEqual(_metric_value(text, "demo_seconds_count"), 3)
+            self.assertAlmostEqual(_metric_value(text, "demo_seconds_sum"), 1.5)
+
+
+class TestWriteAdmission(unittest.TestCase):
+    def test_token_bucket_refills_and_lets_batches_overdraw(self) -> None:
+        bucket = TokenBucket(RateLimit(rate=10, burst=5), now=0.0)
+        self.assertEqual([bucket.take(1, 0.0) for _ in range(5)], [0.0] * 5)
+        self.assertAlmostEqual(bucket.take(1, 0.0), 0.1)
+        self.assertEqual(bucket.take(1, 0.1), 0.0)
+
+        bucket = TokenBucket(RateLimit(rate=10, burst=5), now=0.0)
+        self.assertEqual(bucket.take(50, 0.0), 0.0)
+        # The batch is paid back at the sustained rate before anything else goes through.
+        self.assertAlmostEqual(bucket.take(1, 1.0), 3.6)
+        self.assertEqual(bucket.take(1, 4.6), 0.0)
+
+    def test_inflight_cap_is_per_namespace(self) -> None:
+        admission = WriteAdmission(max_inflight=2)
+        admission.acquire("alpha")
+        admission.acquire("alpha")
+        with self.assertRaises(RateLimited):
+            admission.acquire("alpha")
+        admission.acquire("beta")
+        admission.release("alpha")
+        admission.acquire("alpha")
+
+    def test_rate_is_shared_through_state_dir(self) -> None:
+        # Two admissions stand in for two worker processes: each opens its own
+        # descriptor, so they serialize on the flock just as processes do.
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            limit = RateLimit(rate=0.001, burst=4)
+            workers = [WriteAdmission(default=limit, state_dir=Path(td)) for _ in range(2)]
+            try:
+                for i in range(4):
+                    workers[i % 2].acquire("alpha")
+                for admission in workers:
+                    with self.assertRaises(RateLimited):
+                        admission.acquire("alpha")
+                workers[1].acquire("beta")
+            finally:
+                for admission in workers:
+                    admission.close()
+
+    def test_parse_rate_limit(self) -> None:
+        self.assertEqual(RateLimit.parse("50"), RateLimit(rate=50, burst=50))
+        self.assertEqual(RateLimit.parse("0.5/10"), RateLimit(rate=0.5, burst=10))
+        for spec in ("", "fast", "0", "5/0"):
+            with self.assertRaises(ValueError):
+                RateLimit.parse(spec)
+
+
+class TestBench(unittest.TestCase):
+    def test_generate_core_is_seeded_and_hashed(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_bench_test_") as td:
+            a = Path(td) / "a" / "core.jsonl"
+            b = Path(td) / "b" / "core.jsonl"
+            sha = generate_core(a, 25, seed=7)
+            self.assertEqual(generate_core(b, 25, seed=7), sha)
+            self.assertEqual(sha256_file(a), sha)
+            self.assertEqual(a.with_suffix(".sha256").read_text(encoding="utf-8").split()[0], sha)
+            rows = [json.loads(line) for line in a.read_text(encoding="utf-8").splitlines()]
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(sorted(rows[0]), [f"S{i}" for i in range(1, 8)])
+
+    @unittest.skipUnless(Path("/proc/self/clear_refs").exists(), "needs Linux /proc")
+    def test_peak_rss_resets_between_workloads(self) -> None:
+        code = "import sys; x = bytearray(64 << 20); del x; print('freed', flush=True); sys.stdin.read()"
+        proc = subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            assert proc.stdout is not None
+            self.assertEqual(proc.stdout.readline(), b"freed\n")
+            self.assertGreaterEqual(peak_rss_bytes(proc.pid) or 0, 64 << 20)
+            self.assertTrue(reset_peak_rss(proc.pid))
+            self.assertLess(peak_rss_bytes(proc.pid) or 0, 64 << 20)
+        finally:
+            proc.communicate(b"")
+
+    def test_summarize_percentiles(self) -> None:
+        latencies = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(percentile(sorted(latencies), 50), 0.05)
+        self.assertEqual(percentile([], 99), 0.0)
+        summary = summarize(latencies, errors=2, elapsed=2.0)
+        self.assertEqual(summary["requests"], 100)
+        self.assertEqual(summary["errors"], 2)
+        self.assertEqual(summary["throughput_rps"], 50.0)
+        self.assertEqual(summary["latency_ms"]["p99"], 99.0)
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+    def _append_concurrently(self, writer: GroupCommitWriter, path: Path, n: int) -> int:
+        commits = 0
+        original = writer.pool.lease
+
+        def counting_lease(p: Path):  # type: ignore[no-untyped-def]
+            nonlocal commits
+            commits += 1
+            return original(p)
+
+        writer.pool.lease = counting_lease  # type: ignore[method-assign]
+
+        async def run() -> None:
+            await asyncio.gather(*(writer.append(path, f'{{"i":{i}}}\n'.encode("utf-8")) for i in range(n)))
+            await writer.aclose()
+
+        asyncio.run(run())
+        return commits
+
+    def test_concurrent_appends_are_batched_for_each_policy(self) -> None:
+        for policy in ("none", "batch", "interval"):
+            with self.subTest(policy=policy), tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+                path = Path(td) / "entries.jsonl"
+                writer = GroupCommitWriter(fsync_policy=policy, fsync_interval_ms=5, max_open_files=1)
+                commits = self._append_concurrently(writer, path, 500)
+
+                lines = path.read_text(encoding="utf-8").splitlines()
+                self.assertEqual(sorted(json.loads(line)["i"] for line in lines), list(range(500)))
+                self.assertLess(commits, 500)
+
+    def test_multi_process_appends_do_not_tear_or_lose_lines(self) -> None:
+        workers, count, size = 6, 60, 256 * 1024
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            path = Path(td) / "entries.jsonl"
+            procs = [
+                multiprocessing.Process(target=_stress_append_worker, args=(str(path), w, count, size))
+                for w in range(workers)
+            ]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join(timeout=120)
+                self.assertEqual(p.exitcode, 0)
+
+            seen: list[tuple[int, int]] = []
+            with path.open("rb") as f:
+                for line in f:
+                    row = json.loads(line)
+                    self.assertEqual(row["pad"], chr(ord("a") + row["w"]) * size)
+                    seen.append((row["w"], row["i"]))
+            self.assertEqual(sorted(seen), [(w, i) for w in range(workers) for i in range(count)])
+
+    def test_failed_commit_fails_its_batch_and_keeps_draining(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_api_test_") as td:
+            path = Path(td) / "entries.jsonl"
+            writer = GroupCommitWriter()
+            original = writer.append_fd
+            failures = [json.JSONDecodeError("corrupt manifest", "{", 0)]
+
+            def flaky_append_fd(*args):  # type: ignore[no-untyped-def]
+                if failures:
+                    raise failures.pop()
+                return original(*args)
+
+            writer.append_fd = flaky_append_fd  # type: ignore[method-assign]
+
+            async def run() -> None:
+                with self.assertRaises(json.JSONDecodeError):
+                    await asyncio.wait_for(writer.append(path, b'{"i":0}\n'), 5)
+                await asyncio.wait_for(writer.append(path, b'{"i":1}\n'), 5)
+                await writer.aclose()
+
+            asyncio.run(run())
+            self.assertEqual(path.read_bytes(), b'{"i":1}\n')
+
+    def test_rejects_unknown_fsync_policy(self) -> None:
+        with self.assertRaises(ValueError):
+            GroupCommitWriter(fsync_policy="sometimes")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from .bucket_index import BucketIndex
+from .metrics import APPEND_SECONDS
+from .segments import Manifest, SegmentPolicy, active_since, rotate_locked
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+FSYNC_POLICIES = ("none", "batch", "interval")
+
+# Pseudo-item: fsync records already written, without new data.
+_SYNC_DUE = object()
+
+_OPEN_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_CLOEXEC", 0)
+
+
+class FileHandlePool:
+    """Bounded LRU of append-mode file descriptors keyed by path.
+
+    Descriptors that are currently leased are never evicted, so the pool may
+    briefly exceed `max_open` under heavy fan-out.
+    """
+
+    def __init__(self, max_open: int) -> None:
+        if max_open < 1:
+            raise ValueError("max_open must be >= 1")
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._fds: OrderedDict[Path, int] = OrderedDict()
+        self._leases: dict[Path, int] = {}
+
+    @contextmanager
+    def lease(self, path: Path) -> Iterator[int]:
+        with self._lock:
+            fd = self._fds.get(path)
+            if fd is None:
+                try:
+                    fd = os.open(path, _OPEN_FLAGS, 0o644)
+                except FileNotFoundError:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    fd = os.open(path, _OPEN_FLAGS, 0o644)
+                self._fds[path] = fd
+            self._fds.move_to_end(path)
+            self._leases[path] = self._leases.get(path, 0) + 1
+        try:
+            yield fd
+        finally:
+            with self._lock:
+                self._leases[path] -= 1
+                if not self._leases[path]:
+                    del self._leases[path]
+                self._evict_locked()
+
+    def replace(self, path: Path, fd: int | None = None) -> int:
+        """Swap the pooled descriptor for `path` (reopening it if `fd` is None).
+
+        Only called by the holder of the lease on `path`, after the file was
+        rotated underneath it.
+        """
+        if fd is None:
+            fd = os.open(path, _OPEN_FLAGS, 0o644)
+        with self._lock:
+            old = self._fds.get(path)
+            self._fds[path] = fd
+        if old is not None and old != fd:
+            os.close(old)
+        return fd
+
+    def _evict_locked(self) -> None:
+        for path in list(self._fds):
+            if len(self._fds) <= self.max_open:
+                return
+            if path not in self._leases:
+                os.close(self._fds.pop(path))
+
+    def close(self) -> None:
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def append_locked(fd: int, data: bytes) -> None:
+    """Append `data` to an O_APPEND descriptor without interleaving other writers.
+
+    O_APPEND makes each write() land at the current end of file, but a large
+    batch may be split into several short writes, and other uvicorn workers
+    append to the same file. An exclusive flock() per namespace file keeps
+    every batch contiguous across processes. Without fcntl (non-POSIX) the
+    batch must go out in a single write() or the append fails loudly.
+    """
+    if fcntl is None:
+        written = os.write(fd, data)
+        if written != len(data):
+            raise OSError(f"Short append ({written} of {len(data)} bytes) without file locking")
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        _write_all(fd, data)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class _NamespaceWriter:
+    """Drain task for one log: commits queued records in batches.
+
+    The task exits as soon as its queue is empty and nothing awaits an fsync,
+    and is restarted by the next append, so no task outlives its event loop.
+    """
+
+    def __init__(self, path: Path, owner: "GroupCommitWriter") -> None:
+        self.path = path
+        self.owner = owner
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[tuple[bytes, asyncio.Future[None]]] = asyncio.Queue()
+        self.task = self.loop.create_task(self._run())
+
+    def _commit(self, data: bytes, sync: bool) -> None:
+        with APPEND_SECONDS.time(), self.owner.pool.lease(self.path) as fd:
+            if data:
+                fd = self.owner.append_fd(self.path, fd, data)
+            if sync:
+                os.fsync(fd)
+
+    async def _run(self) -> None:
+        policy = self.owner.fsync_policy
+        interval = self.owner.fsync_interval_ms / 1000
+        # Futures waiting for the next interval fsync.
+        unsynced: list[asyncio.Future[None]] = []
+        next_sync = 0.0
+
+        while True:
+            item: object
+            if unsynced and not self.owner.closing:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), max(0.0, next_sync - self.loop.time()))
+                except asyncio.TimeoutError:
+                    item = _SYNC_DUE
+            elif not self.queue.empty():
+                item = self.queue.get_nowait()
+            elif unsynced:
+                item = _SYNC_DUE
+            else:
+                return
+
+            batch: list[tuple[bytes, asyncio.Future[None]]] = []
+            if item is not _SYNC_DUE:
+                batch.append(item)  # type: ignore[arg-type]
+            while len(batch) < self.owner.max_batch_records and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            futures = [fut for _, fut in batch]
+            if policy == "batch":
+                sync = True
+            elif policy == "interval":
+                sync = item is _SYNC_DUE or self.owner.closing or self.loop.time() >= next_sync
+            else:
+                sync = False
+
+            try:
+                await asyncio.to_thread(self._commit, b"".join(line for line, _ in batch), sync)
+            except Exception as e:  # noqa: BLE001 - fail this batch, keep draining the queue
+                for fut in futures + (unsynced if sync else []):
+                    if not fut.done():
+                        fut.set_exception(e)
+                if sync:
+                    unsynced = []
+                continue
+
+            if policy == "interval" and not sync:
+                if not unsynced:
+                    next_sync = self.loop.time() + interval
+                unsynced.extend(futures)
+                continue
+            if sync:
+                futures += unsynced
+                unsynced = []
+                next_sync = self.loop.time() + interval
+            for fut in futures:
+                if not fut.done():
+                    fut.set_result(None)
+
+
+class GroupCommitWriter:
+    """Batches concurrent appends to the same log into one write() per batch.
+
+    fsync_policy:
+    - "none": acknowledge once the batch is written to the OS.
+    - "batch": fsync every batch before acknowledging it.
+    - "interval": fsync at most every `fsync_interval_ms`; appends are
+      acknowledged by the fsync that covers them.
+
+    With `index_buckets`, each batch is also added to the namespace's
+    s_bucket index (see bucket_index.py) while the log is still locked.
+    """
+
+    def __init__(
+        self,
+        *,
+        fsync_policy: str = "none",
+        fsync_interval_ms: int = 50,
+        max_open_files: int = 256,
+        max_batch_records: int = 1024,
+        segment_policy: SegmentPolicy | None = None,
+        index_buckets: bool = False,
+    ) -> None:
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}")
+        self.fsync_policy = fsync_policy
+        self.segment_policy = segment_policy if segment_policy is not None and segment_policy.rotates else None
+        # path -> (active inode, when that active segment started)
+        self._active_since: dict[Path, tuple[int, int | None]] = {}
+        self.index_buckets = index_buckets
+        # path -> (active inode, logical offset where that active file starts)
+        self._active_base: dict[Path, tuple[int, int]] = {}
+        self.fsync_interval_ms = fsync_interval_ms
+        self.max_batch_records = max_batch_records
+        self.pool = FileHandlePool(max_open_files)
+        self.closing = False
+        self._writers: dict[Path, _NamespaceWriter] = {}
+
+    def append_fd(self, path: Path, fd: int, data: bytes) -> int:
+        """Append `data` to the log at `path` via its pooled `fd`, rotating first if due.
+
+        Returns the descriptor now current for `path`, which differs from
+        `fd` after a rotation by this or another worker.
+        """
+        policy = self.segment_policy
+        if fcntl is None or (policy is None and not self.index_buckets):
+            append_locked(fd, data)
+            return fd
+
+        while True:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            st = os.fstat(fd)
+            if st.st_ino != current:
+                # Another worker rotated the log: follow it to the new active file.
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                fd = self.pool.replace(path)
+                continue
+
+            try:
+                if policy is None or not self._rotation_due(path, st, len(data), policy):
+                    _write_all(fd, data)
+                    self._index_locked(path, st, data)
+                    return fd
+                new_fd = rotate_locked(path.parent, fd)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            try:
+                new_st = os.fstat(new_fd)
+                _write_all(new_fd, data)
+                self._index_locked(path, new_st, data)
+            finally:
+                fcntl.flock(new_fd, fcntl.LOCK_UN)
+            self._active_since[path] = (new_st.st_ino, int(time.time()))
+            return self.pool.replace(path, new_fd)
+
+    def _index_locked(self, path: Path, st: os.stat_result, data: bytes) -> None:
+        """Index `data`, appended to the active file whose pre-append stat is `st`."""
+        if not self.index_buckets:
+            return
+        cached = self._active_base.get(path)
+        if cached is None or cached[0] != st.st_ino:
+            # active_base only changes together with the active inode.
+            cached = (st.st_ino, Manifest.load(path.parent).active_base)
+            self._active_base[path] = cached
+        try:
+            BucketIndex(path.parent).record_locked(cached[1] + st.st_size, data)
+        except OSError:
+            # The data is committed; the next append catches the index up from its watermark.
+            pass
+
+    def _rotation_due(self, path: Path, st: os.stat_result, incoming: int, policy: SegmentPolicy) -> bool:
+        if st.st_size == 0:
+            return False
+        if policy.max_bytes > 0 and st.st_size + incoming > policy.max_bytes:
+            return True
+        if policy.max_age_seconds > 0:
+            cached = self._active_since.get(path)
+            if cached is None or cached[0] != st.st_ino:
+                cached = (st.st_ino, active_since(path.parent, Manifest.load(path.parent), st.st_ino))
+                self._active_since[path] = cached
+            since = cached[1]
+            if since is not None and time.time() - since >= policy.max_age_seconds:
+                return True
+        return False
+
+    def _writer_for(self, path: Path) -> _NamespaceWriter:
+        writer = self._writers.get(path)
+        if writer is None or writer.task.done() or writer.loop is not asyncio.get_running_loop():
+            writer = _NamespaceWriter(path, self)
+            self._writers[path] = writer
+        return writer
+
+    async def append(self, path: Path, data: bytes) -> None:
+        """Append pre-encoded line(s) to `path`; returns once committed per the fsync policy."""
+        writer = self._writer_for(path)
+        fut: asyncio.Future[None] = writer.loop.create_future()
+        writer.queue.put_nowait((data, fut))
+        await fut
+
+    async def aclose(self) -> None:
+        """Flush (and fsync, for "interval") everything queued, then close all handles."""
+        self.closing = True
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(w.task for w in self._writers.values() if w.loop is loop))
+        finally:
+            self._writers.clear()
+            self.pool.close()
+            self.closing = False
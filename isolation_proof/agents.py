@@ -2,9 +2,9 @@ from __future__ import annotations
 
 import json
 from dataclasses import dataclass
-from typing import Any, Iterable
+from typing import Any, Iterable, Mapping
 
-from .core import CORE_KEYS
+from .core import CORE_KEYS, CoreIndex
 from .safefs import SandboxFS
 
 
@@ -12,7 +12,7 @@ class ProjectionError(ValueError):
     pass
 
 
-def _validate_projection(projection: dict[str, Any]) -> None:
+def _validate_projection(projection: Mapping[str, Any]) -> None:
     missing = [k for k in CORE_KEYS if k not in projection]
     extra = [k for k in projection.keys() if k not in CORE_KEYS]
     if missing or extra:
@@ -29,50 +29,57 @@ class Agent:
             for entry in entries:
                 f.write(json.dumps(entry, sort_keys=True, separators=(",", ":")) + "\n")
 
-    def analyze(self, core_records: list[dict[str, Any]]) -> list[dict[str, Any]]:
-        """Produces agent-local entries that explicitly project to S1-S7."""
+    def analyze(self, core_records: Iterable[Mapping[str, Any]] | CoreIndex) -> list[dict[str, Any]]:
+        """Produces agent-local entries that explicitly project to S1-S7.
+
+        `core_records` is iterated once, so `CoreDataset.iter_records()` and
+        `CoreColumns` work as well as a loaded list; a `CoreIndex` answers
+        each rule by lookup instead of a scan.
+        """
         entries: list[dict[str, Any]] = []
+        if isinstance(core_records, CoreIndex):
+            patch_claims = core_records.lookup("S1", "CORE-0002")
+        else:
+            patch_claims = [r for r in core_records if r["S1"] == "CORE-0002"]
 
         if self.agent_id == "agent_alpha":
             # Alpha: agrees vulnerability exists and claims patch is effective.
-            for r in core_records:
-                if r["S1"] == "CORE-0002":
-                    projection = dict(r)
-                    _validate_projection(projection)
-                    entries.append(
-                        {
-                            "agent_id": self.agent_id,
-                            "kind": "analysis",
-                            "projection": projection,
-                            "local": {
-                                "assessment": "patch likely effective",
-                                "confidence": 0.62,
-                                "evidence": ["release notes mention fix"],
-                            },
-                        }
-                    )
+            for r in patch_claims:
+                projection = dict(r)
+                _validate_projection(projection)
+                entries.append(
+                    {
+                        "agent_id": self.agent_id,
+                        "kind": "analysis",
+                        "projection": projection,
+                        "local": {
+                            "assessment": "patch likely effective",
+                            "confidence": 0.62,
+                            "evidence": ["release notes mention fix"],
+                        },
+                    }
+                )
 
         if self.agent_id == "agent_beta":
             # Beta: disputes that the patch fully resolves the issue.
-            for r in core_records:
-                if r["S1"] == "CORE-0002":
-                    projection = dict(r)
-                    _validate_projection(projection)
-                    entries.append(
-                        {
-                            "agent_id": self.agent_id,
-                            "kind": "analysis",
-                            "projection": projection,
-                            "local": {
-                                "assessment": "patch may be incomplete",
-                                "confidence": 0.71,
-                                "evidence": ["independent reproduction after patch"],
-                                "repro": {
-                                    "steps": ["install v2.1.3", "run fuzz harness", "observe crash"],
-                                    "artifact": "crashlog-42.txt",
-                                },
+            for r in patch_claims:
+                projection = dict(r)
+                _validate_projection(projection)
+                entries.append(
+                    {
+                        "agent_id": self.agent_id,
+                        "kind": "analysis",
+                        "projection": projection,
+                        "local": {
+                            "assessment": "patch may be incomplete",
+                            "confidence": 0.71,
+                            "evidence": ["independent reproduction after patch"],
+                            "repro": {
+                                "steps": ["install v2.1.3", "run fuzz harness", "observe crash"],
+                                "artifact": "crashlog-42.txt",
                             },
-                        }
-                    )
+                        },
+                    }
+                )
 
         return entries
@@ -3,9 +3,9 @@ from __future__ import annotations
 import json
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator
 
-from .core import CORE_KEYS, load_jsonl
+from .core import CORE_KEYS, iter_jsonl
 
 
 class AggregationError(ValueError):
@@ -33,15 +33,20 @@ def project_entry(entry: dict[str, Any]) -> dict[str, Any]:
 
 @dataclass(frozen=True)
 class Aggregator:
+    def iter_agent_entries(self, path: Path) -> Iterator[dict[str, Any]]:
+        return iter_jsonl(path)
+
     def read_agent_entries(self, path: Path) -> list[dict[str, Any]]:
-        return load_jsonl(path)
+        return list(self.iter_agent_entries(path))
 
-    def aggregate(self, agent_entry_paths: Iterable[Path]) -> list[dict[str, Any]]:
-        out: list[dict[str, Any]] = []
+    def iter_aggregate(self, agent_entry_paths: Iterable[Path]) -> Iterator[dict[str, Any]]:
+        """Projected entries streamed file by file; pair with `write_jsonl` for constant memory."""
         for p in agent_entry_paths:
-            for entry in self.read_agent_entries(p):
-                out.append(project_entry(entry))
-        return out
+            for entry in self.iter_agent_entries(p):
+                yield project_entry(entry)
+
+    def aggregate(self, agent_entry_paths: Iterable[Path]) -> list[dict[str, Any]]:
+        return list(self.iter_aggregate(agent_entry_paths))
 
 
 def write_jsonl(path: Path, rows: Iterable[dict[str, Any]]) -> None:
@@ -12,6 +12,7 @@ from urllib.parse import parse_qs, urlparse
 from .aggregate import Aggregator, write_jsonl
 from .agents import ProjectionError
 from .core import CoreDataset, compute_file_sha256
+from .merkle import MANIFEST_NAME, ROOT_PIN_NAME, read_pin
 from .safefs import SandboxFS, SandboxViolation
 
 
@@ -80,7 +81,15 @@ class ApiState:
         return self.config.core_hash_path.read_text(encoding="utf-8").strip().split()[0]
 
     def core_dataset(self) -> CoreDataset:
-        return CoreDataset(path=self.config.core_path, expected_sha256=self.expected_core_sha256())
+        merkle_path = self.config.core_hash_path.with_name(MANIFEST_NAME)
+        root_pin_path = self.config.core_hash_path.with_name(ROOT_PIN_NAME)
+        pinned = merkle_path.exists() and root_pin_path.exists()
+        return CoreDataset(
+            path=self.config.core_path,
+            expected_sha256=self.expected_core_sha256(),
+            merkle_path=merkle_path if pinned else None,
+            expected_merkle_root=read_pin(root_pin_path) if pinned else None,
+        )
 
     def authenticate(self, handler: BaseHTTPRequestHandler) -> str:
         """Return principal name for a valid bearer token."""
@@ -95,10 +104,13 @@ class ApiState:
 
     def agent_fs(self, agent_id: str) -> SandboxFS:
         agents_root = self.config.data_dir / "agents"
+        if agent_id in {"", ".", ".."} or Path(agent_id).name != agent_id:
+            raise SandboxViolation(f"Invalid agent id: {agent_id!r}")
         allowed = agents_root / agent_id
-        # Deny writes into core, and deny escaping into sibling agents (best-effort).
-        # Core deny is sufficient for the main safety claim; sibling denies help catch mistakes.
-        deny_roots = (self.config.core_path.parent, agents_root)
+        # Writes must stay under `allowed`, which already excludes every sibling agent,
+        # including ones created later. agents_root itself cannot be denied: it contains
+        # `allowed`. Deny core explicitly, in case it is ever placed under data_dir.
+        deny_roots = (self.config.core_path.parent,)
         return SandboxFS(allowed_root=allowed, deny_roots=deny_roots)
 
 
@@ -133,9 +145,23 @@ def make_handler(state: ApiState):
 
                 if path == "/v1/core/records":
                     # Any authenticated principal may read core.
+                    records, _ = state.core_dataset().load_verified()
+                    _json_response(self, 200, {"records": records})
+                    return
+
+                if path == "/v1/core/proof":
+                    # GET /v1/core/proof?line=N -> inclusion proof for 0-based core line N.
                     core = state.core_dataset()
-                    core.verify_immutable()
-                    _json_response(self, 200, {"records": core.load()})
+                    if core.merkle_path is None:
+                        _json_response(self, 404, {"error": "not_found", "message": "No pinned Merkle manifest for core"})
+                        return
+                    try:
+                        line_no = int(parse_qs(parsed.query).get("line", [""])[0])
+                        proof = core.merkle_manifest().prove(core.path, line_no)
+                    except (ValueError, IndexError) as e:
+                        _json_response(self, 400, {"error": "bad_request", "message": str(e)})
+                        return
+                    _json_response(self, 200, proof.to_dict())
                     return
 
                 if path == "/v1/aggregate":
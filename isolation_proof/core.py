@@ -2,10 +2,16 @@ from __future__ import annotations
 
 import hashlib
 import json
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Callable, Iterable, Iterator
 
+from .merkle import MerkleManifest
 
 CORE_KEYS = ("S1", "S2", "S3", "S4", "S5", "S6", "S7")
 
@@ -22,8 +28,8 @@ def compute_file_sha256(path: Path) -> str:
     return h.hexdigest()
 
 
-def load_jsonl(path: Path) -> list[dict]:
-    rows: list[dict] = []
+def iter_jsonl(path: Path) -> Iterator[dict]:
+    """Yield one parsed object per non-blank line, reading the file lazily."""
     with path.open("r", encoding="utf-8") as f:
         for line_no, line in enumerate(f, start=1):
             line = line.strip()
@@ -33,33 +39,427 @@ def load_jsonl(path: Path) -> list[dict]:
                 obj = json.loads(line)
             except json.JSONDecodeError as e:
                 raise ValueError(f"Invalid JSON on line {line_no} of {path}: {e}") from e
-            rows.append(obj)
-    return rows
+            yield obj
+
+
+def load_jsonl(path: Path) -> list[dict]:
+    return list(iter_jsonl(path))
+
 
+def validate_core_record(rec: Mapping[str, Any], idx: int) -> None:
+    missing = [k for k in CORE_KEYS if k not in rec]
+    extra = [k for k in rec.keys() if k not in CORE_KEYS]
+    if missing or extra:
+        raise CoreSchemaError(
+            f"Core record {idx} violates schema; missing={missing}, extra={extra}"
+        )
 
-def validate_core_records(records: Iterable[dict]) -> None:
+
+def validate_core_records(records: Iterable[Mapping[str, Any]]) -> None:
     for idx, rec in enumerate(records):
-        missing = [k for k in CORE_KEYS if k not in rec]
-        extra = [k for k in rec.keys() if k not in CORE_KEYS]
-        if missing or extra:
-            raise CoreSchemaError(
-                f"Core record {idx} violates schema; missing={missing}, extra={extra}"
-            )
+        validate_core_record(rec, idx)
+
+
+# On finalize, an all-string column becomes a string blob if it holds more
+# than this many distinct values and those make up over half of its rows.
+DICTIONARY_LIMIT = 4096
+
+
+class _Column:
+    """One S-column: dictionary codes (low cardinality) or a UTF-8 blob with offsets."""
+
+    __slots__ = ("key", "codes", "values", "lookup", "all_str", "blob", "offsets")
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.codes: array | None = array("B")
+        self.values: list[Any] = []
+        self.lookup: dict[Any, int] | None = {}
+        # Checked once per distinct value, so finalize() need not rescan them.
+        self.all_str = True
+        self.blob: bytearray | None = None
+        self.offsets: array | None = None
+
+    def append(self, value: Any) -> None:
+        if self.offsets is not None:
+            if type(value) is not str:
+                raise CoreSchemaError(f"Core column {self.key} mixes strings with {type(value).__name__} values")
+            self.blob += value.encode("utf-8")  # type: ignore[operator]
+            self.offsets.append(len(self.blob))  # type: ignore[arg-type]
+            return
+        code = self.lookup.get(value)  # type: ignore[union-attr]
+        if code is None:
+            code = self.lookup[value] = len(self.values)  # type: ignore[index]
+            self.values.append(value)
+            if type(value) is not str:
+                self.all_str = False
+            if code > 0xFF and self.codes.typecode == "B":  # type: ignore[union-attr]
+                self.codes = array("H", self.codes)  # type: ignore[arg-type]
+            elif code > 0xFFFF and self.codes.typecode == "H":  # type: ignore[union-attr]
+                self.codes = array("I", self.codes)  # type: ignore[arg-type]
+        self.codes.append(code)  # type: ignore[union-attr]
+
+    def finalize(self) -> None:
+        """Pack a mostly-unique all-string column into a blob; one pass, at most once."""
+        if self.offsets is not None or not self.all_str:
+            return
+        if len(self.values) <= DICTIONARY_LIMIT or len(self.values) * 2 <= len(self.codes):  # type: ignore[arg-type]
+            return
+        encoded = [v.encode("utf-8") for v in self.values]
+        blob = bytearray()
+        offsets = array("Q", [0])
+        for code in self.codes:  # type: ignore[union-attr]
+            blob += encoded[code]
+            offsets.append(len(blob))
+        self.blob, self.offsets = blob, offsets
+        self.codes, self.values, self.lookup = None, [], None
+
+    def __getitem__(self, idx: int) -> Any:
+        if self.offsets is not None:
+            return self.blob[self.offsets[idx] : self.offsets[idx + 1]].decode("utf-8")  # type: ignore[index]
+        return self.values[self.codes[idx]]  # type: ignore[index]
+
+
+class CoreRow(Mapping):
+    """Read-only record view over `CoreColumns`; values are decoded on access."""
+
+    __slots__ = ("_columns", "_idx")
+
+    def __init__(self, columns: "CoreColumns", idx: int) -> None:
+        self._columns = columns
+        self._idx = idx
+
+    def __getitem__(self, key: str) -> Any:
+        column = self._columns._by_key.get(key)  # pylint: disable=protected-access
+        if column is None:
+            raise KeyError(key)
+        return column[self._idx]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(CORE_KEYS)
+
+    def __len__(self) -> int:
+        return len(CORE_KEYS)
+
+    def __repr__(self) -> str:
+        return f"CoreRow({dict(self)!r})"
+
+
+class CoreColumns(Sequence):
+    """The core stored column by column instead of one dict per record.
+
+    Low-cardinality columns keep a code per row (1-4 bytes) into a list of
+    distinct values; `finalize` packs columns that turned out mostly unique
+    strings (S1, free text) into one UTF-8 blob with offsets. Rows appended
+    after that extend the blob. Indexing returns `CoreRow`
+    views, so anything that reads records as Mappings - `Agent.analyze`,
+    `CoreIndex.build`, the validators - works on it unchanged.
+    """
+
+    def __init__(self) -> None:
+        self._by_key = {k: _Column(k) for k in CORE_KEYS}
+        self._len = 0
+
+    @staticmethod
+    def from_records(records: Iterable[Mapping[str, Any]]) -> "CoreColumns":
+        """Build from validated records, consuming them one at a time."""
+        columns = CoreColumns()
+        for rec in records:
+            columns.append(rec)
+        return columns.finalize()
+
+    def finalize(self) -> "CoreColumns":
+        """Choose each column's final encoding once all rows are in; returns self."""
+        for column in self._by_key.values():
+            column.finalize()
+        return self
+
+    def append(self, rec: Mapping[str, Any]) -> None:
+        for k, column in self._by_key.items():
+            column.append(rec[k])
+        self._len += 1
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, idx):  # type: ignore[no-untyped-def]
+        if isinstance(idx, slice):
+            return [CoreRow(self, i) for i in range(*idx.indices(self._len))]
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError("core row index out of range")
+        return CoreRow(self, idx)
+
+    def column(self, key: str) -> list[Any]:
+        """All values of one S-column, in row order."""
+        column = self._by_key[key]
+        return [column[i] for i in range(self._len)]
+
+
+_INDEX_MAGIC = b"COREIDX1"
+_INDEX_HEADER = struct.Struct("<8s32sQ")
+_KEY_HEADER = struct.Struct("<QQ")
+
+
+def _read_uint32s(data: bytes, pos: int, count: int) -> array:
+    values = array("I")
+    values.frombytes(data[pos : pos + count * values.itemsize])
+    if len(values) != count:
+        raise ValueError("truncated core index")
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+@dataclass(frozen=True)
+class _Postings:
+    """Rows grouped by value: with g = codes[v], rows[starts[g]:starts[g + 1]] hold v, in core order."""
+
+    codes: dict[Any, int]
+    starts: array
+    rows: array
+
+
+@dataclass(frozen=True)
+class CoreIndex:
+    """Postings over validated core records: S1 -> one row, any other S-key -> its rows.
+
+    Postings hold positions into `records`, so the index is only meaningful
+    for the records of the core whose verified hash is `core_sha256`.
+
+    Sidecar layout (see `save`): magic, raw sha256, row count, then for each
+    of CORE_KEYS the JSON list of its distinct values, the group starts and
+    the grouped rows as little endian uint32. Loading is a JSON decode per
+    key plus array copies, with no per-row Python work.
+    """
+
+    core_sha256: str
+    records: Sequence[Mapping[str, Any]]
+    postings: Mapping[str, _Postings]
+
+    @staticmethod
+    def build(records: Sequence[Mapping[str, Any]], *, core_sha256: str) -> "CoreIndex":
+        groups: dict[str, dict[Any, list[int]]] = {k: {} for k in CORE_KEYS}
+        for idx, rec in enumerate(records):
+            for k in CORE_KEYS:
+                groups[k].setdefault(rec[k], []).append(idx)
+        duplicates = [v for v, rows in groups["S1"].items() if len(rows) > 1]
+        if duplicates:
+            raise CoreSchemaError(f"Core S1 values must be unique; duplicates={duplicates}")
+        postings: dict[str, _Postings] = {}
+        for k, by_value in groups.items():
+            starts, rows = array("I", [0]), array("I")
+            for members in by_value.values():
+                rows.extend(members)
+                starts.append(len(rows))
+            postings[k] = _Postings(codes=dict(zip(by_value, range(len(by_value)))), starts=starts, rows=rows)
+        return CoreIndex(core_sha256=core_sha256, records=records, postings=postings)
+
+    @staticmethod
+    def load(path: Path, records: Sequence[Mapping[str, Any]], *, core_sha256: str) -> "CoreIndex | None":
+        """Read a sidecar written by `save`; None if it is missing, damaged or for another core."""
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            magic, raw_sha, count = _INDEX_HEADER.unpack_from(data, 0)
+            if magic != _INDEX_MAGIC or raw_sha.hex() != core_sha256 or count != len(records):
+                return None
+            pos = _INDEX_HEADER.size
+            postings: dict[str, _Postings] = {}
+            for k in CORE_KEYS:
+                json_len, distinct = _KEY_HEADER.unpack_from(data, pos)
+                pos += _KEY_HEADER.size
+                values = json.loads(data[pos : pos + json_len])
+                pos += json_len
+                starts = _read_uint32s(data, pos, distinct + 1)
+                pos += len(starts) * starts.itemsize
+                rows = _read_uint32s(data, pos, count)
+                pos += len(rows) * rows.itemsize
+                if len(values) != distinct or starts[-1] != count:
+                    return None
+                postings[k] = _Postings(codes=dict(zip(values, range(distinct))), starts=starts, rows=rows)
+        except (struct.error, ValueError, TypeError):
+            return None
+        if pos != len(data):
+            return None
+        return CoreIndex(core_sha256=core_sha256, records=records, postings=postings)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, bytes.fromhex(self.core_sha256), len(self.records)))
+            for k in CORE_KEYS:
+                postings = self.postings[k]
+                values = json.dumps(list(postings.codes), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                f.write(_KEY_HEADER.pack(len(values), len(postings.codes)))
+                f.write(values)
+                for column in (postings.starts, postings.rows):
+                    if sys.byteorder != "little":
+                        column = array("I", column)
+                        column.byteswap()
+                    column.tofile(f)
+        os.replace(tmp, path)
+
+    def get(self, s1: Any) -> Mapping[str, Any] | None:
+        """The record whose S1 is `s1`, or None."""
+        postings = self.postings["S1"]
+        code = postings.codes.get(s1)
+        return None if code is None else self.records[postings.rows[postings.starts[code]]]
+
+    def lookup(self, key: str, value: Any) -> list[Mapping[str, Any]]:
+        """All records with `key == value`, in core order."""
+        if key not in self.postings:
+            raise KeyError(f"{key!r} is not a core key; expected one of {CORE_KEYS}")
+        postings = self.postings[key]
+        code = postings.codes.get(value)
+        if code is None:
+            return []
+        return [self.records[idx] for idx in postings.rows[postings.starts[code] : postings.starts[code + 1]]]
 
 
 @dataclass(frozen=True)
 class CoreDataset:
     path: Path
     expected_sha256: str
+    merkle_path: Path | None = None
+    expected_merkle_root: str | None = None
+    index_dir: Path | None = None
 
-    def verify_immutable(self) -> None:
-        actual = compute_file_sha256(self.path)
+    def _check_digest(self, actual: str) -> None:
         if actual != self.expected_sha256:
             raise AssertionError(
                 f"Core hash mismatch for {self.path}. expected={self.expected_sha256} actual={actual}"
             )
 
-    def load(self) -> list[dict]:
-        records = load_jsonl(self.path)
-        validate_core_records(records)
+    def verify_immutable(self) -> str:
+        """Re-hash the core file; returns the digest, which equals the pinned one."""
+        actual = compute_file_sha256(self.path)
+        self._check_digest(actual)
+        return actual
+
+    def merkle_manifest(self) -> MerkleManifest:
+        """The chunk manifest next to the core, accepted only if its root is `expected_merkle_root`."""
+        if self.merkle_path is None or self.expected_merkle_root is None:
+            raise FileNotFoundError(f"No pinned Merkle manifest configured for {self.path}")
+        manifest = MerkleManifest.load(self.merkle_path)
+        if manifest.root != self.expected_merkle_root:
+            raise AssertionError(
+                f"Merkle root mismatch for {self.merkle_path}. "
+                f"expected={self.expected_merkle_root} actual={manifest.root}"
+            )
+        return manifest
+
+    def verify_chunks(self, chunks: Iterable[int] | None = None, *, workers: int | None = None) -> str:
+        """Verify `chunks` (default: all) against the Merkle manifest on `workers` threads; returns its root."""
+        manifest = self.merkle_manifest()
+        manifest.verify(self.path, chunks, workers=workers)
+        return manifest.root
+
+    def read_verified(self, start: int, stop: int) -> list[dict]:
+        """Validated records for lines [start, stop), verifying only the chunks they live in."""
+        manifest = self.merkle_manifest()
+        stop = min(stop, manifest.lines)
+        if start >= stop:
+            return []
+        records: list[dict] = []
+        line_no = manifest.chunks[manifest.chunk_for_line(start)].first_line
+        for index in range(manifest.chunk_for_line(start), manifest.chunk_for_line(stop - 1) + 1):
+            data = manifest.read_chunk(self.path, index)
+            for raw in data.split(b"\n")[: manifest.chunks[index].lines]:
+                if start <= line_no < stop and raw.strip():
+                    try:
+                        rec = json.loads(raw)
+                    except ValueError as e:
+                        raise ValueError(f"Invalid JSON on line {line_no + 1} of {self.path}: {e}") from e
+                    validate_core_record(rec, line_no)
+                    records.append(rec)
+                line_no += 1
         return records
+
+    def index(self, records: Sequence[Mapping[str, Any]] | None = None, *, digest: str | None = None) -> CoreIndex:
+        """A `CoreIndex` over `records` (default: `load_verified()`).
+
+        Records passed in must come with the `digest` that `load_verified`
+        or `load_columns_verified` returned for them. With `index_dir`, the
+        index is kept in `core-<digest>.index` there, so a changed core never
+        picks up postings built for other bytes.
+        """
+        if records is None:
+            records, digest = self.load_verified()
+        elif digest is None:
+            raise ValueError("records passed to index() need the digest they were verified against")
+        index_file = self.index_dir / f"core-{digest}.index" if self.index_dir is not None else None
+        if index_file is not None:
+            index = CoreIndex.load(index_file, records, core_sha256=digest)
+            if index is not None:
+                return index
+        index = CoreIndex.build(records, core_sha256=digest)
+        if index_file is not None:
+            index.save(index_file)
+        return index
+
+    def _read_verified(self, append: Callable[[dict], None]) -> str:
+        h = hashlib.sha256()
+        count = 0
+        error: ValueError | None = None
+        with self.path.open("rb") as f:
+            for line_no, raw in enumerate(f, start=1):
+                h.update(raw)
+                if error is not None:
+                    continue
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    try:
+                        obj = json.loads(line)
+                    except ValueError as e:
+                        raise ValueError(f"Invalid JSON on line {line_no} of {self.path}: {e}") from e
+                    validate_core_record(obj, count)
+                    append(obj)
+                except ValueError as e:
+                    error = e
+                    continue
+                count += 1
+        actual = h.hexdigest()
+        self._check_digest(actual)
+        if error is not None:
+            raise error
+        return actual
+
+    def load_verified(self) -> tuple[list[dict], str]:
+        """Parse and validate the core while hashing the same bytes, in one read.
+
+        Returns (records, digest) only if the digest matches the pinned hash;
+        otherwise raises AssertionError and no records are returned. A hash
+        mismatch is reported ahead of any JSON or schema error, since it
+        means the parse saw something other than the pinned core.
+        """
+        records: list[dict] = []
+        return records, self._read_verified(records.append)
+
+    def load_columns_verified(self) -> tuple[CoreColumns, str]:
+        """Like `load_verified`, but packs records into `CoreColumns` as they are parsed."""
+        columns = CoreColumns()
+        digest = self._read_verified(columns.append)
+        return columns.finalize(), digest
+
+    def iter_records(self) -> Iterator[dict]:
+        """Validated core records, one at a time (constant memory for any core size).
+
+        A schema or JSON error is raised when the offending row is reached,
+        after the rows before it have been yielded.
+        """
+        for idx, rec in enumerate(iter_jsonl(self.path)):
+            validate_core_record(rec, idx)
+            yield rec
+
+    def load(self) -> list[dict]:
+        return list(self.iter_records())
+
+    def load_columns(self) -> CoreColumns:
+        return CoreColumns.from_records(self.iter_records())
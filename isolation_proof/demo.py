@@ -7,7 +7,7 @@ from pathlib import Path
 
 from .aggregate import Aggregator, write_jsonl
 from .agents import Agent
-from .core import CoreDataset, compute_file_sha256
+from .core import CoreDataset
 from .safefs import SandboxFS, SandboxViolation
 
 
@@ -21,11 +21,11 @@ def run(out_dir: Path) -> dict:
     core_hash_path = repo_root / "isolation_proof" / "core" / "core.sha256"
 
     expected = _read_expected_hash(core_hash_path)
-    core = CoreDataset(path=core_path, expected_sha256=expected)
+    # The index sidecar lives with the demo output; the core directory stays read-only.
+    core = CoreDataset(path=core_path, expected_sha256=expected, index_dir=out_dir / "index")
 
-    # Baseline proof anchor.
-    before = compute_file_sha256(core_path)
-    core_records = core.load()
+    # Baseline proof anchor: the records are parsed from exactly the bytes that were hashed.
+    core_records, before = core.load_columns_verified()
 
     agents_root = out_dir / "agents"
     alpha_root = agents_root / "agent_alpha"
@@ -40,8 +40,9 @@ def run(out_dir: Path) -> dict:
         fs=SandboxFS(allowed_root=beta_root, deny_roots=(core_path.parent, alpha_root)),
     )
 
-    alpha_entries = alpha.analyze(core_records)
-    beta_entries = beta.analyze(core_records)
+    index = core.index(core_records, digest=before)
+    alpha_entries = alpha.analyze(index)
+    beta_entries = beta.analyze(index)
 
     alpha.write_entries_jsonl("entries.jsonl", alpha_entries)
     beta.write_entries_jsonl("entries.jsonl", beta_entries)
@@ -63,8 +64,7 @@ def run(out_dir: Path) -> dict:
         violations.append(f"beta->core blocked: {e}")
 
     # Verify core immutability.
-    core.verify_immutable()
-    after = compute_file_sha256(core_path)
+    after = core.verify_immutable()
 
     aggregator = Aggregator()
     aggregated = aggregator.aggregate(
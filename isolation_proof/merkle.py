@@ -0,0 +1,397 @@
+"""Chunked Merkle manifest for the core: parallel, partial verification and inclusion proofs.
+
+The core is cut into line-aligned chunks of about `chunk_bytes`, and each
+chunk into line-aligned blocks of about `block_bytes`. Block hashes are the
+leaves of a per-chunk tree; the chunk roots are the leaves of the top tree.
+The manifest (`core.merkle.json`, next to `core.sha256`) lists every chunk's
+byte range, line range and root, so a reader can verify just the chunks it
+reads, a full check hashes chunks on several threads (hashlib releases the
+GIL for block-sized buffers), and a single record can be proven with its
+block plus two short sibling paths.
+
+The manifest itself is not trusted: anyone who can change the core can
+rewrite it. The root is pinned separately in `core.merkle.root`, written
+together with `core.sha256` and held to the same standard, and manifests
+and proofs are only accepted against that pin. Everything a reader relies
+on is under that root: each block leaf carries the number of its first line
+within the chunk, and each top-tree leaf carries its chunk's byte range and
+line range, so neither can be edited in the manifest or a proof.
+
+Hashes are domain-separated as in RFC 6962: leaf = H(0x00 || line || block),
+chunk leaf = H(0x02 || offset || length || first_line || lines || chunk root),
+node = H(0x01 || left || right), integers as 8-byte big-endian; an odd node
+is carried up unchanged.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterable
+
+MANIFEST_NAME = "core.merkle.json"
+ROOT_PIN_NAME = "core.merkle.root"
+DEFAULT_CHUNK_BYTES = 1024 * 1024
+DEFAULT_BLOCK_BYTES = 4096
+
+
+def read_pin(path: Path) -> str:
+    """The hex digest in a `<digest>  <file>` pin file such as core.sha256."""
+    return path.read_text(encoding="utf-8").strip().split()[0]
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+_LINE = struct.Struct(">Q")
+_SPAN = struct.Struct(">QQQQ")
+
+
+def leaf_hash(block: bytes, line: int) -> bytes:
+    """Leaf for `block`, whose first line is line `line` of its chunk."""
+    h = hashlib.sha256(b"\x00" + _LINE.pack(line))
+    h.update(block)
+    return h.digest()
+
+
+def chunk_leaf(offset: int, length: int, first_line: int, lines: int, root: bytes) -> bytes:
+    return hashlib.sha256(b"\x02" + _SPAN.pack(offset, length, first_line, lines) + root).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def merkle_root(leaves: list[bytes]) -> bytes:
+    if not leaves:
+        return hashlib.sha256(b"").digest()
+    level = leaves
+    while len(level) > 1:
+        nxt = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+
+def merkle_path(leaves: list[bytes], index: int) -> list[tuple[str, bytes]]:
+    """Siblings from leaf `index` up to the root, each tagged with the side it sits on."""
+    path: list[tuple[str, bytes]] = []
+    level = leaves
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            path.append(("left" if sibling < index else "right", level[sibling]))
+        nxt = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+        index //= 2
+    return path
+
+
+def climb(node: bytes, path: Iterable[tuple[str, bytes]]) -> bytes:
+    for side, sibling in path:
+        node = node_hash(sibling, node) if side == "left" else node_hash(node, sibling)
+    return node
+
+
+def block_ends(chunk: bytes, block_bytes: int) -> list[int]:
+    """End offsets (exclusive) of the line-aligned blocks of `chunk`."""
+    ends: list[int] = []
+    pos = 0
+    while pos < len(chunk):
+        nl = chunk.find(b"\n", pos + block_bytes - 1)
+        pos = len(chunk) if nl < 0 else nl + 1
+        ends.append(pos)
+    return ends
+
+
+def _block_leaves(chunk: bytes, block_bytes: int) -> tuple[list[bytes], list[int]]:
+    ends = block_ends(chunk, block_bytes)
+    view = memoryview(chunk)
+    leaves = []
+    line = 0
+    for start, end in zip([0, *ends], ends):
+        leaves.append(leaf_hash(view[start:end], line))  # type: ignore[arg-type]
+        line += chunk.count(b"\n", start, end)
+    return leaves, ends
+
+
+def _count_lines(chunk: bytes) -> int:
+    return chunk.count(b"\n") + (1 if chunk and not chunk.endswith(b"\n") else 0)
+
+
+def _chunk_bounds(path: Path, chunk_bytes: int) -> list[tuple[int, int]]:
+    """Line-aligned (offset, length) chunks: each starts at the first line at or after k * chunk_bytes."""
+    size = path.stat().st_size
+    starts = [0]
+    with path.open("rb") as f:
+        for target in range(chunk_bytes, size, chunk_bytes):
+            if target <= starts[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()
+            boundary = f.tell()
+            if starts[-1] < boundary < size:
+                starts.append(boundary)
+    return [(start, end - start) for start, end in zip(starts, [*starts[1:], size])] if size else []
+
+
+def _read_range(path: Path, offset: int, length: int) -> bytes:
+    with path.open("rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) != length:
+        raise AssertionError(f"Core {path} is shorter than its Merkle manifest")
+    return data
+
+
+@dataclass(frozen=True)
+class Chunk:
+    offset: int
+    length: int
+    first_line: int
+    lines: int
+    root: str
+
+    def leaf(self) -> bytes:
+        """This chunk's leaf in the top tree, binding its ranges to its root."""
+        return chunk_leaf(self.offset, self.length, self.first_line, self.lines, bytes.fromhex(self.root))
+
+
+@dataclass(frozen=True)
+class InclusionProof:
+    """Everything needed to check that `record` is line `line_no` of the core with Merkle `root`."""
+
+    line_no: int
+    record: str
+    block: str
+    block_line: int
+    line_in_block: int
+    chunk: int
+    chunk_span: tuple[int, int, int, int]
+    block_path: list[tuple[str, str]]
+    chunk_path: list[tuple[str, str]]
+    root: str
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_dict(raw: dict) -> "InclusionProof":
+        return InclusionProof(
+            line_no=raw["line_no"],
+            record=raw["record"],
+            block=raw["block"],
+            block_line=raw["block_line"],
+            line_in_block=raw["line_in_block"],
+            chunk=raw["chunk"],
+            chunk_span=tuple(raw["chunk_span"]),  # type: ignore[arg-type]
+            block_path=[(side, h) for side, h in raw["block_path"]],
+            chunk_path=[(side, h) for side, h in raw["chunk_path"]],
+            root=raw["root"],
+        )
+
+    def verify(self, root: str) -> bool:
+        """Whether this proof ties `record` to `root`, which must come from the pin, not the proof."""
+        # Lines end at b"\n" only, as in `prove`; str.splitlines would also split on \r, \x85, U+2028...
+        lines = self.block.split("\n")
+        if self.block.endswith("\n"):
+            lines.pop()
+        if not 0 <= self.line_in_block < len(lines) or lines[self.line_in_block].rstrip("\r") != self.record:
+            return False
+        # block_line and chunk_span are hashed into the leaves below, so `line_no` only passes if the root agrees.
+        offset, length, first_line, count = self.chunk_span
+        if first_line + self.block_line + self.line_in_block != self.line_no or self.line_no >= first_line + count:
+            return False
+        node = leaf_hash(self.block.encode("utf-8"), self.block_line)
+        node = climb(node, ((side, bytes.fromhex(h)) for side, h in self.block_path))
+        node = chunk_leaf(offset, length, first_line, count, node)
+        node = climb(node, ((side, bytes.fromhex(h)) for side, h in self.chunk_path))
+        return node.hex() == root == self.root
+
+
+@dataclass(frozen=True)
+class MerkleManifest:
+    core_sha256: str
+    size: int
+    chunk_bytes: int
+    block_bytes: int
+    root: str
+    chunks: tuple[Chunk, ...]
+
+    @staticmethod
+    def build(
+        core_path: Path,
+        *,
+        core_sha256: str,
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+        block_bytes: int = DEFAULT_BLOCK_BYTES,
+        workers: int | None = None,
+    ) -> "MerkleManifest":
+        """Hash `core_path` chunk by chunk on `workers` threads.
+
+        `core_sha256` is the pinned whole-file hash; the file is re-hashed
+        first and AssertionError is raised if it does not match, so a root
+        is only ever issued for the pinned core.
+        """
+        if chunk_bytes < 1 or block_bytes < 1:
+            raise ValueError("chunk_bytes and block_bytes must be >= 1")
+        actual = _file_sha256(core_path)
+        if actual != core_sha256:
+            raise AssertionError(
+                f"Refusing to build a Merkle manifest for {core_path}: expected={core_sha256} actual={actual}"
+            )
+        bounds = _chunk_bounds(core_path, chunk_bytes)
+
+        def hash_chunk(bound: tuple[int, int]) -> tuple[bytes, int]:
+            data = _read_range(core_path, *bound)
+            leaves, _ = _block_leaves(data, block_bytes)
+            return merkle_root(leaves), _count_lines(data)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashed = list(pool.map(hash_chunk, bounds))
+        first_lines = [0, *accumulate(lines for _, lines in hashed)]
+
+        chunks = [
+            Chunk(offset=offset, length=length, first_line=first_line, lines=lines, root=root.hex())
+            for (offset, length), first_line, (root, lines) in zip(bounds, first_lines, hashed)
+        ]
+        return MerkleManifest(
+            core_sha256=core_sha256,
+            size=sum(length for _, length in bounds),
+            chunk_bytes=chunk_bytes,
+            block_bytes=block_bytes,
+            root=merkle_root([c.leaf() for c in chunks]).hex(),
+            chunks=tuple(chunks),
+        )
+
+    @staticmethod
+    def load(path: Path) -> "MerkleManifest":
+        """Load a manifest and check that its chunk roots add up to its root."""
+        raw = json.loads(path.read_text(encoding="utf-8"))
+        manifest = MerkleManifest(
+            core_sha256=raw["core_sha256"],
+            size=raw["size"],
+            chunk_bytes=raw["chunk_bytes"],
+            block_bytes=raw["block_bytes"],
+            root=raw["root"],
+            chunks=tuple(Chunk(**chunk) for chunk in raw["chunks"]),
+        )
+        if merkle_root([c.leaf() for c in manifest.chunks]).hex() != manifest.root:
+            raise AssertionError(f"Merkle manifest {path} is inconsistent with its own root")
+        return manifest
+
+    def save(self, path: Path) -> None:
+        payload = asdict(self)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(payload, sort_keys=True, indent=1) + "\n", encoding="utf-8")
+        os.replace(tmp, path)
+
+    @property
+    def lines(self) -> int:
+        return self.chunks[-1].first_line + self.chunks[-1].lines if self.chunks else 0
+
+    def chunk_for_line(self, line_no: int) -> int:
+        if not 0 <= line_no < self.lines:
+            raise IndexError(f"Line {line_no} is outside the core (0..{self.lines - 1})")
+        return bisect_right([c.first_line for c in self.chunks], line_no) - 1
+
+    def read_chunk(self, core_path: Path, index: int) -> bytes:
+        """The bytes of chunk `index`, after checking them against its pinned root."""
+        chunk = self.chunks[index]
+        data = _read_range(core_path, chunk.offset, chunk.length)
+        leaves, _ = _block_leaves(data, self.block_bytes)
+        if merkle_root(leaves).hex() != chunk.root or _count_lines(data) != chunk.lines:
+            raise AssertionError(f"Core chunk {index} of {core_path} does not match its Merkle root")
+        return data
+
+    def verify(self, core_path: Path, chunks: Iterable[int] | None = None, *, workers: int | None = None) -> None:
+        """Check `chunks` (default: all of them) in parallel; raises AssertionError on any mismatch."""
+        indexes = range(len(self.chunks)) if chunks is None else sorted(set(chunks))
+        if chunks is None and core_path.stat().st_size != self.size:
+            raise AssertionError(f"Core {core_path} size differs from its Merkle manifest")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(lambda i: self.read_chunk(core_path, i), indexes):
+                pass
+
+    def prove(self, core_path: Path, line_no: int) -> InclusionProof:
+        """Inclusion proof for line `line_no` (0-based); its chunk is verified first."""
+        index = self.chunk_for_line(line_no)
+        chunk = self.chunks[index]
+        data = self.read_chunk(core_path, index)
+
+        start = 0
+        for _ in range(line_no - chunk.first_line):
+            start = data.index(b"\n", start) + 1
+        end = data.find(b"\n", start)
+        end = len(data) if end < 0 else end + 1
+
+        leaves, ends = _block_leaves(data, self.block_bytes)
+        block_index = bisect_right(ends, start)
+        block_start = ends[block_index - 1] if block_index else 0
+        block = data[block_start : ends[block_index]]
+        line_in_block = block[: start - block_start].count(b"\n")
+        return InclusionProof(
+            line_no=line_no,
+            record=data[start:end].rstrip(b"\r\n").decode("utf-8"),
+            block=block.decode("utf-8"),
+            block_line=line_no - chunk.first_line - line_in_block,
+            line_in_block=line_in_block,
+            chunk=index,
+            chunk_span=(chunk.offset, chunk.length, chunk.first_line, chunk.lines),
+            block_path=[(side, h.hex()) for side, h in merkle_path(leaves, block_index)],
+            chunk_path=[(side, h.hex()) for side, h in merkle_path([c.leaf() for c in self.chunks], index)],
+            root=self.root,
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or verify the core's Merkle manifest")
+    parser.add_argument("command", choices=("build", "verify"))
+    parser.add_argument("--core", type=str, default=None, help="Default: isolation_proof/core/core.jsonl")
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    parser.add_argument("--block-bytes", type=int, default=DEFAULT_BLOCK_BYTES)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    core_path = Path(args.core) if args.core else Path(__file__).resolve().parent / "core" / "core.jsonl"
+    manifest_path = core_path.with_name(MANIFEST_NAME)
+    root_pin_path = core_path.with_name(ROOT_PIN_NAME)
+    pinned = read_pin(core_path.with_name("core.sha256"))
+
+    if args.command == "build":
+        manifest = MerkleManifest.build(
+            core_path,
+            core_sha256=pinned,
+            chunk_bytes=args.chunk_bytes,
+            block_bytes=args.block_bytes,
+            workers=args.workers,
+        )
+        manifest.save(manifest_path)
+        root_pin_path.write_text(f"{manifest.root}  {core_path.name}\n", encoding="utf-8")
+    else:
+        manifest = MerkleManifest.load(manifest_path)
+        if manifest.root != read_pin(root_pin_path):
+            raise SystemExit(f"{manifest_path} does not match the root pinned in {root_pin_path}")
+        manifest.verify(core_path, workers=args.workers)
+    print(f"root={manifest.root} chunks={len(manifest.chunks)} lines={manifest.lines}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,23 @@
 from __future__ import annotations
 
+import json
 import tempfile
+import threading
+import tracemalloc
 import unittest
+import urllib.error
+import urllib.request
+from dataclasses import replace
+from unittest import mock
+from http.server import ThreadingHTTPServer
 from pathlib import Path
 
+from isolation_proof.api import ApiConfig, ApiState, make_handler
+from isolation_proof.agents import Agent
+from isolation_proof.core import CORE_KEYS, CoreColumns, CoreDataset, CoreIndex, CoreSchemaError, compute_file_sha256, iter_jsonl
 from isolation_proof.demo import run
+from isolation_proof.merkle import MANIFEST_NAME, ROOT_PIN_NAME, InclusionProof, MerkleManifest, merkle_root
+from isolation_proof.safefs import SandboxViolation
 
 
 class TestIsolationProof(unittest.TestCase):
@@ -24,6 +37,349 @@ class TestIsolationProof(unittest.TestCase):
         self.assertGreaterEqual(result["agent_beta_entries"], 1)
         self.assertEqual(result["aggregate_entries"], result["agent_alpha_entries"] + result["agent_beta_entries"])
 
+    def test_api_agent_writes_land_in_own_sandbox(self) -> None:
+        repo_root = Path(__file__).resolve().parents[1]
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_api_") as td:
+            data_dir = Path(td)
+            config = ApiConfig(
+                core_path=repo_root / "isolation_proof" / "core" / "core.jsonl",
+                core_hash_path=repo_root / "isolation_proof" / "core" / "core.sha256",
+                data_dir=data_dir,
+                tokens={"agent_alpha": "ta", "agent_beta": "tb"},
+            )
+            httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(ApiState(config=config)))
+            thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+            thread.start()
+            try:
+                base = f"http://127.0.0.1:{httpd.server_address[1]}"
+                for agent, token in (("agent_alpha", "ta"), ("agent_beta", "tb")):
+                    req = urllib.request.Request(
+                        f"{base}/v1/agents/{agent}/entries",
+                        data=json.dumps({"projection": {"S1": agent}}).encode("utf-8"),
+                        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+                        method="POST",
+                    )
+                    with urllib.request.urlopen(req) as resp:
+                        self.assertEqual(resp.status, 201)
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+
+            for agent in ("agent_alpha", "agent_beta"):
+                lines = (data_dir / "agents" / agent / "entries.jsonl").read_text(encoding="utf-8").splitlines()
+                self.assertEqual([json.loads(line)["projection"]["S1"] for line in lines], [agent])
+
+    def test_agent_sandbox_denies_siblings_created_later_and_core(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_api_") as td:
+            data_dir = Path(td) / "data"
+            core_dir = data_dir / "core"
+            state = ApiState(
+                config=ApiConfig(
+                    core_path=core_dir / "core.jsonl",
+                    core_hash_path=core_dir / "core.sha256",
+                    data_dir=data_dir,
+                    tokens={},
+                )
+            )
+            fs = state.agent_fs("agent_alpha")
+            # The sibling does not exist yet when the sandbox is built.
+            (data_dir / "agents" / "agent_beta").mkdir(parents=True)
+            with fs.open_text_for_write("entries.jsonl") as f:
+                f.write("{}\n")
+            for rel in ("../agent_beta/entries.jsonl", "../agent_gamma/entries.jsonl", "../../core/core.jsonl"):
+                with self.subTest(rel=rel), self.assertRaises(SandboxViolation):
+                    fs.open_text_for_write(rel)
+            for agent_id in ("..", ".", "", "agent_alpha/../agent_beta"):
+                with self.subTest(agent_id=agent_id), self.assertRaises(SandboxViolation):
+                    state.agent_fs(agent_id)
+
+    def test_iter_records_validates_rows_as_they_stream(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_test_") as td:
+            path = Path(td) / "core.jsonl"
+            good = {k: f"{k}-value" for k in CORE_KEYS}
+            path.write_text(
+                json.dumps(good) + "\n\n" + json.dumps({**good, "S8": "extra"}) + "\n{not json\n", encoding="utf-8"
+            )
+            core = CoreDataset(path=path, expected_sha256=compute_file_sha256(path))
+
+            records = core.iter_records()
+            self.assertEqual(next(records), good)
+            with self.assertRaisesRegex(CoreSchemaError, r"Core record 1 .*extra=\['S8'\]"):
+                next(records)
+            with self.assertRaises(CoreSchemaError):
+                core.load()
+
+            rows = iter_jsonl(path)
+            self.assertEqual([next(rows), next(rows)], [good, {**good, "S8": "extra"}])
+            with self.assertRaisesRegex(ValueError, "Invalid JSON on line 4"):
+                next(rows)
+
+    def test_load_verified_hashes_the_bytes_it_parses(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_test_") as td:
+            path = Path(td) / "core.jsonl"
+            good = {k: f"{k}-value" for k in CORE_KEYS}
+            path.write_text(json.dumps(good) + "\n", encoding="utf-8")
+            digest = compute_file_sha256(path)
+
+            records, actual = CoreDataset(path=path, expected_sha256=digest).load_verified()
+            self.assertEqual((records, actual), ([good], digest))
+            self.assertEqual(CoreDataset(path=path, expected_sha256=digest).verify_immutable(), digest)
+
+            # Tampering is reported as a hash mismatch, even when it also breaks parsing.
+            with path.open("a", encoding="utf-8") as f:
+                f.write("{tampered\n")
+            with self.assertRaisesRegex(AssertionError, "Core hash mismatch"):
+                CoreDataset(path=path, expected_sha256=digest).load_verified()
+            with self.assertRaisesRegex(ValueError, "Invalid JSON on line 2"):
+                CoreDataset(path=path, expected_sha256=compute_file_sha256(path)).load_verified()
+
+    def test_merkle_manifest_verifies_touched_chunks_and_proves_records(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_test_") as td:
+            path = Path(td) / "core.jsonl"
+            rows = [{k: f"{k}-{i}" for k in CORE_KEYS} for i in range(200)]
+            path.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+            digest = compute_file_sha256(path)
+            manifest = MerkleManifest.build(path, core_sha256=digest, chunk_bytes=2048, block_bytes=300, workers=4)
+            self.assertGreater(len(manifest.chunks), 4)
+            self.assertEqual(manifest.lines, 200)
+            # Chunk layout does not depend on how many threads hashed it.
+            self.assertEqual(MerkleManifest.build(path, core_sha256=digest, chunk_bytes=2048, block_bytes=300, workers=1), manifest)
+
+            manifest_path = Path(td) / MANIFEST_NAME
+            manifest.save(manifest_path)
+            core = CoreDataset(
+                path=path, expected_sha256=digest, merkle_path=manifest_path, expected_merkle_root=manifest.root
+            )
+            self.assertEqual(core.verify_chunks(), manifest.root)
+            self.assertEqual(core.read_verified(98, 103), rows[98:103])
+
+            proof = InclusionProof.from_dict(json.loads(json.dumps(manifest.prove(path, 123).to_dict())))
+            self.assertEqual(json.loads(proof.record), rows[123])
+            self.assertTrue(proof.verify(manifest.root))
+            self.assertFalse(InclusionProof.from_dict({**proof.to_dict(), "line_in_block": proof.line_in_block + 1}).verify(manifest.root))
+
+            # Line numbers are authenticated by the root: relabelling a proof or shifting
+            # chunk line ranges in the manifest is rejected, with or without a fixed-up root.
+            raw = proof.to_dict()
+            for forged_proof in (
+                {**raw, "line_no": 126},
+                {**raw, "line_no": 126, "block_line": raw["block_line"] + 3},
+                {**raw, "line_no": 126, "chunk_span": [*raw["chunk_span"][:2], raw["chunk_span"][2] + 3, raw["chunk_span"][3]]},
+            ):
+                self.assertFalse(InclusionProof.from_dict(forged_proof).verify(manifest.root))
+            shifted = replace(
+                manifest, chunks=(manifest.chunks[0], *(replace(c, first_line=c.first_line + 3) for c in manifest.chunks[1:]))
+            )
+            shifted.save(manifest_path)
+            with self.assertRaisesRegex(AssertionError, "inconsistent with its own root"):
+                core.read_verified(30, 31)
+            replace(shifted, root=merkle_root([c.leaf() for c in shifted.chunks]).hex()).save(manifest_path)
+            with self.assertRaisesRegex(AssertionError, "Merkle root mismatch"):
+                core.read_verified(30, 31)
+            manifest.save(manifest_path)
+
+            # Tamper with one byte in the last chunk: only reads that touch it fail.
+            data = bytearray(path.read_bytes())
+            data[-10] ^= 0x01
+            path.write_bytes(bytes(data))
+            last = len(manifest.chunks) - 1
+            core.verify_chunks(range(last))
+            self.assertEqual(core.read_verified(0, 5), rows[:5])
+            with self.assertRaisesRegex(AssertionError, f"chunk {last} "):
+                core.verify_chunks()
+            with self.assertRaisesRegex(AssertionError, "does not match its Merkle root"):
+                core.read_verified(195, 200)
+
+            # A manifest regenerated for the tampered core, claiming the pinned sha256, is
+            # refused at build time and, if forged by hand, rejected against the pinned root.
+            with self.assertRaisesRegex(AssertionError, "Refusing to build"):
+                MerkleManifest.build(path, core_sha256=digest, chunk_bytes=2048, block_bytes=300)
+            forged = MerkleManifest.build(path, core_sha256=compute_file_sha256(path), chunk_bytes=2048, block_bytes=300)
+            replace(forged, core_sha256=digest).save(manifest_path)
+            with self.assertRaisesRegex(AssertionError, "Merkle root mismatch"):
+                core.read_verified(195, 200)
+            with self.assertRaises(FileNotFoundError):
+                CoreDataset(path=path, expected_sha256=digest, merkle_path=manifest_path).verify_chunks()
+
+    def test_inclusion_proof_lines_end_at_newline_only(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_test_") as td:
+            path = Path(td) / "core.jsonl"
+            # Raw U+2028, U+0085 and \r inside values are line breaks to str.splitlines, not to the core.
+            rows = [{**{k: f"{k}-{i}" for k in CORE_KEYS}, "S7": f"a\u2028b\x85c {i}"} for i in range(6)]
+            path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows), encoding="utf-8")
+            manifest = MerkleManifest.build(path, core_sha256=compute_file_sha256(path), block_bytes=1 << 20)
+            for line_no in range(6):
+                proof = manifest.prove(path, line_no)
+                self.assertEqual(json.loads(proof.record), rows[line_no])
+                self.assertEqual(proof.line_in_block, line_no)
+                self.assertTrue(proof.verify(manifest.root))
+
+    def test_core_index_lookups_and_sidecar(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_test_") as td:
+            path = Path(td) / "core.jsonl"
+            rows = [
+                {**{k: f"{k}-x" for k in CORE_KEYS}, "S1": f"CORE-{i:04d}", "S3": "has_vulnerability" if i % 2 else "patched_in"}
+                for i in range(1, 6)
+            ]
+            path.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+            digest = compute_file_sha256(path)
+            index_dir = Path(td) / "index"
+            core = CoreDataset(path=path, expected_sha256=digest, index_dir=index_dir)
+
+            index = core.index()
+            self.assertEqual(index.get("CORE-0002"), rows[1])
+            self.assertIsNone(index.get("CORE-9999"))
+            self.assertEqual(index.lookup("S3", "has_vulnerability"), [rows[0], rows[2], rows[4]])
+            self.assertEqual(index.lookup("S2", "S2-x"), rows)
+            self.assertEqual(index.lookup("S3", "missing"), [])
+            with self.assertRaises(KeyError):
+                index.lookup("S8", "x")
+            self.assertEqual([p.name for p in index_dir.iterdir()], [f"core-{digest}.index"])
+
+            # The sidecar is reused for the same verified hash instead of rebuilt.
+            with mock.patch.object(CoreIndex, "build", side_effect=AssertionError("rebuilt")):
+                reused = core.index(rows, digest=digest)
+            for k in CORE_KEYS:
+                self.assertEqual(reused.postings[k], index.postings[k])
+            with self.assertRaises(ValueError):
+                core.index(rows)
+            # A damaged sidecar is rebuilt.
+            (index_dir / f"core-{digest}.index").write_bytes(b"COREIDX1")
+            self.assertEqual(core.index(rows, digest=digest).lookup("S3", "patched_in"), [rows[1], rows[3]])
+
+            # Once the core changes (and is re-pinned), its index is keyed by the new hash,
+            # so postings built for the old bytes are never used.
+            changed = [rows[0], {**rows[1], "S3": "has_vulnerability"}, *rows[2:]]
+            path.write_text("".join(json.dumps(r) + "\n" for r in changed), encoding="utf-8")
+            new_digest = compute_file_sha256(path)
+            with self.assertRaisesRegex(AssertionError, "Core hash mismatch"):
+                core.index()
+            repinned = CoreDataset(path=path, expected_sha256=new_digest, index_dir=index_dir)
+            self.assertEqual(repinned.index().lookup("S3", "patched_in"), [changed[3]])
+            self.assertTrue((index_dir / f"core-{new_digest}.index").exists())
+
+            alpha = Agent(agent_id="agent_alpha", fs=mock.Mock())
+            self.assertEqual(alpha.analyze(index), alpha.analyze(rows))
+            with self.assertRaisesRegex(CoreSchemaError, "duplicates"):
+                CoreIndex.build(rows + rows[:1], core_sha256="x")
+
+    def test_core_columns_match_records_in_a_fraction_of_the_memory(self) -> None:
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_test_") as td:
+            path = Path(td) / "core.jsonl"
+            with path.open("w", encoding="utf-8") as f:
+                for i in range(10000):
+                    row = {
+                        "S1": f"CORE-{i:07d}",
+                        "S2": f"acme.pkg{i % 300}",
+                        "S3": ("has_vulnerability", "patched_in", "affected_versions")[i % 3],
+                        "S4": f"CVE-2025-{i % 9000}",
+                        "S5": ("vendor_advisory", "release_notes")[i % 2],
+                        "S6": f"2025-12-{i % 28 + 1:02d}T12:00:00Z",
+                        "S7": f"Note {i} about the \u00e9cosyst\u00e8me.",
+                    }
+                    f.write(json.dumps(row) + "\n")
+            core = CoreDataset(path=path, expected_sha256=compute_file_sha256(path))
+
+            tracemalloc.start()
+            try:
+                records, digest = core.load_verified()
+                dict_bytes = tracemalloc.get_traced_memory()[0]
+                del records
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                columns, columns_digest = core.load_columns_verified()
+                column_bytes = tracemalloc.get_traced_memory()[0] - base
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(columns_digest, digest)
+            self.assertLess(column_bytes * 8, dict_bytes)
+
+            records = core.load()
+            self.assertEqual(len(columns), len(records))
+            self.assertEqual([dict(r) for r in columns], records)
+            self.assertEqual(columns[-1], records[-1])
+            self.assertEqual(columns.column("S3")[:3], ["has_vulnerability", "patched_in", "affected_versions"])
+            self.assertEqual(CoreIndex.build(columns, core_sha256=digest).lookup("S4", "CVE-2025-7"), records[7::9000])
+            self.assertEqual(
+                Agent(agent_id="agent_beta", fs=mock.Mock()).analyze(core.load_columns()),
+                Agent(agent_id="agent_beta", fs=mock.Mock()).analyze(records),
+            )
+            with self.assertRaises(KeyError):
+                columns[0]["S8"]
+
+            # A mostly-unique column that is not all strings stays dictionary-encoded. Its
+            # type is tracked per distinct value, so this builds in linear time.
+            mixed = CoreColumns.from_records([{**records[0], "S1": i} for i in range(30000)] + records[:1])
+            self.assertEqual(mixed.column("S1")[-2:], [29999, records[0]["S1"]])
+            # Once S1 is a blob, later rows must keep to strings.
+            columns.append(records[0])
+            self.assertEqual(dict(columns[-1]), records[0])
+            with self.assertRaisesRegex(CoreSchemaError, "mixes strings"):
+                columns.append({**records[0], "S1": 1})
+
+    def test_api_serves_core_inclusion_proofs(self) -> None:
+        repo_root = Path(__file__).resolve().parents[1]
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_api_") as td:
+            core_dir = Path(td) / "core"
+            core_dir.mkdir()
+            for name in ("core.jsonl", "core.sha256"):
+                (core_dir / name).write_bytes((repo_root / "isolation_proof" / "core" / name).read_bytes())
+            config = ApiConfig(
+                core_path=core_dir / "core.jsonl",
+                core_hash_path=core_dir / "core.sha256",
+                data_dir=Path(td) / "data",
+                tokens={"core_reader": "tr"},
+            )
+            httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(ApiState(config=config)))
+            thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+            thread.start()
+
+            def get(query: str) -> tuple[int, dict]:
+                req = urllib.request.Request(
+                    f"http://127.0.0.1:{httpd.server_address[1]}/v1/core/proof?{query}",
+                    headers={"Authorization": "Bearer tr"},
+                )
+                try:
+                    with urllib.request.urlopen(req) as resp:
+                        return resp.status, json.loads(resp.read())
+                except urllib.error.HTTPError as e:
+                    return e.code, json.loads(e.read())
+
+            try:
+                self.assertEqual(get("line=0")[0], 404)
+                manifest = MerkleManifest.build(
+                    config.core_path, core_sha256=ApiState(config=config).expected_core_sha256(), chunk_bytes=256
+                )
+                manifest.save(core_dir / MANIFEST_NAME)
+                # A manifest without a pinned root is not served.
+                self.assertEqual(get("line=0")[0], 404)
+                (core_dir / ROOT_PIN_NAME).write_text(f"{manifest.root}  core.jsonl\n", encoding="utf-8")
+                status, body = get("line=1")
+                self.assertEqual(status, 200)
+                self.assertTrue(InclusionProof.from_dict(body).verify(manifest.root))
+                self.assertEqual(get(f"line={manifest.lines}")[0], 400)
+                self.assertEqual(get("line=x")[0], 400)
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+
+    def test_demo_reads_core_twice(self) -> None:
+        core_path = (Path(__file__).resolve().parent / "core" / "core.jsonl").resolve()
+        original_open = Path.open
+        reads: list[Path] = []
+
+        def counting_open(self: Path, *args, **kwargs):  # type: ignore[no-untyped-def]
+            if self.resolve() == core_path:
+                reads.append(self)
+            return original_open(self, *args, **kwargs)
+
+        with tempfile.TemporaryDirectory(prefix="isolation_proof_test_") as td, mock.patch.object(
+            Path, "open", counting_open
+        ):
+            result = run(Path(td))
+        self.assertEqual(result["core_sha256_before"], result["core_sha256_after"])
+        self.assertEqual(len(reads), 2)
+
 
 if __name__ == "__main__":
     unittest.main()